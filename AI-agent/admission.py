@@ -0,0 +1,299 @@
+"""
+Admission control for LLM calls.
+
+Two layers protect the Gemini quota:
+
+- Rate limits: a token bucket per business and per sender, checked when a
+  message arrives. Buckets live in-process by default; with a SQLite URL
+  they are shared by the workers of one host (each check is one short
+  write transaction), and with a Redis URL by all workers on any host (as
+  fixed windows of `burst` requests per burst/rate seconds, since plain
+  Redis commands can't refill a bucket atomically).
+- Concurrency: a per-process limit on in-flight LLM calls. Callers that
+  can't get a slot wait in per-business FIFO queues that are served
+  round-robin, so a burst from one business can't starve the others. A
+  caller that waits longer than `queue_timeout` is turned away, and the
+  agent sends a canned reply instead of timing out.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class LocalRateLimiter:
+    """In-process token buckets, LRU-capped on the number of keys"""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        # key -> [tokens, last refill]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(burst), now]
+                while len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return True
+            return False
+
+
+class RedisRateLimiter:
+    """Fixed-window counters shared across workers through Redis"""
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    def allow(self, key, rate, burst):
+        window = max(1, int(round(burst / rate)))
+        redis_key = f"{self.prefix}{key}:{int(time.time() // window)}"
+        count, _ = self.client.pipeline([('INCR', redis_key), ('EXPIRE', redis_key, window * 2)])
+        return count <= burst
+
+
+class SQLiteRateLimiter:
+    """Token buckets in a SQLite file, shared by the worker processes of one host"""
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, path='agent_state.db', idle_ttl=3600.0):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._conn().execute('''
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def allow(self, key, rate, burst):
+        conn = self._conn()
+        now = time.time()
+        # IMMEDIATE takes the write lock up front, so the read-refill-write below is atomic across processes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE bucket_key = ?', (key,)).fetchone()
+            tokens = float(burst) if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+            allowed = tokens >= 1.0
+            conn.execute('INSERT OR REPLACE INTO rate_buckets (bucket_key, tokens, updated_at) VALUES (?, ?, ?)',
+                         (key, tokens - 1.0 if allowed else tokens, now))
+            if now - self._last_sweep >= self.SWEEP_INTERVAL:
+                self._last_sweep = now
+                conn.execute('DELETE FROM rate_buckets WHERE updated_at < ?', (now - self.idle_ttl,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed
+
+
+class _Waiter:
+    __slots__ = ('business_id', 'event', 'future', 'loop', 'granted')
+
+    def __init__(self, business_id, loop=None):
+        self.business_id = business_id
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+        self.granted = False
+
+    def wake(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionController:
+    """Rate limits per business/sender plus a fair, bounded wait for LLM slots"""
+
+    def __init__(self, max_concurrency=16, queue_timeout=2.0, max_queued_per_business=50,
+                 business_rate=5.0, business_burst=20, sender_rate=0.5, sender_burst=5, limiter=None):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_queued_per_business = max_queued_per_business
+        self.business_rate = business_rate
+        self.business_burst = business_burst
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.limiter = limiter or LocalRateLimiter()
+
+        self._lock = threading.Lock()
+        self._active = 0
+        # business_id -> deque of waiters; OrderedDict order is the round-robin order
+        self._queues = OrderedDict()
+
+        self.admitted = Counter()
+        self.rate_limited_business = Counter()
+        self.rate_limited_sender = Counter()
+        self.rejected_overload = Counter()
+        self.in_flight = Gauge()
+        self.queued = Gauge()
+        self.queue_wait = Histogram()
+
+    def check_rate(self, business_id, sender):
+        """Return None if the message may proceed, else 'sender' or 'business'"""
+        try:
+            if self.sender_rate > 0 and sender and \
+                    not self.limiter.allow(f"sender:{business_id or ''}:{sender}", self.sender_rate, self.sender_burst):
+                self.rate_limited_sender.inc()
+                return 'sender'
+            if self.business_rate > 0 and \
+                    not self.limiter.allow(f"business:{business_id or ''}", self.business_rate, self.business_burst):
+                self.rate_limited_business.inc()
+                return 'business'
+        except Exception as e:
+            # A shared limiter being down shouldn't take replies down with it
+            logger.error(f"Rate limiter unavailable, admitting message: {str(e)}")
+        return None
+
+    def _try_acquire(self, business_id, waiter):
+        """Take a slot now, or enqueue the waiter; returns True, False (queued) or None (queue full)"""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._queues:
+                self._active += 1
+                return True
+            queue = self._queues.get(business_id)
+            if queue is None:
+                queue = self._queues[business_id] = deque()
+            if len(queue) >= self.max_queued_per_business:
+                return None
+            queue.append(waiter)
+            self.queued.inc()
+            return False
+
+    def _cancel(self, waiter):
+        """Remove a waiter that gave up; returns True if it was granted a slot in the meantime"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            queue = self._queues.get(waiter.business_id)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                self.queued.dec()
+                if not queue:
+                    del self._queues[waiter.business_id]
+            return False
+
+    def _admitted(self, started):
+        self.admitted.inc()
+        self.in_flight.inc()
+        self.queue_wait.observe(time.perf_counter() - started)
+        return True
+
+    def acquire(self, business_id, timeout=None):
+        """Wait for an LLM slot (up to `timeout`, default queue_timeout); returns False when overloaded"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.perf_counter()
+        waiter = _Waiter(business_id)
+        taken = self._try_acquire(business_id, waiter)
+        if taken is None:
+            self.rejected_overload.inc()
+            return False
+        if taken or waiter.event.wait(timeout) or self._cancel(waiter):
+            return self._admitted(started)
+        self.rejected_overload.inc()
+        return False
+
+    async def acquire_async(self, business_id, timeout=None):
+        """Awaitable acquire for the ASGI app"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.perf_counter()
+        waiter = _Waiter(business_id, asyncio.get_running_loop())
+        taken = self._try_acquire(business_id, waiter)
+        if taken is None:
+            self.rejected_overload.inc()
+            return False
+        if not taken:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                if not self._cancel(waiter):
+                    self.rejected_overload.inc()
+                    return False
+            except asyncio.CancelledError:
+                # The request went away; don't leak a slot granted while it was being cancelled
+                if self._cancel(waiter):
+                    self.release(admitted=False)
+                raise
+        return self._admitted(started)
+
+    def release(self, admitted=True):
+        """Free a slot, handing it to the next business in round-robin order"""
+        if admitted:
+            self.in_flight.dec()
+        with self._lock:
+            if not self._queues:
+                self._active -= 1
+                return
+            business_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self.queued.dec()
+            # Move this business to the back so the next slot goes to someone else
+            del self._queues[business_id]
+            if queue:
+                self._queues[business_id] = queue
+            waiter.wake()
+
+    def stats(self):
+        with self._lock:
+            queues = {str(business_id): len(queue) for business_id, queue in self._queues.items()}
+            active = self._active
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": active,
+            "queued": queues,
+            "admitted": self.admitted.value,
+            "rate_limited_business": self.rate_limited_business.value,
+            "rate_limited_sender": self.rate_limited_sender.value,
+            "rejected_overload": self.rejected_overload.value,
+            "queue_wait": self.queue_wait.snapshot(),
+            "limiter": self.limiter.__class__.__name__
+        }
+
+
+def create_admission_controller(url='memory://', **kwargs):
+    """Build a controller whose rate limits are in-process (memory://) or shared (sqlite://, redis://)"""
+    if url.startswith('sqlite://'):
+        return AdmissionController(limiter=SQLiteRateLimiter(url[len('sqlite:///'):] or 'agent_state.db'), **kwargs)
+    if url.startswith('redis://'):
+        from redis_client import RedisClient
+        return AdmissionController(limiter=RedisRateLimiter(RedisClient(url)), **kwargs)
+    if url.startswith('memory://'):
+        return AdmissionController(**kwargs)
+    raise ValueError(f"Unsupported ADMISSION_STORE_URL: {url}")
@@ -0,0 +1,531 @@
+"""
+Per-business rollups over the daily message logs, updated incrementally.
+
+MessageAnalytics tails messages_YYYYMMDD.log from a background thread,
+reading only the complete lines appended since its last pass, and adds
+each entry to a fixed-size rollup per business and day:
+
+- incoming, outgoing and error messages per hour, in array('I') counters
+- unique senders: exact up to EXACT_SENDERS, then a HyperLogLog sketch
+  of 1024 one-byte registers (about 3% error)
+- reply latency, from a sender's message to the next reply to that
+  sender, in a sketch of logarithmic buckets that answers any percentile
+  within 2% of the true value
+
+Both sketches merge across days, so a query over a date range combines at
+most `retention_days` rollups however many messages were logged.
+
+Once a past day has been read to the end, its rollups and byte offset are
+written to analytics_YYYYMMDD.json in `state_dir`. A restarted process
+loads those instead of reparsing the logs, and keeps a day's rollups
+after its log file is removed. With `parquet_dir` set and pyarrow
+installed, each snapshotted day is also exported to Parquet, one row per
+business, for offline analysis.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta
+
+from metrics import Counter
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+_DAY = re.compile(r'(\d{8})\.(?:log|json)$')
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Senders counted exactly per rollup before switching to HyperLogLog
+EXACT_SENDERS = 128
+_REGISTER_BITS = 10
+_RANK_BITS = 64 - _REGISTER_BITS
+_RANK_MASK = (1 << _RANK_BITS) - 1
+_REGISTERS = 1 << _REGISTER_BITS
+_ALPHA = 0.7213 / (1 + 1.079 / _REGISTERS)
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(_RANK_BITS + 2)]
+
+# Latency buckets grow by GAMMA, so a bucket's midpoint is within 2% of anything in it
+_ACCURACY = 0.02
+_GAMMA = (1 + _ACCURACY) / (1 - _ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+_MIN_LATENCY = 0.001
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class SenderCounter:
+    """Distinct senders: a set of hashes, then HyperLogLog registers once it grows past EXACT_SENDERS"""
+
+    __slots__ = ('hashes', 'registers')
+
+    def __init__(self):
+        self.hashes = set()
+        self.registers = None
+
+    def add(self, sender):
+        self.add_hash(_hash(sender))
+
+    def add_hash(self, value):
+        if self.registers is None:
+            self.hashes.add(value)
+            if len(self.hashes) > EXACT_SENDERS:
+                self.registers = array('B', bytes(_REGISTERS))
+                for hashed in self.hashes:
+                    self._update(hashed)
+                self.hashes = set()
+        else:
+            self._update(value)
+
+    def _update(self, value):
+        index = value >> _RANK_BITS
+        rank = _RANK_BITS - (value & _RANK_MASK).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.registers is None:
+            for value in other.hashes:
+                self.add_hash(value)
+            return
+        if self.registers is None:
+            hashes = self.hashes
+            self.registers, self.hashes = array('B', other.registers), set()
+            for value in hashes:
+                self._update(value)
+        else:
+            # A comprehension is several times faster than map(max, ...) here
+            self.registers = array('B', [mine if mine >= theirs else theirs
+                                         for mine, theirs in zip(self.registers, other.registers)])
+
+    def count(self):
+        if self.registers is None:
+            return len(self.hashes)
+        estimate = _ALPHA * _REGISTERS * _REGISTERS / sum(map(_INVERSE_POWERS.__getitem__, self.registers))
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * _REGISTERS and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = _REGISTERS * math.log(_REGISTERS / zeros)
+        return round(estimate)
+
+    def to_dict(self):
+        if self.registers is None:
+            return {"hashes": sorted(self.hashes)}
+        return {"registers": base64.b64encode(self.registers.tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        counter = cls()
+        if "registers" in data:
+            counter.registers = array('B', base64.b64decode(data["registers"]))
+        else:
+            counter.hashes = set(data.get("hashes", ()))
+        return counter
+
+
+class LatencySketch:
+    """Counts per logarithmic bucket; percentiles within 2% relative error, mergeable"""
+
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, seconds):
+        index = math.ceil(math.log(max(seconds, _MIN_LATENCY)) / _LOG_GAMMA)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * _GAMMA ** index / (_GAMMA + 1)
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum,
+                "buckets": {str(index): count for index, count in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls()
+        sketch.buckets = {int(index): count for index, count in data.get("buckets", {}).items()}
+        sketch.count = data.get("count", 0)
+        sketch.sum = data.get("sum", 0.0)
+        return sketch
+
+
+class DayRollup:
+    """One business's messages on one day"""
+
+    __slots__ = ('incoming', 'outgoing', 'errors', 'senders', 'latency')
+
+    def __init__(self):
+        self.incoming = array('I', [0]) * 24
+        self.outgoing = array('I', [0]) * 24
+        self.errors = array('I', [0]) * 24
+        self.senders = SenderCounter()
+        self.latency = LatencySketch()
+
+    def to_dict(self):
+        return {"incoming": self.incoming.tolist(), "outgoing": self.outgoing.tolist(),
+                "errors": self.errors.tolist(), "senders": self.senders.to_dict(),
+                "latency": self.latency.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        rollup = cls()
+        for name in ('incoming', 'outgoing', 'errors'):
+            getattr(rollup, name)[:] = array('I', data.get(name, [0] * 24))
+        rollup.senders = SenderCounter.from_dict(data.get("senders", {}))
+        rollup.latency = LatencySketch.from_dict(data.get("latency", {}))
+        return rollup
+
+
+class MessageAnalytics:
+    """Hourly volume, unique senders, error rate and reply latency per business, tailed from the message logs"""
+
+    def __init__(self, directory='.', prefix='messages_', state_dir=None, retention_days=30, interval=10.0,
+                 parquet_dir=None, max_reply_wait=600.0, max_pending=100000):
+        self.directory = directory
+        self.prefix = prefix
+        self.state_dir = state_dir or directory
+        self.retention_days = retention_days
+        self.interval = interval
+        self.parquet_dir = parquet_dir
+        self.max_reply_wait = max_reply_wait
+        self.max_pending = max_pending
+        # day -> business_id -> DayRollup
+        self._rollups = {}
+        # day -> bytes of its log read so far; day -> offset its snapshot was written at
+        self._offsets = {}
+        self._saved = {}
+        # (business_id, sender) -> time of the oldest message not yet answered
+        self._waiting = {}
+        self._midnights = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._pass_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.caught_up = threading.Event()
+        self.updated_at = None
+        self.last_pass_time = 0.0
+
+        self.passes = Counter()
+        self.lines_read = Counter()
+        self.skipped = Counter()
+        self.snapshots_loaded = Counter()
+        self.snapshots_written = Counter()
+        self.parquet_written = Counter()
+
+        if parquet_dir and pyarrow is None:
+            logger.warning('ANALYTICS_PARQUET_DIR is set but pyarrow is not installed; Parquet export is off')
+        os.makedirs(self.state_dir or '.', exist_ok=True)
+        self._thread = None
+        if interval > 0:
+            self._thread = threading.Thread(target=self._run, name="message-analytics", daemon=True)
+            self._thread.start()
+
+    def path(self, day):
+        return os.path.join(self.directory, f"{self.prefix}{day}.log")
+
+    def snapshot_path(self, day):
+        return os.path.join(self.state_dir, f"analytics_{day}.json")
+
+    def _days(self, directory, prefix, since_day):
+        days = set()
+        for name in os.listdir(directory or '.'):
+            match = _DAY.search(name)
+            if name.startswith(prefix) and match and match.group(1) >= since_day:
+                days.add(match.group(1))
+        return days
+
+    def _seconds(self, timestamp):
+        """Seconds since 0001-01-01 of a naive ISO timestamp, without building a datetime per line"""
+        midnight = self._midnights.get(timestamp[:10])
+        if midnight is None:
+            midnight = self._midnights[timestamp[:10]] = date.fromisoformat(timestamp[:10]).toordinal() * 86400
+        return midnight + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + float(timestamp[17:])
+
+    def _add(self, day, entry):
+        """Count one log entry; called with the lock held"""
+        business_id = entry.get("business_id")
+        timestamp = entry.get("timestamp") or ''
+        try:
+            hour = int(timestamp[11:13])
+        except ValueError:
+            hour = None
+        if not business_id or hour is None:
+            self.skipped.inc()
+            return
+        business = self._rollups.get(day)
+        if business is None:
+            business = self._rollups[day] = {}
+        rollup = business.get(business_id)
+        if rollup is None:
+            rollup = business[business_id] = DayRollup()
+
+        direction = entry.get("direction")
+        key = (business_id, entry.get("phone_number"))
+        if direction == "incoming":
+            rollup.incoming[hour] += 1
+            rollup.senders.add(key[1] or '')
+            if key not in self._waiting:
+                if len(self._waiting) >= self.max_pending:
+                    self._expire(self._seconds(timestamp))
+                self._waiting[key] = self._seconds(timestamp)
+        elif direction == "outgoing":
+            rollup.outgoing[hour] += 1
+            started = self._waiting.pop(key, None)
+            if started is not None:
+                latency = self._seconds(timestamp) - started
+                if 0 <= latency <= self.max_reply_wait:
+                    rollup.latency.add(latency)
+        elif direction == "error":
+            # The fallback reply, if any, is logged as outgoing and closes the wait
+            rollup.errors[hour] += 1
+
+    def _expire(self, now):
+        """Forget messages that were never answered"""
+        cutoff = now - self.max_reply_wait
+        self._waiting = {key: started for key, started in self._waiting.items() if started >= cutoff}
+        while len(self._waiting) >= self.max_pending:
+            self._waiting.pop(next(iter(self._waiting)))
+
+    def _read_day(self, day):
+        """Add the complete lines appended to one day's log since the last pass; returns lines read"""
+        path = self.path(day)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+        offset = self._offsets.get(day, 0)
+        if size < offset:
+            # The file was replaced or truncated: rebuild this day
+            with self._lock:
+                self._rollups.pop(day, None)
+            self._saved.pop(day, None)
+            offset = 0
+        count = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while offset < size:
+                data = f.read(min(READ_CHUNK_SIZE, size - offset))
+                # A line still being written is picked up on the next pass
+                end = data.rfind(b'\n') + 1
+                if not end:
+                    break
+                entries = []
+                for line in data[:end].splitlines():
+                    try:
+                        entries.append(_loads(line))
+                    except ValueError:
+                        self.skipped.inc()
+                with self._lock:
+                    for entry in entries:
+                        self._add(day, entry)
+                    offset += end
+                    self._offsets[day] = offset
+                f.seek(offset)
+                count += len(entries)
+        return count
+
+    def _load_snapshots(self, since_day):
+        for day in sorted(self._days(self.state_dir, 'analytics_', since_day)):
+            try:
+                with open(self.snapshot_path(day), encoding='utf-8') as f:
+                    state = json.load(f)
+                rollups = {business_id: DayRollup.from_dict(data)
+                           for business_id, data in state.get("businesses", {}).items()}
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading analytics snapshot for {day}: {str(e)}")
+                continue
+            with self._lock:
+                self._rollups[day] = rollups
+                self._offsets[day] = self._saved[day] = state.get("offset", 0)
+            self.snapshots_loaded.inc()
+
+    def _save(self, day):
+        """Write a past day's rollups and log offset, so a restart doesn't reparse them"""
+        with self._lock:
+            offset = self._offsets.get(day, 0)
+            businesses = dict(self._rollups.get(day, {}))
+            state = {"day": day, "offset": offset,
+                     "businesses": {business_id: rollup.to_dict() for business_id, rollup in businesses.items()}}
+        path = self.snapshot_path(day)
+        # Workers sharing state_dir write the same content; each renames its own temporary file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(temporary, path)
+        self._saved[day] = offset
+        self.snapshots_written.inc()
+        if self.parquet_dir and pyarrow is not None:
+            try:
+                self._export_parquet(day, businesses)
+            except Exception as e:
+                logger.error(f"Error exporting analytics for {day} to Parquet: {str(e)}")
+
+    def _export_parquet(self, day, businesses):
+        rows = sorted(businesses.items())
+        table = pyarrow.table({
+            "day": [day] * len(rows),
+            "business_id": [business_id for business_id, _ in rows],
+            "incoming": [rollup.incoming.tolist() for _, rollup in rows],
+            "outgoing": [rollup.outgoing.tolist() for _, rollup in rows],
+            "errors": [rollup.errors.tolist() for _, rollup in rows],
+            "unique_senders": [rollup.senders.count() for _, rollup in rows],
+            "latency_count": [rollup.latency.count for _, rollup in rows],
+            "latency_p50": [rollup.latency.quantile(0.5) for _, rollup in rows],
+            "latency_p90": [rollup.latency.quantile(0.9) for _, rollup in rows],
+            "latency_p99": [rollup.latency.quantile(0.99) for _, rollup in rows],
+        })
+        os.makedirs(self.parquet_dir, exist_ok=True)
+        path = os.path.join(self.parquet_dir, f"analytics_{day}.parquet")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        pyarrow.parquet.write_table(table, temporary)
+        os.replace(temporary, path)
+        self.parquet_written.inc()
+
+    def catch_up(self):
+        """Read what was appended to the logs since the last pass; returns lines read"""
+        with self._pass_lock:
+            started = time.perf_counter()
+            now = datetime.now()
+            today = now.strftime('%Y%m%d')
+            first_day = (now - timedelta(days=self.retention_days - 1)).strftime('%Y%m%d')
+            with self._lock:
+                for day in [day for day in self._rollups if day < first_day]:
+                    del self._rollups[day]
+                    self._offsets.pop(day, None)
+                    self._saved.pop(day, None)
+            if not self._loaded:
+                self._load_snapshots(first_day)
+                self._loaded = True
+            count = 0
+            for day in sorted(self._days(self.directory, self.prefix, first_day)):
+                count += self._read_day(day)
+                if day < today and day in self._offsets and self._saved.get(day) != self._offsets[day]:
+                    self._save(day)
+            self.passes.inc()
+            self.lines_read.inc(count)
+            self.updated_at = time.time()
+            self.last_pass_time = time.perf_counter() - started
+            self.caught_up.set()
+            return count
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.catch_up()
+            except Exception as e:
+                logger.error(f"Error updating message analytics: {str(e)}")
+            self._stopping.wait(self.interval)
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+
+    def summary(self, business_id, days=7):
+        """Totals, unique senders, reply latency and hourly volume of a business over the last `days` days"""
+        days = max(1, min(days, self.retention_days))
+        today = date.today()
+        wanted = [(today - timedelta(days=offset)).strftime('%Y%m%d') for offset in range(days - 1, -1, -1)]
+        senders = SenderCounter()
+        latency = LatencySketch()
+        hourly = []
+        incoming = outgoing = errors = 0
+        with self._lock:
+            for day in wanted:
+                rollup = self._rollups.get(day, {}).get(business_id)
+                if rollup is None:
+                    continue
+                senders.merge(rollup.senders)
+                latency.merge(rollup.latency)
+                incoming += sum(rollup.incoming)
+                outgoing += sum(rollup.outgoing)
+                errors += sum(rollup.errors)
+                for hour in range(24):
+                    if rollup.incoming[hour] or rollup.outgoing[hour] or rollup.errors[hour]:
+                        hourly.append({"hour": f"{day[:4]}-{day[4:6]}-{day[6:]}T{hour:02d}:00",
+                                       "incoming": rollup.incoming[hour], "outgoing": rollup.outgoing[hour],
+                                       "errors": rollup.errors[hour]})
+        return {
+            "business_id": business_id,
+            "since": wanted[0],
+            "until": wanted[-1],
+            "days": days,
+            "incoming": incoming,
+            "outgoing": outgoing,
+            "errors": errors,
+            "error_rate": round(errors / incoming, 4) if incoming else 0.0,
+            "unique_senders": senders.count(),
+            "latency": {
+                "count": latency.count,
+                "mean": round(latency.sum / latency.count, 3) if latency.count else None,
+                **{name: round(value, 3) if value is not None else None
+                   for name, value in (("p50", latency.quantile(0.5)), ("p90", latency.quantile(0.9)),
+                                       ("p99", latency.quantile(0.99)))}
+            },
+            "hourly": hourly,
+            "catching_up": not self.caught_up.is_set(),
+            "updated_at": datetime.fromtimestamp(self.updated_at).isoformat() if self.updated_at else None
+        }
+
+    def stats(self):
+        with self._lock:
+            days = len(self._rollups)
+            rollups = sum(len(businesses) for businesses in self._rollups.values())
+            waiting = len(self._waiting)
+        return {
+            "directory": self.directory,
+            "state_dir": self.state_dir,
+            "parquet_dir": self.parquet_dir if pyarrow is not None else None,
+            "retention_days": self.retention_days,
+            "interval": self.interval,
+            "catching_up": not self.caught_up.is_set(),
+            "days": days,
+            "rollups": rollups,
+            "waiting_for_reply": waiting,
+            "passes": self.passes.value,
+            "lines_read": self.lines_read.value,
+            "skipped": self.skipped.value,
+            "last_pass_ms": round(self.last_pass_time * 1000, 1),
+            "snapshots_loaded": self.snapshots_loaded.value,
+            "snapshots_written": self.snapshots_written.value,
+            "parquet_written": self.parquet_written.value
+        }
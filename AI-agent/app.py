@@ -1,48 +1,213 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from twilio.twiml.messaging_response import MessagingResponse
-import google.generativeai as genai
+from flask import Blueprint, Flask, Response, g, request, jsonify, stream_with_context
 import os
-import requests
 from dotenv import load_dotenv
 import logging
 from datetime import datetime
 import json
+import threading
+import time
+import deadline
+import telemetry
+from admission import create_admission_controller
+from analytics import MessageAnalytics
+from backend_client import BackendClient
+from cluster import ClusterRouter
+from coalescer import MessageCoalescer
+from config_cache import ConfigCache
+from deadline import DeadlineExceeded, deadline_scope, with_deadline
+from conversation_sink import ConversationSink
+from conversation_store import create_conversation_store
+from history import HistoryTruncator, build_contents, compact_prompt
+from llm_providers import create_router
+from message_index import LineCounter, MessageLogIndex, encode_cursor, tail_lines
+from message_log import MessageLogWriter, start_queue_logging
+from metrics import Histogram
+from faq_index import FAQRegistry, format_entries, parse_numbered_faq
+from model_registry import ModelRegistry
+from response_cache import ResponseCache
+from shared_state import create_shared_state
+from token_ledger import TokenLedger, parse_budgets
+from twilio_webhook import SIGNATURE_HEADER, SignatureValidator, twiml_message
+from reply_dispatcher import TwilioReplySender, create_reply_dispatcher, EMPTY_TWIML
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging to file
+# Log to a daily file and the console; handlers are created per process by init_runtime()
 log_filename = f"ai_agent_{datetime.now().strftime('%Y%m%d')}.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename, encoding='utf-8'),
-        logging.StreamHandler()  # Also print to console
-    ]
-)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)
+# Import the Gemini/Cohere SDKs in create_app() rather than on each worker's first request;
+# with gunicorn --preload that happens once in the master and the workers share them
+PRELOAD_SDKS = os.getenv('PRELOAD_SDKS', 'false').lower() == 'true'
+
+# Message log (messages_YYYYMMDD.log): async (batched background writer), sync or off
+MESSAGE_LOG_MODE = os.getenv('MESSAGE_LOG_MODE', 'async').lower()
+MESSAGE_LOG_DIR = os.getenv('MESSAGE_LOG_DIR', '.')
+MESSAGE_LOG_BATCH_SIZE = int(os.getenv('MESSAGE_LOG_BATCH_SIZE', 256))
+MESSAGE_LOG_QUEUE_SIZE = int(os.getenv('MESSAGE_LOG_QUEUE_SIZE', 10000))
+# Sidecar SQLite index used by /messages for filtered and paginated queries
+MESSAGE_INDEX_PATH = os.getenv('MESSAGE_INDEX_PATH')
+MESSAGE_QUERY_MAX_LIMIT = int(os.getenv('MESSAGE_QUERY_MAX_LIMIT', 500))
+
+# Prometheus metrics at /metrics; business_id label values beyond the cap are reported as "other".
+# Tracing writes sampled per-request stage timings to traces_YYYYMMDD.log in TRACE_LOG_DIR
+METRICS_MAX_BUSINESSES = int(os.getenv('METRICS_MAX_BUSINESSES', 1000))
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'false').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+TRACE_LOG_DIR = os.getenv('TRACE_LOG_DIR', MESSAGE_LOG_DIR)
+
+# LLM providers in order of preference: gemini (SDK), gemini_rest, cohere; anything but plain
+# "gemini" goes through the latency-aware router
+LLM_PROVIDERS = [name.strip() for name in os.getenv('LLM_PROVIDERS', 'gemini').split(',') if name.strip()]
+LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+LLM_HEDGE_DELAY = float(os.getenv('LLM_HEDGE_DELAY', 2.0))
+# Threads for hedged calls; when all are busy a call goes to one provider without a hedge
+LLM_HEDGE_THREADS = int(os.getenv('LLM_HEDGE_THREADS', 32))
+LLM_ROUTER_EXPLORE = float(os.getenv('LLM_ROUTER_EXPLORE', 0.05))
+LLM_PROVIDER_COOLDOWN = float(os.getenv('LLM_PROVIDER_COOLDOWN', 30))
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', 10))
 
 # Initialize Gemini
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-else:
-    raise RuntimeError('GEMINI_API_KEY not set in environment')
+GEMINI_API_URL = os.getenv('GEMINI_API_URL', 'https://generativelanguage.googleapis.com')
+
+# Cohere configuration
+COHERE_API_KEY = os.getenv('COHERE_API_KEY')
+COHERE_MODEL = os.getenv('COHERE_MODEL', 'command')
 
 # Twilio configuration
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
+TWILIO_API_URL = os.getenv('TWILIO_API_URL', 'https://api.twilio.com')
+# Reject webhooks whose X-Twilio-Signature doesn't match (403); needs TWILIO_AUTH_TOKEN. Behind a proxy
+# or load balancer set the public base URL Twilio posts to, e.g. https://agent.example.com
+TWILIO_VALIDATE_SIGNATURE = os.getenv('TWILIO_VALIDATE_SIGNATURE', 'false').lower() == 'true'
+TWILIO_WEBHOOK_BASE_URL = os.getenv('TWILIO_WEBHOOK_BASE_URL')
+
+# Async reply mode: ack Twilio immediately and deliver the reply via the REST API
+ASYNC_REPLIES = os.getenv('ASYNC_REPLIES', 'false').lower() == 'true'
+ASYNC_REPLY_WORKERS = int(os.getenv('ASYNC_REPLY_WORKERS', 4))
+ASYNC_REPLY_QUEUE_SIZE = int(os.getenv('ASYNC_REPLY_QUEUE_SIZE', 100))
+# memory:// or sqlite:///path/to.db: a durable queue keyed by MessageSid that drops Twilio's retries,
+# survives restarts and retries failed replies with backoff; finished messages are kept for the retention
+ASYNC_REPLY_QUEUE_URL = os.getenv('ASYNC_REPLY_QUEUE_URL', 'memory://')
+ASYNC_REPLY_MAX_ATTEMPTS = int(os.getenv('ASYNC_REPLY_MAX_ATTEMPTS', 5))
+ASYNC_REPLY_RETRY_BACKOFF = float(os.getenv('ASYNC_REPLY_RETRY_BACKOFF', 2.0))
+ASYNC_REPLY_RETENTION = float(os.getenv('ASYNC_REPLY_RETENTION', 86400))
+
+# Coalescing: answer messages a sender sends within a short window with one reply
+COALESCE_ENABLED = os.getenv('COALESCE_ENABLED', 'false').lower() == 'true'
+COALESCE_WINDOW = float(os.getenv('COALESCE_WINDOW', 1.5))
+COALESCE_MAX_WAIT = float(os.getenv('COALESCE_MAX_WAIT', 5.0))
+
+# Request deadlines (seconds; 0 disables). Twilio gives up on a webhook after 15s.
+# The reserve is kept back to send the reply; config loads and summaries leave the LLM at least its min time
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 12))
+ASYNC_REPLY_DEADLINE = float(os.getenv('ASYNC_REPLY_DEADLINE', 60))
+DEADLINE_RESERVE = float(os.getenv('DEADLINE_RESERVE', 0.5))
+DEADLINE_LLM_MIN_TIME = float(os.getenv('DEADLINE_LLM_MIN_TIME', 4))
 
 # Backend API configuration
 BACKEND_API_URL = os.getenv('BACKEND_API_URL', 'http://localhost:5000')
 BACKEND_API_KEY = os.getenv('BACKEND_API_KEY')
+BACKEND_CONNECT_TIMEOUT = float(os.getenv('BACKEND_CONNECT_TIMEOUT', 3.05))
+BACKEND_READ_TIMEOUT = float(os.getenv('BACKEND_READ_TIMEOUT', 10))
+BACKEND_MAX_RETRIES = int(os.getenv('BACKEND_MAX_RETRIES', 2))
+BACKEND_POOL_SIZE = int(os.getenv('BACKEND_POOL_SIZE', 10))
+BACKEND_BREAKER_THRESHOLD = int(os.getenv('BACKEND_BREAKER_THRESHOLD', 5))
+BACKEND_BREAKER_RESET = float(os.getenv('BACKEND_BREAKER_RESET', 30))
+
+# Conversation persistence: batched background writes to the bulk endpoint, spooled to disk on failure
+PERSIST_ASYNC = os.getenv('PERSIST_ASYNC', 'true').lower() == 'true'
+PERSIST_BATCH_SIZE = int(os.getenv('PERSIST_BATCH_SIZE', 50))
+PERSIST_FLUSH_INTERVAL = float(os.getenv('PERSIST_FLUSH_INTERVAL', 1.0))
+PERSIST_QUEUE_SIZE = int(os.getenv('PERSIST_QUEUE_SIZE', 10000))
+PERSIST_SPOOL_PATH = os.getenv('PERSIST_SPOOL_PATH', 'conversation_spool.jsonl')
+PERSIST_REPLAY_INTERVAL = float(os.getenv('PERSIST_REPLAY_INTERVAL', 30))
+
+# Scale-out: state shared by all workers, sqlite:///path/to.db (one host) or redis://host:port/db.
+# It is the default store for history and rate limits, and holds business configs and the cache
+# invalidations that every worker picks up within SHARED_SYNC_INTERVAL seconds
+SHARED_STATE_URL = os.getenv('SHARED_STATE_URL', 'memory://')
+SHARED_CONFIG_TTL = float(os.getenv('SHARED_CONFIG_TTL', 300))
+SHARED_SYNC_INTERVAL = float(os.getenv('SHARED_SYNC_INTERVAL', 1.0))
+
+# Cluster routing: webhooks are answered by the node that owns the conversation on a consistent-hash
+# ring of CLUSTER_NODES (comma-separated base URLs); CLUSTER_SELF_URL is this node's entry in the list
+CLUSTER_NODES = [node.strip() for node in os.getenv('CLUSTER_NODES', '').split(',') if node.strip()]
+CLUSTER_SELF_URL = os.getenv('CLUSTER_SELF_URL', '')
+CLUSTER_VNODES = int(os.getenv('CLUSTER_VNODES', 100))
+CLUSTER_FORWARD_TIMEOUT = float(os.getenv('CLUSTER_FORWARD_TIMEOUT', 13))
+# Forwards in flight per process; keep it below the worker's threads so forwarded requests find one free
+CLUSTER_MAX_FORWARDS = int(os.getenv('CLUSTER_MAX_FORWARDS', 4))
+
+# Business config cache
+CONFIG_CACHE_SIZE = int(os.getenv('CONFIG_CACHE_SIZE', 1000))
+CONFIG_CACHE_TTL = float(os.getenv('CONFIG_CACHE_TTL', 300))
+CONFIG_CACHE_NEGATIVE_TTL = float(os.getenv('CONFIG_CACHE_NEGATIVE_TTL', 30))
+
+# Conversation history store: memory://, sqlite:///path/to.db or redis://host:port/db
+CONVERSATION_STORE_URL = os.getenv('CONVERSATION_STORE_URL', SHARED_STATE_URL)
+CONVERSATION_MAX_TURNS = int(os.getenv('CONVERSATION_MAX_TURNS', 20))
+CONVERSATION_MAX_CONVERSATIONS = int(os.getenv('CONVERSATION_MAX_CONVERSATIONS', 10000))
+CONVERSATION_IDLE_TTL = float(os.getenv('CONVERSATION_IDLE_TTL', 86400))
+
+# History sent to Gemini: newest turns within a token budget, older ones optionally summarized
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', 1500))
+HISTORY_SUMMARY_ENABLED = os.getenv('HISTORY_SUMMARY_ENABLED', 'false').lower() == 'true'
+
+# Store the FAQ preamble with Gemini context caching for this many seconds (0 = send inline)
+FAQ_CONTEXT_CACHE_TTL = int(os.getenv('FAQ_CONTEXT_CACHE_TTL', 0))
+
+# FAQ retrieval: answer confident matches directly, otherwise send only the top-k entries
+FAQ_DIR = os.getenv('FAQ_DIR', 'faqs')
+FAQ_TOP_K = int(os.getenv('FAQ_TOP_K', 3))
+FAQ_DIRECT_THRESHOLD = float(os.getenv('FAQ_DIRECT_THRESHOLD', 0.8))
+FAQ_REFERENCE_THRESHOLD = float(os.getenv('FAQ_REFERENCE_THRESHOLD', 0.3))
+
+# Answer cache for repeated questions: exact match, then TF-IDF similarity
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_CHAT = os.getenv('RESPONSE_CACHE_CHAT', 'false').lower() == 'true'
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1000))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 3600))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0.85))
+
+# Admission control: token buckets per business and per sender, and a cap on concurrent LLM calls
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'false').lower() == 'true'
+ADMISSION_STORE_URL = os.getenv('ADMISSION_STORE_URL', SHARED_STATE_URL)
+BUSINESS_RATE_LIMIT = float(os.getenv('BUSINESS_RATE_LIMIT', 5))
+BUSINESS_RATE_BURST = int(os.getenv('BUSINESS_RATE_BURST', 20))
+SENDER_RATE_LIMIT = float(os.getenv('SENDER_RATE_LIMIT', 0.5))
+SENDER_RATE_BURST = int(os.getenv('SENDER_RATE_BURST', 5))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 16))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 2.0))
+LLM_MAX_QUEUED_PER_BUSINESS = int(os.getenv('LLM_MAX_QUEUED_PER_BUSINESS', 50))
+
+# Threads that run deadline-bounded Gemini calls. A call that missed its deadline keeps its thread until
+# Gemini returns, so leave headroom over LLM_MAX_CONCURRENCY; with none free, calls fail fast
+DEADLINE_CALL_THREADS = max(int(os.getenv('DEADLINE_CALL_THREADS', LLM_MAX_CONCURRENCY * 4)), LLM_MAX_CONCURRENCY + 1)
+
+# Token accounting per business and endpoint, from Gemini's usage_metadata (estimated when a provider doesn't
+# report it). Counted in memory and flushed to token_usage_YYYYMMDD.log in TOKEN_LOG_DIR, which all workers share.
+# Daily budgets in tokens (in + out, 0 = unlimited): TOKEN_BUDGET_DAILY for every business, TOKEN_BUDGETS
+# (business-1=200000,business-2=50000) for specific ones
+TOKEN_ACCOUNTING_ENABLED = os.getenv('TOKEN_ACCOUNTING_ENABLED', 'true').lower() == 'true'
+TOKEN_LOG_DIR = os.getenv('TOKEN_LOG_DIR', MESSAGE_LOG_DIR)
+TOKEN_FLUSH_INTERVAL = float(os.getenv('TOKEN_FLUSH_INTERVAL', 5))
+TOKEN_BUDGET_DAILY = int(os.getenv('TOKEN_BUDGET_DAILY', 0))
+TOKEN_BUDGETS = parse_budgets(os.getenv('TOKEN_BUDGETS'))
+
+# Analytics for /stats/<business_id>: per-business hourly rollups tailed from the message logs every
+# ANALYTICS_INTERVAL seconds. Past days are snapshotted to analytics_YYYYMMDD.json in ANALYTICS_DIR, and
+# exported to Parquet in ANALYTICS_PARQUET_DIR when it is set and pyarrow is installed
+ANALYTICS_ENABLED = os.getenv('ANALYTICS_ENABLED', 'true').lower() == 'true'
+ANALYTICS_DIR = os.getenv('ANALYTICS_DIR', MESSAGE_LOG_DIR)
+ANALYTICS_INTERVAL = float(os.getenv('ANALYTICS_INTERVAL', 10))
+ANALYTICS_RETENTION_DAYS = int(os.getenv('ANALYTICS_RETENTION_DAYS', 30))
+ANALYTICS_PARQUET_DIR = os.getenv('ANALYTICS_PARQUET_DIR')
 
 # FAQ context: Add your FAQ or allowed queries here
 CONTEXT_FAQ = '''
@@ -56,10 +221,89 @@ FAQ Reference:
 You are a helpful customer support assistant. Use the FAQ above as a reference when relevant, but feel free to provide helpful, friendly responses to any customer questions. Be conversational and helpful even if the exact question isn't in the FAQ. If you don't know something specific, suggest contacting support or provide general guidance.
 '''
 
+FALLBACK_REPLY = "I apologize, but I'm having trouble processing your request right now. Please try again in a moment."
+FAQ_FALLBACK_REPLY = "I apologize, but I'm having trouble processing your FAQ request right now. Please try again in a moment."
+RATE_LIMIT_REPLY = "You're sending messages faster than we can answer them. Please wait a moment and try again."
+OVERLOAD_REPLY = "We're receiving a lot of messages right now. Please try again in a minute."
+TOKEN_BUDGET_REPLY = "We can't answer new questions right now. Please try again tomorrow or contact support."
+
+# Server-sent events: disable proxy buffering so chunks reach the client as they are generated
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+FAQ_PREAMBLE = """You are a helpful customer support assistant. Use the FAQ reference provided with each question when relevant, but provide helpful responses to any questions. Please provide a helpful, friendly response. If the question relates to the FAQ, use that information. If not, still try to be helpful and suggest contacting support if needed."""
+
 class CustomerSupportAgent:
-    def __init__(self):
-        self.conversation_history = {}
-        self.business_configs = {}
+    def __init__(self, backend=None, conversation_store=None, message_log=None, conversation_sink=None,
+                 admission=None, token_ledger=None, analytics=None):
+        self.conversation_history = conversation_store or create_conversation_store(
+            CONVERSATION_STORE_URL,
+            max_conversations=CONVERSATION_MAX_CONVERSATIONS,
+            max_turns=CONVERSATION_MAX_TURNS,
+            idle_ttl=CONVERSATION_IDLE_TTL
+        )
+        self.history_truncator = HistoryTruncator(
+            HISTORY_TOKEN_BUDGET,
+            summarize=HISTORY_SUMMARY_ENABLED,
+            summary_cache_size=CONVERSATION_MAX_CONVERSATIONS,
+            summary_ttl=CONVERSATION_IDLE_TTL
+        )
+        self.response_cache = ResponseCache(
+            RESPONSE_CACHE_SIZE,
+            RESPONSE_CACHE_TTL,
+            similarity_threshold=RESPONSE_CACHE_SIMILARITY,
+            similarity=RESPONSE_CACHE_SIMILARITY < 1.0
+        ) if RESPONSE_CACHE_ENABLED else None
+        self.faqs = FAQRegistry(parse_numbered_faq(CONTEXT_FAQ), faq_dir=FAQ_DIR, maxsize=CONFIG_CACHE_SIZE)
+        self.models = ModelRegistry(
+            GEMINI_MODEL,
+            maxsize=CONFIG_CACHE_SIZE,
+            faq_cache_ttl=FAQ_CONTEXT_CACHE_TTL,
+            router=llm_router
+        )
+        self.business_configs = ConfigCache(CONFIG_CACHE_SIZE, CONFIG_CACHE_TTL, CONFIG_CACHE_NEGATIVE_TTL)
+        self.shared_state = create_shared_state(
+            SHARED_STATE_URL,
+            config_ttl=SHARED_CONFIG_TTL,
+            sync_interval=SHARED_SYNC_INTERVAL
+        )
+        self.backend = backend or BackendClient(
+            BACKEND_API_URL,
+            BACKEND_API_KEY,
+            connect_timeout=BACKEND_CONNECT_TIMEOUT,
+            read_timeout=BACKEND_READ_TIMEOUT,
+            max_retries=BACKEND_MAX_RETRIES,
+            pool_size=BACKEND_POOL_SIZE,
+            breaker_threshold=BACKEND_BREAKER_THRESHOLD,
+            breaker_reset=BACKEND_BREAKER_RESET
+        )
+        self.stream_ttft = Histogram()
+        self.stream_latency = Histogram()
+        self.message_log = message_log or message_log_writer
+        self.analytics = analytics or message_analytics
+        self.conversation_sink = conversation_sink or (ConversationSink(
+            self.backend,
+            batch_size=PERSIST_BATCH_SIZE,
+            flush_interval=PERSIST_FLUSH_INTERVAL,
+            queue_size=PERSIST_QUEUE_SIZE,
+            spool_path=PERSIST_SPOOL_PATH,
+            replay_interval=PERSIST_REPLAY_INTERVAL
+        ) if PERSIST_ASYNC and BACKEND_API_KEY else None)
+        self.admission = admission or (create_admission_controller(
+            ADMISSION_STORE_URL,
+            max_concurrency=LLM_MAX_CONCURRENCY,
+            queue_timeout=LLM_QUEUE_TIMEOUT,
+            max_queued_per_business=LLM_MAX_QUEUED_PER_BUSINESS,
+            business_rate=BUSINESS_RATE_LIMIT,
+            business_burst=BUSINESS_RATE_BURST,
+            sender_rate=SENDER_RATE_LIMIT,
+            sender_burst=SENDER_RATE_BURST
+        ) if ADMISSION_ENABLED else None)
+        self.token_ledger = token_ledger or (TokenLedger(
+            TOKEN_LOG_DIR,
+            flush_interval=TOKEN_FLUSH_INTERVAL,
+            default_budget=TOKEN_BUDGET_DAILY,
+            budgets=TOKEN_BUDGETS
+        ) if TOKEN_ACCOUNTING_ENABLED else None)
         
     def log_message(self, direction, phone_number, message, response=None, error=None, business_id=None):
         """Log all messages with timestamps"""
@@ -74,171 +318,738 @@ class CustomerSupportAgent:
             "business_id": business_id
         }
         
-        # Log to file
-        logger.info(f"MESSAGE_LOG: {json.dumps(log_entry, ensure_ascii=False)}")
+        # Full entries go to the dedicated message log; the app log only gets them at DEBUG
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"MESSAGE_LOG: {json.dumps(log_entry, ensure_ascii=False)}")
+        
+        # Queue for the background writer of the dedicated message log file
+        if self.message_log is not None:
+            self.message_log.write(log_entry)
+        
+    def parse_business_config(self, business_data):
+        """Build the agent's business config from a /api/setup/status payload"""
+        config = {
+            'name': business_data.get('name', 'Business'),
+            'tone': 'professional',
+            'language': 'English',
+            'specialties': '',
+            'business_hours': '24/7',
+            'faqs': business_data.get('faqs') or []
+        }
+        
+        # Get bot config if available
+        if business_data.get('bot_configs'):
+            bot_config = business_data['bot_configs'][0]
+            config.update({
+                'tone': bot_config.get('tone', 'professional'),
+                'language': bot_config.get('language', 'English'),
+                'specialties': bot_config.get('specialties', ''),
+                'business_hours': bot_config.get('businessHours', '24/7')
+            })
+        
+        return config
+        
+    def build_context(self, business_config):
+        """Build the system context for a business (or a generic one)"""
+        if business_config:
+            return compact_prompt(f"""You are a helpful customer support agent for {business_config['name']}. 
+                Business Context: {business_config['specialties']}
+                Communication Style: {business_config['tone']}
+                Language: {business_config['language']}
+                Business Hours: {business_config['business_hours']}
+                
+                Please provide helpful, professional, and friendly responses to customer inquiries.
+                Keep responses concise but informative.""")
+        return compact_prompt(f"""You are a helpful customer support agent for a business. 
+                Please provide helpful, professional, and friendly responses to customer inquiries.
+                Keep responses concise but informative.""")
+        
+    def conversation_key(self, phone_number, business_id=None):
+        """History is per business so one sender's chats with two businesses never mix"""
+        return f"{business_id}:{phone_number}" if business_id else phone_number
+        
+    def record_turn(self, key, user_message, ai_response):
+        """Append a user/assistant exchange to the conversation history"""
+        self.conversation_history.append(key, [
+            ("user", user_message),
+            ("assistant", ai_response)
+        ])
+        
+    def build_faq_prompt(self, question, entries, inline_preamble=True):
+        """Question plus only the relevant FAQ entries; instructions too unless the model carries them"""
+        prompt = f"Customer Question: {question}"
+        if entries:
+            prompt = f"FAQ Reference:\n{compact_prompt(format_entries(entries))}\n\n{prompt}"
+        if inline_preamble:
+            prompt = f"{FAQ_PREAMBLE}\n\n{prompt}"
+        return prompt
+        
+    def faq_reference(self, question, business_id, business_config):
+        """FAQ entries relevant enough to pass to the model alongside a chat message"""
+        matches = self.faqs.for_business(business_id, business_config).search(question, FAQ_TOP_K)
+        entries = [entry for entry, confidence in matches if confidence >= FAQ_REFERENCE_THRESHOLD]
+        return f"Relevant FAQ entries:\n{compact_prompt(format_entries(entries))}" if entries else None
+        
+    def prepare_faq(self, question, business_id=None, business_config=None):
+        """Return (direct_answer, model, prompt); direct_answer is set for confident FAQ matches"""
+        matches = self.faqs.for_business(business_id, business_config).search(question, FAQ_TOP_K)
+        if matches and matches[0][1] >= FAQ_DIRECT_THRESHOLD:
+            entry, confidence = matches[0]
+            logger.info(f"FAQ answered from index (confidence {confidence:.2f}): {entry.question}")
+            telemetry.cache_lookup("faq_index", True)
+            return entry.answer, None, None
+        
+        telemetry.cache_lookup("faq_index", False)
+        model, preamble_turn = self.models.faq_model(FAQ_PREAMBLE)
+        entries = [entry for entry, _ in matches]
+        return None, model, self.build_faq_prompt(question, entries, inline_preamble=preamble_turn is not None)
+        
+    def fetch_business_config(self, business_id):
+        """Load a business config from the backend; None means the business doesn't exist"""
+        response = self.backend.get(f"/api/setup/status/{business_id}", endpoint="setup_status")
         
-        # Also save to a dedicated message log file
-        message_log_file = f"messages_{datetime.now().strftime('%Y%m%d')}.log"
-        with open(message_log_file, 'a', encoding='utf-8') as f:
-            f.write(f"{json.dumps(log_entry, ensure_ascii=False)}\n")
+        if response.status_code == 200:
+            return self.parse_business_config(response.json())
+        if response.status_code >= 500:
+            # Transient: raise so the failure isn't negatively cached
+            raise RuntimeError(f"Backend returned {response.status_code}")
+        logger.warning(f"Failed to get business config: {response.status_code}")
+        return None
+        
+    def load_business_config(self, business_id):
+        """Config cache loader: the copy another worker stored in shared state, else the backend"""
+        if self.shared_state is None:
+            return self.fetch_business_config(business_id)
+        config = self.shared_state.get_config(business_id)
+        if config is None:
+            config = self.fetch_business_config(business_id)
+            if config is not None:
+                self.shared_state.set_config(business_id, config)
+        return config
+        
+    def invalidate_business(self, business_id, publish=True):
+        """Drop everything cached for a business; with publish, in the other workers too"""
+        removed = self.business_configs.invalidate(business_id)
+        self.models.invalidate(business_id)
+        self.faqs.invalidate(business_id)
+        if self.response_cache is not None:
+            self.response_cache.invalidate(f"business:{business_id}")
+            self.response_cache.invalidate(f"faq:{business_id}")
+        if publish and self.shared_state is not None:
+            self.shared_state.invalidate(business_id)
+        return removed
+        
+    def sync_invalidations(self):
+        """Apply invalidations published by other workers since the last sync"""
+        if self.shared_state is None:
+            return
+        for business_id in self.shared_state.poll():
+            self.invalidate_business(business_id, publish=False)
+            logger.info(f"Business config cache invalidated for {business_id} by another worker")
         
     def get_business_config(self, business_id):
         """Get business configuration from backend"""
         try:
-            if business_id in self.business_configs:
-                return self.business_configs[business_id]
-            
-            response = requests.get(
-                f"{BACKEND_API_URL}/api/setup/status/{business_id}",
-                headers={
-                    "Authorization": f"Bearer {BACKEND_API_KEY}",
-                    "Content-Type": "application/json"
-                }
-            )
-            
-            if response.status_code == 200:
-                business_data = response.json()
-                config = {
-                    'name': business_data.get('name', 'Business'),
-                    'tone': 'professional',
-                    'language': 'English',
-                    'specialties': '',
-                    'business_hours': '24/7'
-                }
-                
-                # Get bot config if available
-                if business_data.get('bot_configs'):
-                    bot_config = business_data['bot_configs'][0]
-                    config.update({
-                        'tone': bot_config.get('tone', 'professional'),
-                        'language': bot_config.get('language', 'English'),
-                        'specialties': bot_config.get('specialties', ''),
-                        'business_hours': bot_config.get('businessHours', '24/7')
-                    })
-                
-                self.business_configs[business_id] = config
-                return config
-            else:
-                logger.warning(f"Failed to get business config: {response.status_code}")
-                return None
-                
+            with telemetry.stage("config"), deadline.leaving(DEADLINE_LLM_MIN_TIME):
+                deadline.check("config")
+                self.sync_invalidations()
+                return self.business_configs.get_or_load(business_id, self.load_business_config)
+        except DeadlineExceeded as e:
+            telemetry.error(e)
+            logger.warning(f"Skipping business config for {business_id}: {str(e)}")
+            return None
         except Exception as e:
+            telemetry.error(e)
             logger.error(f"Error getting business config: {str(e)}")
             return None
         
+    def summarize_history(self, key, older, business_id=None):
+        """Fold turns that fell out of the history window into a cached running summary"""
+        prompt, summary = self.history_truncator.summary_prompt(key, older)
+        if prompt is None:
+            return summary
+        try:
+            with telemetry.stage("summary"), deadline.leaving(DEADLINE_LLM_MIN_TIME):
+                deadline.check("summary")
+                response = deadline.call("summary", self.models.default_model().generate_content, prompt)
+            summary = response.text
+            self.record_usage(business_id, prompt, summary, response)
+            self.history_truncator.save_summary(key, older, summary)
+        except DeadlineExceeded as e:
+            telemetry.error(e)
+            logger.warning(f"Skipping history summary for {key}: {str(e)}")
+        except Exception as e:
+            telemetry.error(e)
+            logger.error(f"Error summarizing history for {key}: {str(e)}")
+        return summary
+        
+    def cached_answer(self, namespace, question):
+        """Look up a previously generated answer; None on a miss or when caching is off"""
+        if self.response_cache is None:
+            return None
+        hit = self.response_cache.get(namespace, question)
+        telemetry.cache_lookup("response", hit is not None)
+        if hit is None:
+            return None
+        answer, tier = hit
+        logger.info(f"Response cache {tier} hit ({namespace}): {question[:50]}...")
+        return answer
+        
+    def rate_limited(self, business_id, phone_number=None):
+        """True when the sender or the business is over its message rate"""
+        if self.admission is None:
+            return False
+        reason = self.admission.check_rate(business_id, phone_number)
+        if reason is None:
+            return False
+        logger.info(f"Rate limited ({reason}): {phone_number} (business: {business_id})")
+        return True
+        
+    def over_budget(self, business_id):
+        """True when the business has used up today's token budget"""
+        if self.token_ledger is None or not self.token_ledger.exhausted(business_id):
+            return False
+        logger.warning(f"Token budget exhausted, sending canned reply (business: {business_id})")
+        return True
+        
+    def record_usage(self, business_id, contents, text, response=None):
+        """Count the tokens of one LLM call in the metrics and against the business's budget"""
+        tokens_in, tokens_out = telemetry.record_tokens(contents, text, response)
+        if self.token_ledger is not None:
+            self.token_ledger.record(business_id, telemetry.current_endpoint(), tokens_in, tokens_out,
+                                     estimated=getattr(response, 'usage_metadata', None) is None)
+        
+    def acquire_slot(self, business_id):
+        """Wait for an LLM slot; False means the agent is overloaded"""
+        # Never queue past the point where the fallback reply could still be sent
+        if self.admission is None:
+            return True
+        timeout = deadline.cap(LLM_QUEUE_TIMEOUT, DEADLINE_RESERVE)
+        with telemetry.stage("admission"):
+            admitted = self.admission.acquire(business_id, timeout)
+        if admitted:
+            return True
+        logger.warning(f"LLM overloaded, sending canned reply (business: {business_id})")
+        return False
+        
+    def release_slot(self):
+        if self.admission is not None:
+            self.admission.release()
+        
     def generate_response(self, user_message, phone_number, business_id=None):
         """Generate AI response using Gemini with business-specific context"""
         try:
             logger.info(f"Generating AI response for {phone_number} (business: {business_id}): {user_message[:50]}...")
             
+            if self.rate_limited(business_id, phone_number):
+                return RATE_LIMIT_REPLY
+            
             # Get business configuration
             business_config = self.get_business_config(business_id) if business_id else None
             
-            # Build conversation context
-            if business_config:
-                context = f"""You are a helpful customer support agent for {business_config['name']}. 
-                Business Context: {business_config['specialties']}
-                Communication Style: {business_config['tone']}
-                Language: {business_config['language']}
-                Business Hours: {business_config['business_hours']}
-                
-                Please provide helpful, professional, and friendly responses to customer inquiries.
-                Keep responses concise but informative."""
-            else:
-                context = f"""You are a helpful customer support agent for a business. 
-                Please provide helpful, professional, and friendly responses to customer inquiries.
-                Keep responses concise but informative."""
+            # Reuse the business's model; context is None when bound as a system instruction
+            model, context = self.models.for_business(business_id, business_config, self.build_context)
             
-            # Get conversation history for this user
-            history = self.conversation_history.get(phone_number, [])
+            # Get conversation history for this user, trimmed to the token budget
+            key = self.conversation_key(phone_number, business_id)
+            history = self.conversation_history.get(key)
             
-            # Combine context and user message
-            prompt = context + "\n\nCustomer: " + user_message
+            # Opening questions don't depend on history, so their answers can be shared per business
+            cache_namespace = f"business:{business_id or ''}" if RESPONSE_CACHE_CHAT and not history else None
+            ai_response = self.cached_answer(cache_namespace, user_message) if cache_namespace else None
             
-            # Generate response using Gemini
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            response = model.generate_content(prompt)
-            ai_response = response.text
-            logger.info(f"AI response generated for {phone_number}: {ai_response[:50]}...")
+            if ai_response is None:
+                if self.over_budget(business_id):
+                    return TOKEN_BUDGET_REPLY
+                # Wait (fairly across businesses) for one of the limited LLM slots
+                if not self.acquire_slot(business_id):
+                    return OVERLOAD_REPLY
+                # A call cut off by the deadline keeps its slot until Gemini actually returns
+                with deadline.holding(self.release_slot):
+                    older, recent = self.history_truncator.split(history)
+                    summary = self.summarize_history(key, older, business_id)
+                    
+                    # Context, earlier turns and the new message (with relevant FAQ entries) as multi-turn contents
+                    reference = self.faq_reference(user_message, business_id, business_config)
+                    contents = build_contents(context, recent, user_message, summary, reference)
+                    
+                    # Generate response using Gemini, giving up in time to send the fallback reply
+                    with telemetry.stage("llm"):
+                        response = deadline.call("llm", model.generate_content, contents, reserve=DEADLINE_RESERVE)
+                ai_response = response.text
+                self.record_usage(business_id, contents, ai_response, response)
+                logger.info(f"AI response generated for {phone_number}: {ai_response[:50]}...")
+                
+                if cache_namespace and self.response_cache is not None:
+                    self.response_cache.put(cache_namespace, user_message, ai_response)
             
             # Update conversation history
-            if phone_number not in self.conversation_history:
-                self.conversation_history[phone_number] = []
-            
-            self.conversation_history[phone_number].append({
-                "role": "user", 
-                "message": user_message
-            })
-            self.conversation_history[phone_number].append({
-                "role": "assistant", 
-                "message": ai_response
-            })
-            
-            # Keep only last 20 messages to manage memory
-            if len(self.conversation_history[phone_number]) > 20:
-                self.conversation_history[phone_number] = self.conversation_history[phone_number][-20:]
+            self.record_turn(key, user_message, ai_response)
             
             return ai_response
             
         except Exception as e:
+            telemetry.error(e)
             error_msg = f"Error generating response: {str(e)}"
             logger.error(error_msg)
             self.log_message("error", phone_number, user_message, error=error_msg, business_id=business_id)
-            return "I apologize, but I'm having trouble processing your request right now. Please try again in a moment."
+            return FALLBACK_REPLY
 
+    def observe_stream(self, label, started, first_chunk_at):
+        """Record and log time-to-first-token and total latency of a streamed answer"""
+        finished = time.perf_counter()
+        ttft = (first_chunk_at or finished) - started
+        self.stream_ttft.observe(ttft)
+        self.stream_latency.observe(finished - started)
+        logger.info(f"Streamed {label}: ttft={ttft * 1000:.0f}ms total={(finished - started) * 1000:.0f}ms")
+        
+    def stream_response(self, user_message, phone_number, business_id=None):
+        """Yield the AI response in chunks as Gemini generates it; the full text goes to history"""
+        started = time.perf_counter()
+        first_chunk_at = None
+        chunks = []
+        try:
+            logger.info(f"Streaming AI response for {phone_number} (business: {business_id}): {user_message[:50]}...")
+            
+            if self.rate_limited(business_id, phone_number):
+                yield RATE_LIMIT_REPLY
+                return
+            
+            business_config = self.get_business_config(business_id) if business_id else None
+            model, context = self.models.for_business(business_id, business_config, self.build_context)
+            
+            key = self.conversation_key(phone_number, business_id)
+            history = self.conversation_history.get(key)
+            
+            cache_namespace = f"business:{business_id or ''}" if RESPONSE_CACHE_CHAT and not history else None
+            ai_response = self.cached_answer(cache_namespace, user_message) if cache_namespace else None
+            
+            if ai_response is not None:
+                first_chunk_at = time.perf_counter()
+                yield ai_response
+            else:
+                if self.over_budget(business_id):
+                    yield TOKEN_BUDGET_REPLY
+                    return
+                if not self.acquire_slot(business_id):
+                    yield OVERLOAD_REPLY
+                    return
+                # The slot is held until the stream finishes or the client goes away
+                try:
+                    older, recent = self.history_truncator.split(history)
+                    summary = self.summarize_history(key, older, business_id)
+                    reference = self.faq_reference(user_message, business_id, business_config)
+                    contents = build_contents(context, recent, user_message, summary, reference)
+                    
+                    with telemetry.stage("llm"):
+                        stream = model.generate_content(contents, stream=True)
+                        for chunk in stream:
+                            text = chunk.text
+                            if not text:
+                                continue
+                            if first_chunk_at is None:
+                                first_chunk_at = time.perf_counter()
+                            chunks.append(text)
+                            yield text
+                finally:
+                    self.release_slot()
+                ai_response = ''.join(chunks)
+                self.record_usage(business_id, contents, ai_response, stream)
+                
+                if cache_namespace and self.response_cache is not None:
+                    self.response_cache.put(cache_namespace, user_message, ai_response)
+            
+            self.record_turn(key, user_message, ai_response)
+            self.observe_stream(f"response for {phone_number}", started, first_chunk_at)
+            
+        except Exception as e:
+            telemetry.error(e)
+            error_msg = f"Error streaming response: {str(e)}"
+            logger.error(error_msg)
+            self.log_message("error", phone_number, user_message, error=error_msg, business_id=business_id)
+            # Once text has gone out the client keeps what it has; otherwise send the usual fallback
+            if not chunks:
+                yield FALLBACK_REPLY
+    
+    def conversation_record(self, phone_number, user_message, ai_response, business_id=None):
+        return {
+            "phone_number": phone_number,
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "business_id": business_id,
+            "timestamp": datetime.now().astimezone().isoformat()
+        }
+        
     def save_conversation(self, phone_number, user_message, ai_response, business_id=None):
         """Save conversation to backend database"""
         try:
-            if BACKEND_API_KEY:
-                conversation_data = {
-                    "phone_number": phone_number,
-                    "user_message": user_message,
-                    "ai_response": ai_response,
-                    "business_id": business_id,
-                    "timestamp": "now()"
-                }
-                
-                response = requests.post(
-                    f"{BACKEND_API_URL}/api/conversations",
-                    json=conversation_data,
-                    headers={
-                        "Authorization": f"Bearer {BACKEND_API_KEY}",
-                        "Content-Type": "application/json"
-                    }
-                )
-                
-                if response.status_code == 201:
-                    logger.info(f"Conversation saved for {phone_number} (business: {business_id})")
-                else:
-                    logger.warning(f"Failed to save conversation: {response.status_code} - {response.text}")
+            if not BACKEND_API_KEY:
+                return
+            
+            conversation_data = self.conversation_record(phone_number, user_message, ai_response, business_id)
+            
+            # Batched in the background; spooled locally if the backend is down
+            if self.conversation_sink is not None:
+                self.conversation_sink.submit(conversation_data)
+                return
+            
+            # Inline saves only run while the reply can still go out in time
+            with telemetry.stage("persist"), deadline.leaving(DEADLINE_RESERVE):
+                deadline.check("persist")
+                response = self.backend.post("/api/conversations", endpoint="conversations", json=conversation_data)
+            
+            if response.status_code == 201:
+                logger.info(f"Conversation saved for {phone_number} (business: {business_id})")
+            else:
+                logger.warning(f"Failed to save conversation: {response.status_code} - {response.text}")
                     
+        except DeadlineExceeded as e:
+            telemetry.error(e)
+            logger.warning(f"Conversation not saved for {phone_number}: {str(e)}")
         except Exception as e:
+            telemetry.error(e)
             logger.error(f"Error saving conversation: {str(e)}")
 
-    def generate_faq_response(self, question):
-        """Generate FAQ response using Gemini with FAQ context"""
+    def generate_faq_response(self, question, business_id=None):
+        """Generate FAQ response, from the FAQ index when confident, otherwise with Gemini"""
         try:
             logger.info(f"Generating FAQ response for: {question[:50]}...")
             
-            # Include FAQ context in the message itself
-            contextualized_question = f"""You are a helpful customer support assistant. Use the FAQ reference below when relevant, but provide helpful responses to any questions:\n\n{CONTEXT_FAQ}\n\nCustomer Question: {question}\n\nPlease provide a helpful, friendly response. If the question relates to the FAQ, use that information. If not, still try to be helpful and suggest contacting support if needed."""
+            cache_namespace = f"faq:{business_id or ''}"
+            cached = self.cached_answer(cache_namespace, question)
+            if cached is not None:
+                return cached
+            
+            business_config = self.get_business_config(business_id) if business_id else None
+            direct_answer, model, contextualized_question = self.prepare_faq(question, business_id, business_config)
+            if direct_answer is not None:
+                return direct_answer
             
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            response = model.generate_content(contextualized_question)
+            if self.rate_limited(business_id):
+                return RATE_LIMIT_REPLY
+            if self.over_budget(business_id):
+                return TOKEN_BUDGET_REPLY
+            if not self.acquire_slot(business_id):
+                return OVERLOAD_REPLY
+            with deadline.holding(self.release_slot), telemetry.stage("llm"):
+                response = deadline.call("llm", model.generate_content, contextualized_question,
+                                         reserve=DEADLINE_RESERVE)
             ai_response = response.text
+            self.record_usage(business_id, contextualized_question, ai_response, response)
             logger.info(f"FAQ response generated: {ai_response[:50]}...")
             
+            if self.response_cache is not None:
+                self.response_cache.put(cache_namespace, question, ai_response)
+            
             return ai_response
             
         except Exception as e:
+            telemetry.error(e)
             error_msg = f"Error generating FAQ response: {str(e)}"
             logger.error(error_msg)
-            return "I apologize, but I'm having trouble processing your FAQ request right now. Please try again in a moment."
+            return FAQ_FALLBACK_REPLY
+
+    def stream_faq_response(self, question, business_id=None):
+        """Yield the FAQ answer in chunks; index and cache hits arrive as a single chunk"""
+        started = time.perf_counter()
+        first_chunk_at = None
+        chunks = []
+        try:
+            logger.info(f"Streaming FAQ response for: {question[:50]}...")
+            
+            cache_namespace = f"faq:{business_id or ''}"
+            answer = self.cached_answer(cache_namespace, question)
+            if answer is None:
+                business_config = self.get_business_config(business_id) if business_id else None
+                answer, model, prompt = self.prepare_faq(question, business_id, business_config)
+            if answer is not None:
+                yield answer
+                return
+            
+            if self.rate_limited(business_id):
+                yield RATE_LIMIT_REPLY
+                return
+            if self.over_budget(business_id):
+                yield TOKEN_BUDGET_REPLY
+                return
+            if not self.acquire_slot(business_id):
+                yield OVERLOAD_REPLY
+                return
+            try:
+                with telemetry.stage("llm"):
+                    stream = model.generate_content(prompt, stream=True)
+                    for chunk in stream:
+                        text = chunk.text
+                        if not text:
+                            continue
+                        if first_chunk_at is None:
+                            first_chunk_at = time.perf_counter()
+                        chunks.append(text)
+                        yield text
+            finally:
+                self.release_slot()
+            
+            answer = ''.join(chunks)
+            self.record_usage(business_id, prompt, answer, stream)
+            if self.response_cache is not None:
+                self.response_cache.put(cache_namespace, question, answer)
+            self.observe_stream("FAQ response", started, first_chunk_at)
+            
+        except Exception as e:
+            telemetry.error(e)
+            logger.error(f"Error streaming FAQ response: {str(e)}")
+            if not chunks:
+                yield FAQ_FALLBACK_REPLY
+
+def sse_event(data, event=None):
+    """Format one server-sent event with a JSON payload"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def wants_stream(data):
+    """Stream when the client asks for it in the body or accepts text/event-stream"""
+    return bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
 
-# Initialize the agent
-agent = CustomerSupportAgent()
+def sse_stream(chunks, field, on_complete=None, **done):
+    """SSE body: a 'message' event per chunk, then a 'done' event carrying the full text in `field`"""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield sse_event({"text": chunk})
+    full_text = ''.join(parts)
+    if on_complete is not None:
+        on_complete(full_text)
+    yield sse_event({**done, field: full_text}, event="done")
 
-@app.route('/webhook/<business_id>', methods=['POST'])
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+# Per-process state. Nothing here is created at import time: threads, sockets and SQLite
+# connections don't survive a fork, so each gunicorn worker builds its own on first use
+log_handlers = []
+log_listener = None
+message_log_writer = None
+message_log_index = None
+log_line_counter = None
+message_analytics = None
+llm_router = None
+cluster_router = None
+agent = None
+reply_dispatcher = None
+_initialized = set()
+_init_lock = threading.Lock()
+
+def _after_fork():
+    """In a forked child, drop the parent's initialization so the child creates its own clients"""
+    global _init_lock
+    _initialized.clear()
+    _init_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def preload_sdks():
+    """Import, without configuring, the SDKs this process will use"""
+    if 'gemini' in LLM_PROVIDERS:
+        import google.generativeai  # noqa: F401
+    if 'cohere' in LLM_PROVIDERS:
+        import cohere  # noqa: F401
+
+def create_cluster_router():
+    """Router for CLUSTER_NODES, or None when this node runs alone"""
+    if not CLUSTER_NODES:
+        return None
+    return ClusterRouter(
+        CLUSTER_NODES,
+        CLUSTER_SELF_URL,
+        vnodes=CLUSTER_VNODES,
+        timeout=CLUSTER_FORWARD_TIMEOUT,
+        pool_size=BACKEND_POOL_SIZE,
+        max_forwards=CLUSTER_MAX_FORWARDS
+    )
+
+def init_runtime():
+    """Set up logging, the message log, its index and analytics, tracing and the LLM clients for this process"""
+    global log_handlers, log_listener, message_log_writer, message_log_index, log_line_counter, message_analytics
+    global llm_router
+    if 'runtime' in _initialized:
+        return
+    with _init_lock:
+        if 'runtime' in _initialized:
+            return
+        if not GEMINI_API_KEY and any(name.startswith('gemini') for name in LLM_PROVIDERS):
+            raise RuntimeError('GEMINI_API_KEY not set in environment')
+        if TWILIO_VALIDATE_SIGNATURE and not (TWILIO_AUTH_TOKEN and TWILIO_WEBHOOK_BASE_URL):
+            # Behind TLS termination the agent can't see the URL Twilio signed, and every webhook would get a 403
+            raise RuntimeError('TWILIO_VALIDATE_SIGNATURE requires TWILIO_AUTH_TOKEN and TWILIO_WEBHOOK_BASE_URL')
+        if 'gemini' in LLM_PROVIDERS:
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+        
+        # Log handlers run on a background thread so request threads only enqueue
+        log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        log_handlers = [
+            logging.FileHandler(log_filename, encoding='utf-8'),
+            logging.StreamHandler()  # Also print to console
+        ]
+        for log_handler in log_handlers:
+            log_handler.setFormatter(log_formatter)
+        log_listener = start_queue_logging(log_handlers, logging.INFO)
+        
+        message_log_writer = MessageLogWriter(
+            MESSAGE_LOG_DIR,
+            background=MESSAGE_LOG_MODE == 'async',
+            batch_size=MESSAGE_LOG_BATCH_SIZE,
+            queue_size=MESSAGE_LOG_QUEUE_SIZE
+        ) if MESSAGE_LOG_MODE != 'off' else None
+        message_log_index = MessageLogIndex(MESSAGE_LOG_DIR, index_path=MESSAGE_INDEX_PATH)
+        log_line_counter = LineCounter()
+        message_analytics = MessageAnalytics(
+            MESSAGE_LOG_DIR,
+            state_dir=ANALYTICS_DIR,
+            retention_days=ANALYTICS_RETENTION_DAYS,
+            interval=ANALYTICS_INTERVAL,
+            parquet_dir=ANALYTICS_PARQUET_DIR
+        ) if ANALYTICS_ENABLED else None
+        deadline.configure(DEADLINE_CALL_THREADS)
+        telemetry.configure(
+            max_businesses=METRICS_MAX_BUSINESSES,
+            trace_writer=MessageLogWriter(TRACE_LOG_DIR, prefix='traces_') if TRACE_ENABLED else None,
+            trace_sample_rate=TRACE_SAMPLE_RATE
+        )
+        llm_router = create_router(
+            LLM_PROVIDERS,
+            GEMINI_MODEL,
+            gemini_api_key=GEMINI_API_KEY,
+            gemini_api_url=GEMINI_API_URL,
+            cohere_api_key=COHERE_API_KEY,
+            cohere_model=COHERE_MODEL,
+            pool_size=LLM_POOL_SIZE,
+            hedge=LLM_HEDGE_ENABLED,
+            hedge_delay=LLM_HEDGE_DELAY,
+            hedge_threads=LLM_HEDGE_THREADS,
+            explore=LLM_ROUTER_EXPLORE,
+            cooldown=LLM_PROVIDER_COOLDOWN
+        ) if LLM_PROVIDERS != ['gemini'] else None
+        _initialized.add('runtime')
+
+def init_agent():
+    """Create the agent, the async reply workers and the cluster router for this process, after init_runtime()"""
+    global agent, reply_dispatcher, cluster_router
+    if 'agent' in _initialized:
+        return
+    started = time.perf_counter()
+    init_runtime()
+    with _init_lock:
+        if 'agent' in _initialized:
+            return
+        if ASYNC_REPLIES and not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN):
+            raise RuntimeError('ASYNC_REPLIES requires TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN')
+        durable_replies = ASYNC_REPLIES and not ASYNC_REPLY_QUEUE_URL.startswith('memory://')
+        if durable_replies and message_coalescer:
+            # The durable queue answers a conversation's waiting messages together already
+            raise RuntimeError('A durable ASYNC_REPLY_QUEUE_URL can not be combined with COALESCE_ENABLED')
+        agent = CustomerSupportAgent()
+        reply_dispatcher = create_reply_dispatcher(
+            ASYNC_REPLY_QUEUE_URL,
+            telemetry.traced("async_reply", with_deadline(
+                ASYNC_REPLY_DEADLINE, process_batch if message_coalescer else process_message)),
+            TwilioReplySender(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, api_url=TWILIO_API_URL),
+            workers=ASYNC_REPLY_WORKERS,
+            queue_size=ASYNC_REPLY_QUEUE_SIZE,
+            # A claimed message is handed to another worker only once its deadline is long past
+            lease=ASYNC_REPLY_DEADLINE + 30,
+            max_attempts=ASYNC_REPLY_MAX_ATTEMPTS,
+            retry_backoff=ASYNC_REPLY_RETRY_BACKOFF,
+            retention=ASYNC_REPLY_RETENTION
+        ) if ASYNC_REPLIES else None
+        cluster_router = create_cluster_router()
+        _initialized.add('agent')
+    logger.info(f"Agent initialized in process {os.getpid()} ({(time.perf_counter() - started) * 1000:.0f}ms)")
+
+def process_message(business_id, from_number, to_number, incoming_message):
+    """Log, answer and persist one incoming message; returns the AI reply"""
+    # Log incoming message
+    with telemetry.stage("log"):
+        agent.log_message("incoming", from_number, incoming_message, business_id=business_id)
+    
+    # Generate AI response with business context
+    with telemetry.stage("generate"):
+        ai_response = agent.generate_response(incoming_message, from_number, business_id)
+    
+    # Log outgoing message
+    with telemetry.stage("log"):
+        agent.log_message("outgoing", from_number, ai_response, response=ai_response, business_id=business_id)
+    
+    # Save conversation to backend
+    agent.save_conversation(from_number, incoming_message, ai_response, business_id)
+    
+    return ai_response
+
+message_coalescer = MessageCoalescer(COALESCE_WINDOW, COALESCE_MAX_WAIT) if COALESCE_ENABLED else None
+
+signature_validator = SignatureValidator(TWILIO_AUTH_TOKEN, TWILIO_WEBHOOK_BASE_URL) \
+    if TWILIO_VALIDATE_SIGNATURE and TWILIO_AUTH_TOKEN else None
+
+def process_batch(business_id, from_number, to_number, batch):
+    """Wait for the sender to stop typing, then answer every message in the batch with one reply"""
+    try:
+        with telemetry.stage("coalesce"):
+            incoming_message = message_coalescer.collect(batch)
+        return process_message(business_id, from_number, to_number, incoming_message)
+    finally:
+        message_coalescer.finish(batch)
+
+# Routes are registered on the app built by create_app()
+routes = Blueprint('agent', __name__)
+
+# Flask endpoints whose stages are timed, with the endpoint label they are reported under
+TRACED_ENDPOINTS = {
+    'agent.business_webhook': 'webhook',
+    'agent.webhook': 'webhook',
+    'agent.test_ai': 'test',
+    'agent.ai_response': 'ai_response',
+    'agent.faq': 'faq'
+}
+
+# Endpoints Twilio posts to, checked against X-Twilio-Signature
+WEBHOOK_ENDPOINTS = ('agent.business_webhook', 'agent.webhook')
+
+@routes.before_app_request
+def initialize():
+    # /health answers without loading the SDKs, so liveness probes pass while a cold worker starts
+    if request.endpoint != 'agent.health_check':
+        init_agent()
+
+@routes.before_app_request
+def start_trace():
+    endpoint = TRACED_ENDPOINTS.get(request.endpoint)
+    if endpoint is None:
+        return
+    business_id = (request.view_args or {}).get('business_id')
+    if business_id is None and request.is_json:
+        business_id = (request.get_json(silent=True) or {}).get('business_id')
+    g.trace = telemetry.start(endpoint, business_id)
+
+@routes.before_app_request
+def validate_signature():
+    # Only Twilio's webhooks are signed; forwarded ones carry the signature and, with
+    # TWILIO_WEBHOOK_BASE_URL set, check against the same URL on the owning node
+    if signature_validator is None or request.endpoint not in WEBHOOK_ENDPOINTS:
+        return None
+    url = signature_validator.url(request.url, request.full_path.rstrip('?'))
+    if signature_validator.validate(url, request.form.items(multi=True), request.headers.get(SIGNATURE_HEADER)):
+        return None
+    logger.warning(f"Rejected webhook with invalid Twilio signature: url={url} from={request.form.get('From', '')}")
+    return 'Invalid Twilio signature', 403
+
+@routes.teardown_app_request
+def finish_trace(error=None):
+    # Streamed responses are torn down once the stream ends, so their duration covers the whole answer
+    started = g.pop('trace', None)
+    if started is not None:
+        telemetry.finish(started, error)
+
+@routes.route('/webhook/<business_id>', methods=['POST'])
 def business_webhook(business_id):
     """Client-specific webhook endpoint for incoming messages"""
     try:
@@ -247,34 +1058,52 @@ def business_webhook(business_id):
         from_number = request.values.get('From', '')
         to_number = request.values.get('To', '')
         
-        logger.info(f"=== BUSINESS WEBHOOK RECEIVED ===")
-        logger.info(f"Business ID: {business_id}")
-        logger.info(f"From: {from_number}")
-        logger.info(f"To: {to_number}")
-        logger.info(f"Message: {incoming_message}")
+        logger.info(f"Webhook received: business={business_id} from={from_number} to={to_number} message={incoming_message[:50]}")
         
-        # Log incoming message
-        agent.log_message("incoming", from_number, incoming_message, business_id=business_id)
+        # In a cluster, the node that owns the conversation answers it
+        owner = cluster_router.owner(business_id, from_number, request.headers) if cluster_router else None
+        if owner:
+            with telemetry.stage("forward"):
+                forwarded = cluster_router.forward(owner, request.full_path.rstrip('?'),
+                                                   list(request.form.items(multi=True)), request.headers)
+            if forwarded is not None:
+                return forwarded.content, forwarded.status_code, {'Content-Type': forwarded.headers.get('Content-Type', 'text/xml')}
         
-        # Generate AI response with business context
-        ai_response = agent.generate_response(incoming_message, from_number, business_id)
+        # Fold messages sent in quick succession into the sender's pending batch; its reply covers them
+        batch = None
+        if message_coalescer:
+            batch = message_coalescer.submit((business_id, from_number), incoming_message)
+            if batch is None:
+                logger.info(f"Webhook merged into pending reply: business={business_id} from={from_number}")
+                return EMPTY_TWIML, 200, {'Content-Type': 'text/xml'}
+        job = batch or incoming_message
         
-        # Log outgoing message
-        agent.log_message("outgoing", from_number, ai_response, response=ai_response, business_id=business_id)
+        # Hand off to the worker pool and ack Twilio right away
+        if reply_dispatcher and reply_dispatcher.submit(business_id, from_number, to_number, job,
+                                                        message_sid=request.values.get('MessageSid')):
+            logger.info(f"Webhook queued for async reply: business={business_id} from={from_number}")
+            return EMPTY_TWIML, 200, {'Content-Type': 'text/xml'}
         
-        # Save conversation to backend
-        agent.save_conversation(from_number, incoming_message, ai_response, business_id)
+        if reply_dispatcher:
+            logger.warning(f"Async reply queue full, answering {from_number} inline")
+        
+        # Everything from here on has to finish before Twilio gives up on the webhook
+        with deadline_scope(REQUEST_DEADLINE):
+            if batch:
+                ai_response = process_batch(business_id, from_number, to_number, batch)
+            else:
+                ai_response = process_message(business_id, from_number, to_number, incoming_message)
         
         # Create Twilio response
-        resp = MessagingResponse()
-        resp.message(ai_response)
+        with telemetry.stage("twiml"):
+            twiml = twiml_message(ai_response)
         
-        logger.info(f"=== BUSINESS WEBHOOK RESPONSE SENT ===")
-        logger.info(f"Response: {ai_response}")
+        logger.info(f"Webhook response sent: business={business_id} to={from_number} response={ai_response[:50]}")
         
-        return str(resp)
+        return twiml
         
     except Exception as e:
+        telemetry.error(e)
         error_msg = f"Error in business webhook: {str(e)}"
         logger.error(error_msg)
         
@@ -283,16 +1112,14 @@ def business_webhook(business_id):
         incoming_message = request.values.get('Body', 'unknown')
         agent.log_message("error", from_number, incoming_message, error=error_msg, business_id=business_id)
         
-        resp = MessagingResponse()
-        resp.message("I apologize, but I'm having trouble processing your request right now. Please try again in a moment.")
-        return str(resp)
+        return twiml_message(FALLBACK_REPLY)
 
-@app.route('/webhook', methods=['POST'])
+@routes.route('/webhook', methods=['POST'])
 def webhook():
     """Legacy webhook endpoint for backward compatibility"""
     return business_webhook(None)
 
-@app.route('/health', methods=['GET'])
+@routes.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
@@ -301,7 +1128,90 @@ def health_check():
         "timestamp": datetime.now().isoformat()
     })
 
-@app.route('/test', methods=['POST'])
+def optional_stats(component):
+    """stats() of a component that can be turned off"""
+    if component is None:
+        return {"enabled": False}
+    return {"enabled": True, **component.stats()}
+
+def stats_providers(agent, cluster_router=None):
+    """Snapshot function of each subsystem, keyed by the name GET /stats reports it under"""
+    return {
+        "admission": lambda: optional_stats(agent.admission),
+        "analytics": lambda: optional_stats(agent.analytics),
+        "async": lambda: optional_stats(reply_dispatcher),
+        "backend": agent.backend.stats,
+        "cache": agent.business_configs.stats,
+        "cluster": lambda: {
+            "cluster": cluster_router.stats() if cluster_router else None,
+            "shared_state": agent.shared_state.stats() if agent.shared_state else None
+        },
+        "coalesce": lambda: optional_stats(message_coalescer),
+        "conversations": agent.conversation_history.stats,
+        "deadline": deadline.stats.snapshot,
+        "llm": lambda: optional_stats(llm_router) if llm_router else {"enabled": False, "providers": LLM_PROVIDERS},
+        "message_index": lambda: optional_stats(message_log_index),
+        "message_log": lambda: optional_stats(agent.message_log),
+        "models": agent.models.stats,
+        "persistence": lambda: optional_stats(agent.conversation_sink),
+        "response_cache": lambda: optional_stats(agent.response_cache),
+        "signature": lambda: optional_stats(signature_validator),
+        "stream": lambda: {"ttft": agent.stream_ttft.snapshot(), "total": agent.stream_latency.snapshot()}
+    }
+
+def collect_stats(providers, subsystems=None):
+    """Body of GET /stats: every subsystem, or only the comma-separated `subsystems`; None for an unknown name"""
+    names = [name.strip() for name in subsystems.split(',') if name.strip()] if subsystems else list(providers)
+    if any(name not in providers for name in names):
+        return None
+    return {name: providers[name]() for name in names}
+
+@routes.route('/stats', methods=['GET'])
+def subsystem_stats():
+    """Counters of every subsystem (queues, caches, admission, persistence...); ?subsystem=a,b for some of them"""
+    stats = collect_stats(stats_providers(agent, cluster_router), request.args.get('subsystem'))
+    if stats is None:
+        return jsonify({"error": "Unknown subsystem"}), 404
+    return jsonify(stats)
+
+@routes.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: stage latency, LLM tokens, errors, cache hits and in-flight requests"""
+    return Response(telemetry.registry.render(), content_type=telemetry.CONTENT_TYPE)
+
+@routes.route('/cache/invalidate/<business_id>', methods=['POST'])
+def invalidate_business_config(business_id):
+    """Drop a cached business config; called by the backend when a config is saved"""
+    if BACKEND_API_KEY and request.headers.get('Authorization') != f"Bearer {BACKEND_API_KEY}":
+        return jsonify({"error": "Unauthorized"}), 401
+    removed = agent.invalidate_business(business_id)
+    logger.info(f"Business config cache invalidated for {business_id} (cached: {removed})")
+    return jsonify({"business_id": business_id, "invalidated": removed})
+
+@routes.route('/tokens', methods=['GET'])
+def token_usage():
+    """Today's token usage of the busiest businesses, and the flush counters"""
+    if agent.token_ledger is None:
+        return jsonify({"enabled": False})
+    limit = min(request.args.get('limit', 50, type=int), MESSAGE_QUERY_MAX_LIMIT)
+    return jsonify({"enabled": True, "businesses": agent.token_ledger.top(limit), **agent.token_ledger.stats()})
+
+@routes.route('/tokens/<business_id>', methods=['GET'])
+def business_token_usage(business_id):
+    """Today's tokens in and out for one business, per endpoint, against its budget"""
+    if agent.token_ledger is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **agent.token_ledger.usage(business_id)})
+
+@routes.route('/stats/<business_id>', methods=['GET'])
+def business_stats(business_id):
+    """Messages per hour, unique senders, error rate and reply latency of a business over the last `days` days"""
+    if agent.analytics is None:
+        return jsonify({"enabled": False})
+    days = request.args.get('days', 7, type=int)
+    return jsonify({"enabled": True, **agent.analytics.summary(business_id, days)})
+
+@routes.route('/test', methods=['POST'])
 def test_ai():
     """Test AI response without Twilio"""
     try:
@@ -313,6 +1223,15 @@ def test_ai():
         if not message:
             return jsonify({"error": "Message is required"}), 400
         
+        if wants_stream(data):
+            def save(ai_response):
+                if business_id:
+                    agent.save_conversation(phone_number, message, ai_response, business_id)
+            chunks = agent.stream_response(message, phone_number, business_id)
+            return sse_response(sse_stream(
+                chunks, "ai_response", save, user_message=message, success=True, business_id=business_id
+            ))
+        
         # Generate AI response
         ai_response = agent.generate_response(message, phone_number, business_id)
         
@@ -331,40 +1250,67 @@ def test_ai():
         logger.error(f"Error in test endpoint: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/logs', methods=['GET'])
+@routes.route('/logs', methods=['GET'])
 def get_logs():
-    """Get recent logs"""
+    """Get recent logs, read backwards from the end of today's log file"""
     try:
-        with open(log_filename, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            return jsonify({
-                "logs": lines[-50:],  # Last 50 lines
-                "total_lines": len(lines)
-            })
+        count = max(1, min(int(request.args.get('lines', 50)), MESSAGE_QUERY_MAX_LIMIT))
+        lines = tail_lines(log_filename, count)
+        return jsonify({
+            "logs": [f"{line}\n" for _, line in lines],
+            "total_lines": log_line_counter.count(log_filename),
+            "size_bytes": os.path.getsize(log_filename)
+        })
     except FileNotFoundError:
-        return jsonify({"logs": [], "total_lines": 0})
+        return jsonify({"logs": [], "total_lines": 0, "size_bytes": 0})
+    except ValueError:
+        return jsonify({"error": "lines must be an integer"}), 400
 
-@app.route('/messages', methods=['GET'])
+@routes.route('/messages', methods=['GET'])
 def get_messages():
-    """Get recent messages"""
+    """Get recent messages; supports cursor pagination, date ranges and filters"""
     try:
-        message_log_file = f"messages_{datetime.now().strftime('%Y%m%d')}.log"
-        with open(message_log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            messages = [json.loads(line.strip()) for line in lines[-20:]]  # Last 20 messages
-            return jsonify({
-                "messages": messages,
-                "total_messages": len(lines)
-            })
-    except FileNotFoundError:
-        return jsonify({"messages": [], "total_messages": 0})
+        limit = max(1, min(int(request.args.get('limit', 20)), MESSAGE_QUERY_MAX_LIMIT))
+        cursor = request.args.get('cursor')
+        filters = {
+            name: request.args.get(name)
+            for name in ('since', 'until', 'phone_number', 'business_id', 'direction')
+        }
+        
+        # Latest page with no filters: read the end of today's file directly
+        today = datetime.now().strftime('%Y%m%d')
+        path = message_log_index.path(today)
+        if not cursor and not any(filters.values()) and os.path.exists(path):
+            lines = tail_lines(path, limit)
+            messages = []
+            for offset, line in lines:
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    # A damaged line is the log's problem, not the client's
+                    logger.warning(f"Skipping malformed line at byte {offset} of {path}")
+            has_older = bool(lines) and (lines[0][0] > 0 or message_log_index.days()[0] < today)
+            next_cursor = encode_cursor(today, lines[0][0]) if has_older else None
+        else:
+            messages, next_cursor = message_log_index.query(limit, cursor, **filters)
+        
+        return jsonify({
+            "messages": messages,
+            "next_cursor": next_cursor,
+            # Messages in today's log, as before pagination and filters existed (as of the last index pass)
+            "total_messages": message_log_index.count(today)
+        })
+    except ValueError:
+        return jsonify({"error": "Invalid limit or cursor"}), 400
 
-@app.route('/ai-response', methods=['POST'])
+@routes.route('/ai-response', methods=['POST'])
 def ai_response():
     data = request.get_json()
     message = data.get('message', '')
     if not message:
         return jsonify({'reply': 'No message provided.'}), 400
+    if wants_stream(data):
+        return sse_response(sse_stream(agent.stream_response(message, phone_number='whatsapp'), 'reply'))
     try:
         # Generate response using Cohere
         ai_reply = agent.generate_response(message, phone_number='whatsapp', business_id=None)
@@ -372,17 +1318,21 @@ def ai_response():
     except Exception as e:
         return jsonify({'reply': f'Error: {str(e)}'}), 500
 
-@app.route('/faq', methods=['POST'])
+@routes.route('/faq', methods=['POST'])
 def faq():
     """FAQ endpoint for handling FAQ questions"""
     try:
         data = request.get_json()
         question = data.get('question')
+        business_id = data.get('business_id')
         if not question:
             return jsonify({'error': 'Missing question'}), 400
         
+        if wants_stream(data):
+            return sse_response(sse_stream(agent.stream_faq_response(question, business_id), 'answer'))
+        
         # Generate FAQ response
-        answer = agent.generate_faq_response(question)
+        answer = agent.generate_faq_response(question, business_id)
         
         return jsonify({'answer': answer})
         
@@ -390,5 +1340,18 @@ def faq():
         logger.error(f"Error in FAQ endpoint: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def create_app():
+    """Build the Flask app; the agent and its clients are created in each process on its first request"""
+    from flask_cors import CORS
+    flask_app = Flask(__name__)
+    CORS(flask_app)
+    flask_app.register_blueprint(routes)
+    if PRELOAD_SDKS:
+        preload_sdks()
+    return flask_app
+
+app = create_app()
+
 if __name__ == '__main__':
+    init_agent()
     app.run(debug=True, host='0.0.0.0', port=int(os.getenv('PORT', 8000))) 
\ No newline at end of file
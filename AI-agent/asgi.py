@@ -0,0 +1,813 @@
+"""
+ASGI entry point for the AI agent.
+
+Serves the same routes as the Flask app, but every outbound call (backend
+API, Gemini) is awaited instead of blocking a worker, so a single process
+can hold hundreds of in-flight LLM calls. All backend traffic goes through
+one shared, pooled httpx.AsyncClient.
+
+Calls into the stores that may block on disk or network (conversation
+history, rate limits and shared config in SQLite or Redis, the message log
+in sync mode, the conversation spool) run on a thread pool of
+ASGI_BLOCKING_THREADS threads instead of on the event loop. ASYNC_REPLIES
+is not supported here: its reply workers run the Flask agent, so startup
+fails when it is set.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from urllib.parse import parse_qs, parse_qsl
+
+import deadline
+import httpx
+import telemetry
+from deadline import DeadlineExceeded, deadline_scope
+from history import build_contents
+
+from app import (
+    ASYNC_REPLIES,
+    BACKEND_API_KEY,
+    BACKEND_API_URL,
+    BACKEND_CONNECT_TIMEOUT,
+    BACKEND_READ_TIMEOUT,
+    DEADLINE_LLM_MIN_TIME,
+    DEADLINE_RESERVE,
+    FALLBACK_REPLY,
+    FAQ_FALLBACK_REPLY,
+    LLM_QUEUE_TIMEOUT,
+    MESSAGE_QUERY_MAX_LIMIT,
+    OVERLOAD_REPLY,
+    RATE_LIMIT_REPLY,
+    REQUEST_DEADLINE,
+    RESPONSE_CACHE_CHAT,
+    SSE_HEADERS,
+    TOKEN_BUDGET_REPLY,
+    CustomerSupportAgent,
+    collect_stats,
+    create_cluster_router,
+    init_runtime,
+    logger,
+    message_coalescer,
+    signature_validator,
+    sse_event,
+    stats_providers,
+    twiml_message
+)
+from reply_dispatcher import EMPTY_TWIML
+from twilio_webhook import SIGNATURE_HEADER
+
+# Connection pool for the shared async HTTP client
+ASGI_MAX_CONNECTIONS = int(os.getenv('ASGI_MAX_CONNECTIONS', 100))
+ASGI_MAX_KEEPALIVE = int(os.getenv('ASGI_MAX_KEEPALIVE', 20))
+# Threads for store calls that may block (SQLite, Redis, log and spool files)
+ASGI_BLOCKING_THREADS = int(os.getenv('ASGI_BLOCKING_THREADS', 16))
+
+
+class AsyncCustomerSupportAgent(CustomerSupportAgent):
+    """CustomerSupportAgent with awaitable I/O methods"""
+
+    def __init__(self, http_client=None):
+        super().__init__()
+        self.http = http_client
+
+    def backend_headers(self):
+        return {
+            "Authorization": f"Bearer {BACKEND_API_KEY}",
+            "Content-Type": "application/json"
+        }
+
+    async def fetch_business_config_async(self, business_id):
+        """Load a business config from the backend; None means the business doesn't exist"""
+        response = await deadline.wait_for("backend:setup_status", self.http.get(
+            f"{BACKEND_API_URL}/api/setup/status/{business_id}",
+            headers=self.backend_headers()
+        ))
+
+        if response.status_code == 200:
+            return self.parse_business_config(response.json())
+        if response.status_code >= 500:
+            raise RuntimeError(f"Backend returned {response.status_code}")
+        logger.warning(f"Failed to get business config: {response.status_code}")
+        return None
+
+    async def load_business_config_async(self, business_id):
+        """Config cache loader: the copy another worker stored in shared state, else the backend"""
+        if self.shared_state is None:
+            return await self.fetch_business_config_async(business_id)
+        config = await asyncio.to_thread(self.shared_state.get_config, business_id)
+        if config is None:
+            config = await self.fetch_business_config_async(business_id)
+            if config is not None:
+                await asyncio.to_thread(self.shared_state.set_config, business_id, config)
+        return config
+
+    async def get_business_config_async(self, business_id):
+        """Get business configuration from backend"""
+        try:
+            with telemetry.stage("config"), deadline.leaving(DEADLINE_LLM_MIN_TIME):
+                deadline.check("config")
+                if self.shared_state is not None:
+                    await asyncio.to_thread(self.sync_invalidations)
+                return await self.business_configs.get_or_load_async(business_id, self.load_business_config_async)
+        except DeadlineExceeded as e:
+            telemetry.error(e)
+            logger.warning(f"Skipping business config for {business_id}: {str(e)}")
+            return None
+        except Exception as e:
+            telemetry.error(e)
+            logger.error(f"Error getting business config: {str(e)}")
+            return None
+
+    async def summarize_history_async(self, key, older, business_id=None):
+        """Fold turns that fell out of the history window into a cached running summary"""
+        prompt, summary = self.history_truncator.summary_prompt(key, older)
+        if prompt is None:
+            return summary
+        try:
+            with telemetry.stage("summary"), deadline.leaving(DEADLINE_LLM_MIN_TIME):
+                deadline.check("summary")
+                response = await deadline.wait_for("summary", self.models.default_model().generate_content_async(prompt))
+            summary = response.text
+            self.record_usage(business_id, prompt, summary, response)
+            self.history_truncator.save_summary(key, older, summary)
+        except DeadlineExceeded as e:
+            telemetry.error(e)
+            logger.warning(f"Skipping history summary for {key}: {str(e)}")
+        except Exception as e:
+            telemetry.error(e)
+            logger.error(f"Error summarizing history for {key}: {str(e)}")
+        return summary
+
+    async def log_message_async(self, direction, phone_number, message, response=None, error=None,
+                                business_id=None):
+        """log_message() on the blocking pool: with MESSAGE_LOG_MODE=sync it writes the file itself"""
+        await asyncio.to_thread(self.log_message, direction, phone_number, message, response, error, business_id)
+
+    async def acquire_slot_async(self, business_id):
+        """Wait for an LLM slot without blocking the event loop; False means overloaded"""
+        if self.admission is None:
+            return True
+        timeout = deadline.cap(LLM_QUEUE_TIMEOUT, DEADLINE_RESERVE)
+        with telemetry.stage("admission"):
+            admitted = await self.admission.acquire_async(business_id, timeout)
+        if admitted:
+            return True
+        logger.warning(f"LLM overloaded, sending canned reply (business: {business_id})")
+        return False
+
+    async def generate_response_async(self, user_message, phone_number, business_id=None):
+        """Generate AI response using Gemini with business-specific context"""
+        try:
+            logger.info(f"Generating AI response for {phone_number} (business: {business_id}): {user_message[:50]}...")
+
+            if await asyncio.to_thread(self.rate_limited, business_id, phone_number):
+                return RATE_LIMIT_REPLY
+
+            business_config = await self.get_business_config_async(business_id) if business_id else None
+            model, context = self.models.for_business(business_id, business_config, self.build_context)
+
+            key = self.conversation_key(phone_number, business_id)
+            history = await asyncio.to_thread(self.conversation_history.get, key)
+
+            cache_namespace = f"business:{business_id or ''}" if RESPONSE_CACHE_CHAT and not history else None
+            ai_response = self.cached_answer(cache_namespace, user_message) if cache_namespace else None
+
+            if ai_response is None:
+                if self.over_budget(business_id):
+                    return TOKEN_BUDGET_REPLY
+                if not await self.acquire_slot_async(business_id):
+                    return OVERLOAD_REPLY
+                try:
+                    older, recent = self.history_truncator.split(history)
+                    summary = await self.summarize_history_async(key, older, business_id)
+                    reference = self.faq_reference(user_message, business_id, business_config)
+                    contents = build_contents(context, recent, user_message, summary, reference)
+
+                    with telemetry.stage("llm"):
+                        response = await deadline.wait_for("llm", model.generate_content_async(contents), DEADLINE_RESERVE)
+                finally:
+                    self.release_slot()
+                ai_response = response.text
+                self.record_usage(business_id, contents, ai_response, response)
+                logger.info(f"AI response generated for {phone_number}: {ai_response[:50]}...")
+
+                if cache_namespace and self.response_cache is not None:
+                    self.response_cache.put(cache_namespace, user_message, ai_response)
+
+            await asyncio.to_thread(self.record_turn, key, user_message, ai_response)
+            return ai_response
+
+        except Exception as e:
+            telemetry.error(e)
+            error_msg = f"Error generating response: {str(e)}"
+            logger.error(error_msg)
+            await self.log_message_async("error", phone_number, user_message, error=error_msg, business_id=business_id)
+            return FALLBACK_REPLY
+
+    async def save_conversation_async(self, phone_number, user_message, ai_response, business_id=None):
+        """Save conversation to backend database"""
+        try:
+            if not BACKEND_API_KEY:
+                return
+
+            conversation_data = self.conversation_record(phone_number, user_message, ai_response, business_id)
+
+            if self.conversation_sink is not None:
+                # Spools to disk when the queue is full
+                await asyncio.to_thread(self.conversation_sink.submit, conversation_data)
+                return
+
+            with telemetry.stage("persist"), deadline.leaving(DEADLINE_RESERVE):
+                deadline.check("persist")
+                response = await deadline.wait_for("backend:conversations", self.http.post(
+                    f"{BACKEND_API_URL}/api/conversations",
+                    json=conversation_data,
+                    headers=self.backend_headers()
+                ))
+
+            if response.status_code == 201:
+                logger.info(f"Conversation saved for {phone_number} (business: {business_id})")
+            else:
+                logger.warning(f"Failed to save conversation: {response.status_code} - {response.text}")
+
+        except DeadlineExceeded as e:
+            telemetry.error(e)
+            logger.warning(f"Conversation not saved for {phone_number}: {str(e)}")
+        except Exception as e:
+            telemetry.error(e)
+            logger.error(f"Error saving conversation: {str(e)}")
+
+    async def generate_faq_response_async(self, question, business_id=None):
+        """Generate FAQ response, from the FAQ index when confident, otherwise with Gemini"""
+        try:
+            logger.info(f"Generating FAQ response for: {question[:50]}...")
+
+            cache_namespace = f"faq:{business_id or ''}"
+            cached = self.cached_answer(cache_namespace, question)
+            if cached is not None:
+                return cached
+
+            business_config = await self.get_business_config_async(business_id) if business_id else None
+            direct_answer, model, prompt = self.prepare_faq(question, business_id, business_config)
+            if direct_answer is not None:
+                return direct_answer
+
+            if await asyncio.to_thread(self.rate_limited, business_id):
+                return RATE_LIMIT_REPLY
+            if self.over_budget(business_id):
+                return TOKEN_BUDGET_REPLY
+            if not await self.acquire_slot_async(business_id):
+                return OVERLOAD_REPLY
+            try:
+                with telemetry.stage("llm"):
+                    response = await deadline.wait_for("llm", model.generate_content_async(prompt), DEADLINE_RESERVE)
+            finally:
+                self.release_slot()
+            ai_response = response.text
+            self.record_usage(business_id, prompt, ai_response, response)
+            logger.info(f"FAQ response generated: {ai_response[:50]}...")
+
+            if self.response_cache is not None:
+                self.response_cache.put(cache_namespace, question, ai_response)
+
+            return ai_response
+
+        except Exception as e:
+            telemetry.error(e)
+            logger.error(f"Error generating FAQ response: {str(e)}")
+            return FAQ_FALLBACK_REPLY
+
+    async def stream_response_async(self, user_message, phone_number, business_id=None):
+        """Yield the AI response in chunks as Gemini generates it; the full text goes to history"""
+        started = time.perf_counter()
+        first_chunk_at = None
+        chunks = []
+        try:
+            logger.info(f"Streaming AI response for {phone_number} (business: {business_id}): {user_message[:50]}...")
+
+            if await asyncio.to_thread(self.rate_limited, business_id, phone_number):
+                yield RATE_LIMIT_REPLY
+                return
+
+            business_config = await self.get_business_config_async(business_id) if business_id else None
+            model, context = self.models.for_business(business_id, business_config, self.build_context)
+
+            key = self.conversation_key(phone_number, business_id)
+            history = await asyncio.to_thread(self.conversation_history.get, key)
+
+            cache_namespace = f"business:{business_id or ''}" if RESPONSE_CACHE_CHAT and not history else None
+            ai_response = self.cached_answer(cache_namespace, user_message) if cache_namespace else None
+
+            if ai_response is not None:
+                first_chunk_at = time.perf_counter()
+                yield ai_response
+            else:
+                if self.over_budget(business_id):
+                    yield TOKEN_BUDGET_REPLY
+                    return
+                if not await self.acquire_slot_async(business_id):
+                    yield OVERLOAD_REPLY
+                    return
+                try:
+                    older, recent = self.history_truncator.split(history)
+                    summary = await self.summarize_history_async(key, older, business_id)
+                    reference = self.faq_reference(user_message, business_id, business_config)
+                    contents = build_contents(context, recent, user_message, summary, reference)
+
+                    with telemetry.stage("llm"):
+                        stream = await model.generate_content_async(contents, stream=True)
+                        async for chunk in stream:
+                            text = chunk.text
+                            if not text:
+                                continue
+                            if first_chunk_at is None:
+                                first_chunk_at = time.perf_counter()
+                            chunks.append(text)
+                            yield text
+                finally:
+                    self.release_slot()
+                ai_response = ''.join(chunks)
+                self.record_usage(business_id, contents, ai_response, stream)
+
+                if cache_namespace and self.response_cache is not None:
+                    self.response_cache.put(cache_namespace, user_message, ai_response)
+
+            await asyncio.to_thread(self.record_turn, key, user_message, ai_response)
+            self.observe_stream(f"response for {phone_number}", started, first_chunk_at)
+
+        except Exception as e:
+            telemetry.error(e)
+            error_msg = f"Error streaming response: {str(e)}"
+            logger.error(error_msg)
+            await self.log_message_async("error", phone_number, user_message, error=error_msg, business_id=business_id)
+            if not chunks:
+                yield FALLBACK_REPLY
+
+    async def stream_faq_response_async(self, question, business_id=None):
+        """Yield the FAQ answer in chunks; index and cache hits arrive as a single chunk"""
+        started = time.perf_counter()
+        first_chunk_at = None
+        chunks = []
+        try:
+            logger.info(f"Streaming FAQ response for: {question[:50]}...")
+
+            cache_namespace = f"faq:{business_id or ''}"
+            answer = self.cached_answer(cache_namespace, question)
+            if answer is None:
+                business_config = await self.get_business_config_async(business_id) if business_id else None
+                answer, model, prompt = self.prepare_faq(question, business_id, business_config)
+            if answer is not None:
+                yield answer
+                return
+
+            if await asyncio.to_thread(self.rate_limited, business_id):
+                yield RATE_LIMIT_REPLY
+                return
+            if self.over_budget(business_id):
+                yield TOKEN_BUDGET_REPLY
+                return
+            if not await self.acquire_slot_async(business_id):
+                yield OVERLOAD_REPLY
+                return
+            try:
+                with telemetry.stage("llm"):
+                    stream = await model.generate_content_async(prompt, stream=True)
+                    async for chunk in stream:
+                        text = chunk.text
+                        if not text:
+                            continue
+                        if first_chunk_at is None:
+                            first_chunk_at = time.perf_counter()
+                        chunks.append(text)
+                        yield text
+            finally:
+                self.release_slot()
+
+            answer = ''.join(chunks)
+            self.record_usage(business_id, prompt, answer, stream)
+            if self.response_cache is not None:
+                self.response_cache.put(cache_namespace, question, answer)
+            self.observe_stream("FAQ response", started, first_chunk_at)
+
+        except Exception as e:
+            telemetry.error(e)
+            logger.error(f"Error streaming FAQ response: {str(e)}")
+            if not chunks:
+                yield FAQ_FALLBACK_REPLY
+
+
+# Created at lifespan startup, in the worker process that serves requests
+agent = None
+cluster_router = None
+
+
+class Request:
+    """Minimal view over an ASGI HTTP request"""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.method = scope['method']
+        self.path = scope['path']
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+    def form(self):
+        return {key: values[0] for key, values in parse_qs(self.body.decode('utf-8')).items()}
+
+    def form_items(self):
+        """Every (name, value) pair of the form body, blank values included"""
+        return parse_qsl(self.body.decode('utf-8'), keep_blank_values=True)
+
+    def headers(self):
+        return {name.decode('latin-1').title(): value.decode('latin-1') for name, value in self.scope['headers']}
+
+    def full_path(self):
+        query = self.scope.get('query_string')
+        return self.path + (f"?{query.decode()}" if query else '')
+
+    def url(self):
+        host = dict(self.scope['headers']).get(b'host', b'').decode('latin-1')
+        return f"{self.scope.get('scheme', 'http')}://{host}{self.full_path()}"
+
+    def wants_stream(self, data):
+        """Stream when the client asks for it in the body or accepts text/event-stream"""
+        accept = dict(self.scope['headers']).get(b'accept', b'')
+        return bool(data.get('stream')) or b'text/event-stream' in accept
+
+
+# Mirrors flask_cors' default CORS(app) behaviour
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type, Authorization"),
+]
+
+
+async def send_response(send, status, body, content_type):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+            *CORS_HEADERS
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_streaming_response(send, status, events, content_type):
+    """Send each chunk of an async iterator as soon as it is produced (chunked transfer)"""
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode()),
+            *[(name.lower().encode(), value.encode()) for name, value in SSE_HEADERS.items()],
+            *CORS_HEADERS
+        ]
+    })
+    async for event in events:
+        await send({"type": "http.response.body", "body": event.encode('utf-8'), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def sse_stream(chunks, field, on_complete=None, **done):
+    """SSE body: a 'message' event per chunk, then a 'done' event carrying the full text in `field`"""
+    parts = []
+    async for chunk in chunks:
+        parts.append(chunk)
+        yield sse_event({"text": chunk})
+    full_text = ''.join(parts)
+    if on_complete is not None:
+        await on_complete(full_text)
+    yield sse_event({**done, field: full_text}, event="done")
+
+
+def sse_response(events):
+    return 200, events, 'text/event-stream'
+
+
+def json_response(payload, status=200):
+    return status, json.dumps(payload, ensure_ascii=False), 'application/json'
+
+
+def twiml_response(message):
+    return 200, twiml_message(message), 'text/xml'
+
+
+async def business_webhook(request, business_id=None):
+    """Client-specific webhook endpoint for incoming messages"""
+    if signature_validator is not None:
+        url = signature_validator.url(request.url(), request.full_path())
+        if not signature_validator.validate(url, request.form_items(), request.headers().get(SIGNATURE_HEADER)):
+            logger.warning(f"Rejected webhook with invalid Twilio signature (ASGI): url={url}")
+            return 403, 'Invalid Twilio signature', 'text/plain'
+    values = request.form()
+    incoming_message = values.get('Body', '').strip()
+    from_number = values.get('From', '')
+    try:
+        logger.info(f"Webhook received (ASGI): business={business_id} from={from_number} message={incoming_message[:50]}")
+
+        owner = cluster_router.owner(business_id, from_number, request.headers()) if cluster_router else None
+        if owner:
+            forwarded = await forward_webhook(request, owner)
+            if forwarded is not None:
+                return forwarded
+
+        batch = None
+        if message_coalescer:
+            batch = message_coalescer.submit((business_id, from_number), incoming_message)
+            if batch is None:
+                return 200, EMPTY_TWIML, 'text/xml'
+
+        try:
+            with deadline_scope(REQUEST_DEADLINE):
+                if batch:
+                    with telemetry.stage("coalesce"):
+                        incoming_message = await message_coalescer.collect_async(batch)
+                with telemetry.stage("log"):
+                    await agent.log_message_async("incoming", from_number, incoming_message, business_id=business_id)
+                with telemetry.stage("generate"):
+                    ai_response = await agent.generate_response_async(incoming_message, from_number, business_id)
+                with telemetry.stage("log"):
+                    await agent.log_message_async("outgoing", from_number, ai_response, response=ai_response,
+                                                  business_id=business_id)
+                await agent.save_conversation_async(from_number, incoming_message, ai_response, business_id)
+        finally:
+            if batch:
+                message_coalescer.finish(batch)
+
+        with telemetry.stage("twiml"):
+            return twiml_response(ai_response)
+
+    except Exception as e:
+        telemetry.error(e)
+        error_msg = f"Error in business webhook: {str(e)}"
+        logger.error(error_msg)
+        await agent.log_message_async("error", from_number or 'unknown', incoming_message, error=error_msg,
+                                      business_id=business_id)
+        return twiml_response(FALLBACK_REPLY)
+
+
+async def forward_webhook(request, owner):
+    """Relay a webhook to the node that owns the conversation; None if it can't be reached"""
+    path = request.full_path()
+    headers = {**cluster_router.forward_headers(request.headers()), 'Content-Type': 'application/x-www-form-urlencoded'}
+    started = time.perf_counter()
+    try:
+        with telemetry.stage("forward"):
+            response = await agent.http.post(owner + path, content=request.body, headers=headers,
+                                             timeout=httpx.Timeout(cluster_router.timeout[1],
+                                                                   connect=cluster_router.timeout[0]))
+    except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+        cluster_router.record(owner, started, e)
+        return None
+    finally:
+        cluster_router.release()
+    cluster_router.record(owner, started)
+    return response.status_code, response.content, response.headers.get('content-type', 'text/xml')
+
+
+async def invalidate_business_config(request, business_id):
+    """Drop a cached business config; called by the backend when a config is saved"""
+    headers = dict(request.scope['headers'])
+    if BACKEND_API_KEY and headers.get(b'authorization', b'').decode() != f"Bearer {BACKEND_API_KEY}":
+        return json_response({"error": "Unauthorized"}, 401)
+    removed = await asyncio.to_thread(agent.invalidate_business, business_id)
+    logger.info(f"Business config cache invalidated for {business_id} (cached: {removed})")
+    return json_response({"business_id": business_id, "invalidated": removed})
+
+
+async def token_usage(request):
+    """Today's token usage of the busiest businesses, and the flush counters"""
+    if agent.token_ledger is None:
+        return json_response({"enabled": False})
+    try:
+        limit = int(parse_qs(request.scope.get('query_string', b'').decode()).get('limit', ['50'])[0])
+    except ValueError:
+        limit = 50
+    limit = min(limit, MESSAGE_QUERY_MAX_LIMIT)
+    return json_response({"enabled": True, "businesses": agent.token_ledger.top(limit), **agent.token_ledger.stats()})
+
+
+async def business_token_usage(request, business_id):
+    """Today's tokens in and out for one business, per endpoint, against its budget"""
+    if agent.token_ledger is None:
+        return json_response({"enabled": False})
+    return json_response({"enabled": True, **agent.token_ledger.usage(business_id)})
+
+
+async def business_stats(request, business_id):
+    """Messages per hour, unique senders, error rate and reply latency of a business over the last `days` days"""
+    if agent.analytics is None:
+        return json_response({"enabled": False})
+    try:
+        days = int(parse_qs(request.scope.get('query_string', b'').decode()).get('days', ['7'])[0])
+    except ValueError:
+        days = 7
+    return json_response({"enabled": True, **agent.analytics.summary(business_id, days)})
+
+
+async def subsystem_stats(request):
+    """Counters of every subsystem (queues, caches, admission, persistence...); ?subsystem=a,b for some of them"""
+    subsystems = parse_qs(request.scope.get('query_string', b'').decode()).get('subsystem', [None])[0]
+    stats = collect_stats(stats_providers(agent, cluster_router), subsystems)
+    if stats is None:
+        return json_response({"error": "Unknown subsystem"}, 404)
+    return json_response(stats)
+
+
+async def metrics(request):
+    """Prometheus metrics: stage latency, LLM tokens, errors, cache hits and in-flight requests"""
+    return 200, telemetry.registry.render(), telemetry.CONTENT_TYPE
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    return json_response({
+        "status": "healthy",
+        "service": "ai-agent",
+        "timestamp": datetime.now().isoformat()
+    })
+
+
+async def test_ai(request):
+    """Test AI response without Twilio"""
+    try:
+        data = request.json() or {}
+        message = data.get('message', '')
+        phone_number = data.get('phone_number', 'test_user')
+        business_id = data.get('business_id')
+
+        if not message:
+            return json_response({"error": "Message is required"}, 400)
+
+        if request.wants_stream(data):
+            async def save(ai_response):
+                if business_id:
+                    await agent.save_conversation_async(phone_number, message, ai_response, business_id)
+            chunks = agent.stream_response_async(message, phone_number, business_id)
+            return sse_response(sse_stream(
+                chunks, "ai_response", save, user_message=message, success=True, business_id=business_id
+            ))
+
+        ai_response = await agent.generate_response_async(message, phone_number, business_id)
+
+        if business_id:
+            await agent.save_conversation_async(phone_number, message, ai_response, business_id)
+
+        return json_response({
+            "user_message": message,
+            "ai_response": ai_response,
+            "success": True,
+            "business_id": business_id
+        })
+
+    except Exception as e:
+        logger.error(f"Error in test endpoint: {str(e)}")
+        return json_response({"error": "Internal server error"}, 500)
+
+
+async def ai_response(request):
+    data = request.json() or {}
+    message = data.get('message', '')
+    if not message:
+        return json_response({'reply': 'No message provided.'}, 400)
+    if request.wants_stream(data):
+        return sse_response(sse_stream(agent.stream_response_async(message, phone_number='whatsapp'), 'reply'))
+    try:
+        ai_reply = await agent.generate_response_async(message, phone_number='whatsapp', business_id=None)
+        return json_response({'reply': ai_reply})
+    except Exception as e:
+        return json_response({'reply': f'Error: {str(e)}'}, 500)
+
+
+async def faq(request):
+    """FAQ endpoint for handling FAQ questions"""
+    try:
+        data = request.json() or {}
+        question = data.get('question')
+        if not question:
+            return json_response({'error': 'Missing question'}, 400)
+
+        if request.wants_stream(data):
+            return sse_response(sse_stream(agent.stream_faq_response_async(question, data.get('business_id')), 'answer'))
+
+        answer = await agent.generate_faq_response_async(question, data.get('business_id'))
+        return json_response({'answer': answer})
+
+    except Exception as e:
+        logger.error(f"Error in FAQ endpoint: {str(e)}")
+        return json_response({'error': 'Internal server error'}, 500)
+
+
+ROUTES = [
+    ('POST', re.compile(r'^/webhook/(?P<business_id>[^/]+)$'), business_webhook),
+    ('POST', re.compile(r'^/webhook$'), business_webhook),
+    ('GET', re.compile(r'^/health$'), health_check),
+    ('POST', re.compile(r'^/cache/invalidate/(?P<business_id>[^/]+)$'), invalidate_business_config),
+    ('GET', re.compile(r'^/tokens$'), token_usage),
+    ('GET', re.compile(r'^/tokens/(?P<business_id>[^/]+)$'), business_token_usage),
+    ('GET', re.compile(r'^/stats$'), subsystem_stats),
+    ('GET', re.compile(r'^/stats/(?P<business_id>[^/]+)$'), business_stats),
+    ('GET', re.compile(r'^/metrics$'), metrics),
+    ('POST', re.compile(r'^/test$'), test_ai),
+    ('POST', re.compile(r'^/ai-response$'), ai_response),
+    ('POST', re.compile(r'^/faq$'), faq),
+]
+
+
+# Handlers whose stages are timed, with the endpoint label they are reported under
+TRACED_HANDLERS = {
+    business_webhook: 'webhook',
+    test_ai: 'test',
+    ai_response: 'ai_response',
+    faq: 'faq',
+}
+
+
+def traced_business_id(request, params):
+    """business_id from the path, or from the JSON body of API calls"""
+    if 'business_id' in params:
+        return params['business_id']
+    try:
+        data = request.json()
+    except ValueError:
+        return None
+    return data.get('business_id') if isinstance(data, dict) else None
+
+
+async def lifespan(receive, send):
+    global agent, cluster_router
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if ASYNC_REPLIES:
+                await send({'type': 'lifespan.startup.failed',
+                            'message': 'ASYNC_REPLIES is not supported by the ASGI app; run app.py for async replies'})
+                return
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(ASGI_BLOCKING_THREADS, thread_name_prefix='asgi-blocking'))
+            init_runtime()
+            agent = AsyncCustomerSupportAgent()
+            cluster_router = create_cluster_router()
+            agent.http = httpx.AsyncClient(
+                timeout=httpx.Timeout(BACKEND_READ_TIMEOUT, connect=BACKEND_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=ASGI_MAX_CONNECTIONS,
+                    max_keepalive_connections=ASGI_MAX_KEEPALIVE
+                )
+            )
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if agent.http is not None:
+                await agent.http.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+    request = Request(scope, body)
+    for method, pattern, handler in ROUTES:
+        match = pattern.match(request.path)
+        if match:
+            if request.method == 'OPTIONS':
+                return await send_response(send, 204, b'', 'text/plain')
+            if request.method != method:
+                return await send_response(send, 405, '{"error": "Method not allowed"}', 'application/json')
+            params = match.groupdict()
+            endpoint = TRACED_HANDLERS.get(handler)
+            # The trace stays open while a streamed answer is sent
+            with telemetry.request(endpoint, traced_business_id(request, params)) if endpoint else nullcontext():
+                status, payload, content_type = await handler(request, **params)
+                if hasattr(payload, '__aiter__'):
+                    return await send_streaming_response(send, status, payload, content_type)
+                return await send_response(send, status, payload, content_type)
+
+    await send_response(send, 404, '{"error": "Not found"}', 'application/json')
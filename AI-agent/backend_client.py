@@ -0,0 +1,187 @@
+"""
+HTTP client for the Node backend API.
+
+Owns one pooled keep-alive requests.Session so every call to
+BACKEND_API_URL reuses an open TCP/TLS connection, and adds connect/read
+timeouts, bounded retries with exponential backoff, a circuit breaker and
+per-endpoint latency histograms. Under a request deadline, timeouts are
+cut to the time left and retries that wouldn't fit are skipped.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import deadline
+from deadline import DeadlineExceeded
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {502, 503, 504}
+
+
+def _never_sent(error):
+    """True when the request failed before reaching the backend"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class BackendUnavailable(Exception):
+    """Raised when the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Open after N consecutive failures, allow a probe after reset_timeout"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trips = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        return self.state != "open"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.trips.inc()
+                    logger.warning(f"Backend circuit breaker opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+class BackendClient:
+    """Pooled session with timeouts, retries and a circuit breaker"""
+
+    def __init__(self, base_url, api_key=None, connect_timeout=3.05, read_timeout=10.0,
+                 max_retries=2, backoff_factor=0.2, pool_size=10,
+                 breaker_threshold=5, breaker_reset=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+
+        self.session = requests.Session()
+        # pool_block caps concurrent connections per host at pool_size
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+        self.latency = {}
+        self.errors = {}
+        self.retries = Counter()
+        self._lock = threading.Lock()
+
+    def _metrics(self, endpoint):
+        with self._lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram()
+                self.errors[endpoint] = Counter()
+            return self.latency[endpoint], self.errors[endpoint]
+
+    def request(self, method, path, endpoint=None, idempotent=None, **kwargs):
+        """Send a request, retrying transient failures with backoff"""
+        endpoint = endpoint or path
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'PUT', 'DELETE')
+        if not self.breaker.allow():
+            raise BackendUnavailable(f"Backend circuit open, skipping {method} {path}")
+
+        latency, errors = self._metrics(endpoint)
+        timeout = kwargs.pop('timeout', self.timeout)
+        stage = f"backend:{endpoint}"
+        attempt = 0
+        while True:
+            deadline.check(stage)
+            attempt_timeout = deadline.cap(timeout)
+            backoff = self.backoff_factor * (2 ** attempt)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", timeout=attempt_timeout, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                latency.observe(time.perf_counter() - started)
+                # A refused/failed connect never reached the backend, so it is always safe to retry
+                retryable = idempotent or _never_sent(e)
+                error = e
+            except requests.exceptions.Timeout as e:
+                latency.observe(time.perf_counter() - started)
+                if attempt_timeout != timeout:
+                    # Cut short by the request deadline, not a slow backend; leave the breaker alone
+                    errors.inc()
+                    deadline.stats.missed(stage)
+                    raise DeadlineExceeded(stage) from e
+                retryable = idempotent
+                error = e
+            else:
+                latency.observe(time.perf_counter() - started)
+                if (response.status_code in RETRYABLE_STATUS and idempotent and attempt < self.max_retries
+                        and deadline.fits(backoff)):
+                    error, retryable = None, True
+                else:
+                    if response.status_code >= 500:
+                        errors.inc()
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    return response
+
+            if not retryable or attempt >= self.max_retries or not deadline.fits(backoff):
+                errors.inc()
+                self.breaker.record_failure()
+                if retryable and attempt < self.max_retries:
+                    deadline.stats.missed(stage)
+                raise error
+            attempt += 1
+            self.retries.inc()
+            time.sleep(backoff)
+
+    def get(self, path, endpoint=None, **kwargs):
+        return self.request('GET', path, endpoint=endpoint, **kwargs)
+
+    def post(self, path, endpoint=None, **kwargs):
+        return self.request('POST', path, endpoint=endpoint, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            endpoints = list(self.latency)
+        return {
+            "circuit_state": self.breaker.state,
+            "circuit_trips": self.breaker.trips.value,
+            "retries": self.retries.value,
+            "endpoints": {
+                endpoint: {
+                    "errors": self.errors[endpoint].value,
+                    "latency_seconds": self.latency[endpoint].snapshot()
+                }
+                for endpoint in endpoints
+            }
+        }
@@ -0,0 +1,119 @@
+"""
+Admission control under a noisy tenant.
+
+The fake Gemini model serves at most --provider-capacity calls at once
+(a stand-in for the account's quota); extra calls wait for it. One
+business floods the agent with --burst messages at once while quiet
+businesses send a message every --quiet-interval seconds, and a single sender
+spams --spam messages. The run is repeated with admission control off
+and on, and reports the quiet tenants' latency, LLM calls made and how
+the noisy traffic was turned away.
+
+Usage: python -m benchmarks.bench_admission [--burst 300] [--latency 0.2] [--store memory|redis]
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeBackend, FakeGenerativeModel, FakeRedis, import_app, install_fake_gemini, percentile
+
+
+class QuotaLimitedModel(FakeGenerativeModel):
+    """Fake model that only serves `capacity` calls at a time, like a provider quota"""
+
+    slots = None
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        with QuotaLimitedModel.slots:
+            return super().generate_content(contents, stream=stream, **kwargs)
+
+
+def run(app_module, admission, args):
+    agent = app_module.agent
+    agent.admission = admission
+    FakeGenerativeModel.calls = 0
+    quiet_latencies = []
+    replies = {}
+    lock = threading.Lock()
+
+    def send(business_id, sender, message, quiet=False):
+        started = time.perf_counter()
+        reply = agent.generate_response(message, sender, business_id)
+        elapsed = time.perf_counter() - started
+        with lock:
+            replies[reply] = replies.get(reply, 0) + 1
+            if quiet:
+                quiet_latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.burst + args.quiet * 2 + args.spam) as pool:
+        for index in range(args.burst):
+            pool.submit(send, 'noisy', f"whatsapp:+1555{index:07d}", f"Flood #{index}")
+        for index in range(args.spam):
+            pool.submit(send, 'spammy', "whatsapp:+15550000001", f"Spam #{index}")
+        for index in range(args.quiet):
+            time.sleep(args.quiet_interval)
+            pool.submit(send, f"quiet-{index % 5}", f"whatsapp:+1666{index:07d}", f"Question #{index}", True)
+    wall = time.perf_counter() - started
+
+    labels = {
+        app_module.RATE_LIMIT_REPLY: "rate limited",
+        app_module.OVERLOAD_REPLY: "overloaded",
+        app_module.FALLBACK_REPLY: "fallback"
+    }
+    outcome = ", ".join(f"{labels.get(reply, 'answered')}={count}" for reply, count in sorted(
+        replies.items(), key=lambda item: labels.get(item[0], '')))
+    label = "admission on" if admission else "admission off"
+    print(f"{label:<14} quiet p50={percentile(quiet_latencies, 50) * 1000:7.0f}ms "
+          f"p99={percentile(quiet_latencies, 99) * 1000:7.0f}ms  llm_calls={FakeGenerativeModel.calls:4d}  "
+          f"wall={wall:5.1f}s")
+    print(f"{'':<14} {outcome}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--burst', type=int, default=300)
+    parser.add_argument('--quiet', type=int, default=40)
+    parser.add_argument('--quiet-interval', type=float, default=0.05)
+    parser.add_argument('--spam', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--provider-capacity', type=int, default=8)
+    parser.add_argument('--store', choices=['memory', 'redis'], default='memory')
+    args = parser.parse_args()
+
+    install_fake_gemini(args.latency)
+    import google.generativeai as genai
+    genai.GenerativeModel = QuotaLimitedModel
+    QuotaLimitedModel.slots = threading.BoundedSemaphore(args.provider_capacity)
+
+    with FakeBackend() as backend, FakeRedis() as redis:
+        app_module = import_app(BACKEND_API_URL=backend.url, BACKEND_API_KEY='', LLM_MAX_CONCURRENCY=args.provider_capacity)
+        from admission import create_admission_controller
+
+        def controller():
+            return create_admission_controller(
+                redis.url if args.store == 'redis' else 'memory://',
+                max_concurrency=app_module.LLM_MAX_CONCURRENCY,
+                queue_timeout=app_module.LLM_QUEUE_TIMEOUT,
+                max_queued_per_business=app_module.LLM_MAX_QUEUED_PER_BUSINESS,
+                business_rate=app_module.BUSINESS_RATE_LIMIT,
+                business_burst=app_module.BUSINESS_RATE_BURST,
+                sender_rate=app_module.SENDER_RATE_LIMIT,
+                sender_burst=app_module.SENDER_RATE_BURST
+            )
+
+        # Warm the business config cache so both runs see the same backend cost
+        for business_id in ['noisy', 'spammy', *[f"quiet-{index}" for index in range(5)]]:
+            app_module.agent.get_business_config(business_id)
+
+        run(app_module, None, args)
+        admission = controller()
+        run(app_module, admission, args)
+        stats = admission.stats()
+        print(f"{'':<14} queue wait p99={stats['queue_wait']['p99']}s, limiter={stats['limiter']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Message analytics: catch-up throughput, /stats query time, sketch accuracy
+and restarts.
+
+Writes --days daily message logs ending today, --messages conversations a
+day across --businesses businesses with skewed traffic. Each conversation
+is an incoming message and, --llm-latency (lognormal median) later, the
+reply; --error-ratio of them log an error before the fallback reply.
+Scenarios:
+
+- catch-up: first pass of MessageAnalytics over all the logs, in lines
+            per second
+- query:    µs per summary() of the busiest business over 1, 7 and 30
+            days, against reparsing the same days' JSON lines, which is
+            what answering it took before
+- accuracy: unique senders and p50/p90/p99 reply latency from the
+            sketches, against the exact values from the generator, for
+            the busiest, a middle and the quietest business it generated
+- tail:     one pass after --tail more conversations were appended today
+- restart:  a new instance on the same directories: past days come from
+            the analytics_YYYYMMDD.json snapshots, only today is reparsed.
+            Its answers must match the first instance's. Also reports the
+            memory the loaded rollups take.
+
+Usage: python -m benchmarks.bench_analytics [--days 30] [--messages 20000] [--businesses 200]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from benchmarks.fakes import AGENT_DIR
+
+sys.path.insert(0, AGENT_DIR)
+
+from analytics import MessageAnalytics  # noqa: E402
+
+
+class Traffic:
+    """Conversations for a set of businesses, written as message log lines, with the exact answers kept"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        # Zipf-like: business-0 gets the most traffic
+        self.weights = [1.0 / (rank + 1) for rank in range(args.businesses)]
+        self.senders = {}
+        self.latencies = {}
+
+    def entry(self, timestamp, direction, business_id, phone, message, error=None):
+        return json.dumps({
+            "timestamp": timestamp.isoformat(),
+            "direction": direction,
+            "phone_number": phone,
+            "message": message,
+            "response": message if direction == "outgoing" else None,
+            "error": error,
+            "business_id": business_id
+        }, ensure_ascii=False)
+
+    def day_lines(self, day, count, start_second=0):
+        midnight = datetime.combine(day, datetime.min.time())
+        events = []
+        for index in range(count):
+            business = self.rng.choices(range(self.args.businesses), self.weights)[0]
+            business_id = f"business-{business}"
+            # Each business has a pool of senders, a few of them regulars
+            pool = 50 + 20000 // (business + 1)
+            phone = f"whatsapp:+1555{business:03d}{int(self.rng.paretovariate(1.2) * 7) % pool:05d}"
+            asked = midnight + timedelta(seconds=start_second + self.rng.uniform(0, 86399 - start_second - 120))
+            latency = min(self.rng.lognormvariate(0, 0.6) * self.args.llm_latency, 100)
+            message = f"Hello, I have a question about my order number {self.rng.randrange(10 ** 6)}"
+            events.append((asked, self.entry(asked, "incoming", business_id, phone, message)))
+            if self.rng.random() < self.args.error_ratio:
+                events.append((asked + timedelta(seconds=latency / 2),
+                               self.entry(asked, "error", business_id, phone, message, error="LLM timeout")))
+            events.append((asked + timedelta(seconds=latency),
+                           self.entry(asked + timedelta(seconds=latency), "outgoing", business_id, phone,
+                                      "Thanks for your message, your order ships tomorrow.")))
+            self.senders.setdefault((day, business_id), set()).add(phone)
+            self.latencies.setdefault((day, business_id), []).append(latency)
+        events.sort(key=lambda event: event[0])
+        return ''.join(line + '\n' for _, line in events)
+
+    def ranked(self):
+        """Businesses that got traffic, busiest first"""
+        replies = {}
+        for (_, business_id), latencies in self.latencies.items():
+            replies[business_id] = replies.get(business_id, 0) + len(latencies)
+        return sorted(replies, key=replies.get, reverse=True)
+
+    def exact(self, business_id, days):
+        wanted = [date.today() - timedelta(days=offset) for offset in range(days)]
+        senders = set().union(*(self.senders.get((day, business_id), set()) for day in wanted))
+        latencies = [value for day in wanted for value in self.latencies.get((day, business_id), [])]
+        return len(senders), latencies
+
+
+def path(directory, day):
+    return os.path.join(directory, f"messages_{day.strftime('%Y%m%d')}.log")
+
+
+def reparse(directory, business_id, days):
+    """The summary the way it was built before: read and filter every line of the window's logs"""
+    incoming = errors = 0
+    senders = set()
+    hourly = {}
+    for offset in range(days):
+        try:
+            f = open(path(directory, date.today() - timedelta(days=offset)), encoding='utf-8')
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["business_id"] != business_id:
+                    continue
+                hourly[entry["timestamp"][:13]] = hourly.get(entry["timestamp"][:13], 0) + 1
+                if entry["direction"] == "incoming":
+                    incoming += 1
+                    senders.add(entry["phone_number"])
+                elif entry["direction"] == "error":
+                    errors += 1
+    return incoming, errors, len(senders), hourly
+
+
+def quantile(values, q):
+    """Exact percentile, ranked the way LatencySketch.quantile() ranks"""
+    ordered = sorted(values)
+    return ordered[int(q / 100 * (len(ordered) - 1))]
+
+
+def timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--businesses', type=int, default=200)
+    parser.add_argument('--llm-latency', type=float, default=1.5)
+    parser.add_argument('--error-ratio', type=float, default=0.02)
+    parser.add_argument('--tail', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    logs, state = tempfile.mkdtemp(prefix='ai-agent-bench-'), tempfile.mkdtemp(prefix='ai-agent-bench-')
+    traffic = Traffic(args)
+    today = date.today()
+    size = 0
+    for offset in range(args.days - 1, -1, -1):
+        day = today - timedelta(days=offset)
+        with open(path(logs, day), 'w', encoding='utf-8') as f:
+            size += f.write(traffic.day_lines(day, args.messages if offset else args.messages // 2))
+    print(f"logs     {args.days} days, {size / 1024 / 1024:.0f} MB, {args.businesses} businesses")
+
+    analytics = MessageAnalytics(logs, state_dir=state, retention_days=args.days, interval=0)
+    started = time.perf_counter()
+    lines = analytics.catch_up()
+    elapsed = time.perf_counter() - started
+    stats = analytics.stats()
+    print(f"catch-up {lines} lines in {elapsed:.2f}s ({lines / elapsed:,.0f} lines/s)  {stats['rollups']} rollups, "
+          f"{stats['snapshots_written']} days snapshotted")
+
+    # Busiest, middle and quietest business of the generated traffic, whatever --businesses is
+    ranked = traffic.ranked()
+    busiest, sampled = ranked[0], list(dict.fromkeys([ranked[0], ranked[len(ranked) // 2], ranked[-1]]))
+    for days in sorted({min(days, args.days) for days in (1, 7, 30)}):
+        fast, summary = timed(lambda: analytics.summary(busiest, days), 200)
+        slow, (incoming, errors, _, _) = timed(lambda: reparse(logs, busiest, days), 1)
+        assert (summary["incoming"], summary["errors"]) == (incoming, errors), (summary, incoming, errors)
+        print(f"query    {busiest} over {days:2d} days: summary {fast * 1e6:8.0f}us  reparse {slow * 1e3:8.0f}ms  "
+              f"x{slow / fast:,.0f}")
+
+    print("accuracy (sketch vs exact)")
+    for business_id in sampled:
+        summary = analytics.summary(business_id, args.days)
+        senders, latencies = traffic.exact(business_id, args.days)
+        latency = summary["latency"]
+        errors = [abs(latency[f"p{q}"] - quantile(latencies, q)) / quantile(latencies, q) * 100
+                  for q in (50, 90, 99)]
+        print(f"  {business_id:<14} senders {summary['unique_senders']:6d} vs {senders:6d} "
+              f"({(summary['unique_senders'] - senders) / senders * 100:+5.1f}%)  latency p50/p90/p99 "
+              f"{latency['p50']:.2f}/{latency['p90']:.2f}/{latency['p99']:.2f}s, "
+              f"off by {errors[0]:.1f}/{errors[1]:.1f}/{errors[2]:.1f}%  ({latency['count']} replies)")
+
+    with open(path(logs, today), 'a', encoding='utf-8') as f:
+        f.write(traffic.day_lines(today, args.tail, start_second=43200))
+    started = time.perf_counter()
+    lines = analytics.catch_up()
+    print(f"tail     {lines} new lines in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    restarted = MessageAnalytics(logs, state_dir=state, retention_days=args.days, interval=0)
+    started = time.perf_counter()
+    lines = restarted.catch_up()
+    elapsed = time.perf_counter() - started
+    for business_id in sampled:
+        before, after = analytics.summary(business_id, args.days), restarted.summary(business_id, args.days)
+        for key in ("incoming", "outgoing", "errors", "unique_senders", "hourly"):
+            assert before[key] == after[key], (business_id, key)
+    print(f"restart  {restarted.stats()['snapshots_loaded']} snapshots loaded, {lines} lines reparsed in "
+          f"{elapsed:.2f}s (first start: {args.days} days reparsed); answers match")
+    restarted.close()
+
+    tracemalloc.start()
+    loaded = MessageAnalytics(logs, state_dir=state, retention_days=args.days, interval=0)
+    loaded.catch_up()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"memory   {loaded.stats()['rollups']} rollups ({args.businesses} businesses x {args.days} days) "
+          f"in {held / 1024 / 1024:.1f} MB")
+
+    shutil.rmtree(logs, ignore_errors=True)
+    shutil.rmtree(state, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
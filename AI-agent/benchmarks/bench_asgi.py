@@ -0,0 +1,82 @@
+"""
+Concurrent throughput: Flask (one sync worker) vs. the ASGI entry point.
+
+Both servers answer POST /test with a stubbed Gemini model that sleeps for
+--llm-latency seconds, so the numbers reflect how many conversations a
+single process can hold in flight.
+
+Usage: python -m benchmarks.bench_asgi [--requests 200] [--concurrency 50] [--llm-latency 0.5]
+"""
+
+import argparse
+import asyncio
+import logging
+import threading
+import time
+
+import httpx
+
+from benchmarks.fakes import import_app, install_fake_gemini
+
+
+async def drive(url, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        async def one(index):
+            async with semaphore:
+                response = await client.post(f"{url}/test", json={
+                    "message": f"Where is my order #{index}?",
+                    "phone_number": f"bench_{index}"
+                })
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(count)))
+        return time.perf_counter() - started
+
+
+def serve_flask(flask_app):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, flask_app, threaded=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def serve_asgi(asgi_app):
+    import uvicorn
+    config = uvicorn.Config(asgi_app, host='127.0.0.1', port=0, log_level='warning')
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    args = parser.parse_args()
+
+    install_fake_gemini(args.llm_latency)
+    app_module = import_app(BACKEND_API_KEY='')
+    import asgi
+
+    flask_server, flask_url = serve_flask(app_module.app)
+    asgi_server, asgi_url = serve_asgi(asgi.app)
+
+    for label, url in (("flask", flask_url), ("asgi", asgi_url)):
+        elapsed = asyncio.run(drive(url, args.requests, args.concurrency))
+        print(f"{label:<6} {args.requests} requests @ concurrency {args.concurrency}: "
+              f"{elapsed:6.2f}s  {args.requests / elapsed:8.1f} req/s")
+
+    flask_server.shutdown()
+    asgi_server.should_exit = True
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Webhook ack latency: inline replies vs. the async reply pipeline.
+
+Usage: python -m benchmarks.bench_async_webhook [--requests 50] [--llm-latency 0.5]
+"""
+
+import argparse
+import statistics
+import time
+
+from benchmarks.fakes import FakeBackend, FakeTwilio, import_app, install_fake_gemini, percentile
+
+
+def drive(client, count):
+    latencies = []
+    for index in range(count):
+        started = time.perf_counter()
+        client.post('/webhook/bench-business', data={
+            "Body": f"Hello #{index}",
+            "From": f"whatsapp:+1555000{index:04d}",
+            "To": "whatsapp:+14155238886"
+        })
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(label, latencies):
+    print(f"{label:<8} p50={percentile(latencies, 50) * 1000:8.2f}ms "
+          f"p99={percentile(latencies, 99) * 1000:8.2f}ms "
+          f"mean={statistics.mean(latencies) * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    install_fake_gemini(args.llm_latency)
+    with FakeBackend() as backend, FakeTwilio() as twilio:
+        app_module = import_app(BACKEND_API_URL=backend.url, BACKEND_API_KEY='bench-key')
+        from reply_dispatcher import ReplyDispatcher, TwilioReplySender
+        client = app_module.app.test_client()
+
+        report("inline", drive(client, args.requests))
+
+        app_module.reply_dispatcher = ReplyDispatcher(
+            app_module.process_message,
+            TwilioReplySender('ACfake', 'token', api_url=twilio.url),
+            workers=args.workers,
+            queue_size=args.requests
+        )
+        report("async", drive(client, args.requests))
+        started = time.perf_counter()
+        app_module.reply_dispatcher.join()
+        print(f"async drain took {time.perf_counter() - started:.2f}s, "
+              f"fake Twilio received {len(twilio.messages)} messages")
+        stats = app_module.reply_dispatcher.stats()
+        print(f"end-to-end p95 <= {stats['end_to_end_seconds']['p95']}s, "
+              f"failed={stats['failed']} rejected={stats['rejected']}")
+        app_module.reply_dispatcher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Per-request overhead of backend API calls: module-level requests.get
+(new connection every call) vs. the pooled BackendClient session.
+
+Usage: python -m benchmarks.bench_backend_client [--requests 500]
+"""
+
+import argparse
+import time
+
+import requests
+
+from benchmarks.fakes import AGENT_DIR, FakeBackend
+
+import sys
+sys.path.insert(0, AGENT_DIR)
+
+from backend_client import BackendClient  # noqa: E402
+
+
+def bench(label, call, count):
+    started = time.perf_counter()
+    for index in range(count):
+        response = call(f"/api/setup/status/business-{index % 10}")
+        assert response.status_code == 200
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {count} GETs: {elapsed:6.3f}s  {elapsed / count * 1e6:8.1f}us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    with FakeBackend() as backend:
+        headers = {"Authorization": "Bearer bench", "Content-Type": "application/json"}
+        bench("requests", lambda path: requests.get(f"{backend.url}{path}", headers=headers), args.requests)
+
+        client = BackendClient(backend.url, "bench")
+        bench("pooled", lambda path: client.get(path, endpoint="setup_status"), args.requests)
+        print(f"pooled p50/p99: {client.stats()['endpoints']['setup_status']['latency_seconds']['p50']}s / "
+              f"{client.stats()['endpoints']['setup_status']['latency_seconds']['p99']}s")
+
+
+if __name__ == '__main__':
+    main()
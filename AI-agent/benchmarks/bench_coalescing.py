@@ -0,0 +1,134 @@
+"""
+Replay bursty WhatsApp traffic through the webhook with and without coalescing.
+
+By default a synthetic trace is generated: each sender writes a few
+bursts of 1-4 short messages, a fraction of a second apart, with longer
+pauses between bursts. Pass --log messages_YYYYMMDD.log to replay the
+incoming messages of a real message log with their original timing
+(compressed by --speed). Each message is posted at its offset on its own
+thread, as Twilio would.
+
+Reports LLM calls, replies sent and how often two generations for the
+same conversation overlapped (their replies can arrive out of order).
+
+Usage: python -m benchmarks.bench_coalescing [--senders 40] [--window 1.0] [--llm-latency 1.0] [--log FILE]
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.fakes import FakeBackend, FakeGenerativeModel, import_app, install_fake_gemini, percentile
+
+SHORT_MESSAGES = ["hi", "hello", "I have a question", "about my order", "it hasn't arrived", "order #48213",
+                  "can you check?", "also", "how do I get a refund", "thanks", "?", "it's urgent"]
+
+
+def synthetic_trace(senders, bursts, seed=11):
+    """[(offset seconds, business_id, sender, message)] sorted by offset"""
+    rng = random.Random(seed)
+    trace = []
+    for sender_index in range(senders):
+        sender = f"whatsapp:+1555{sender_index:07d}"
+        business_id = f"business-{sender_index % 4}"
+        offset = rng.uniform(0, 3)
+        for _ in range(bursts):
+            for _ in range(rng.randint(1, 4)):
+                trace.append((offset, business_id, sender, rng.choice(SHORT_MESSAGES)))
+                offset += rng.uniform(0.2, 0.9)
+            offset += rng.uniform(5, 8)
+    return sorted(trace)
+
+
+def log_trace(path, speed):
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get('direction') == 'incoming' and entry.get('message'):
+                started = datetime.fromisoformat(entry['timestamp']).timestamp()
+                entries.append((started, entry.get('business_id'), entry['phone_number'], entry['message']))
+    entries.sort()
+    first = entries[0][0] if entries else 0
+    return [((started - first) / speed, business_id, sender, message)
+            for started, business_id, sender, message in entries]
+
+
+def replay(app_module, trace):
+    client = app_module.app.test_client()
+    agent = app_module.agent
+    generate = agent.generate_response
+    lock = threading.Lock()
+    active = {}
+    overlaps = [0]
+    replies = []
+
+    def tracked(user_message, phone_number, business_id=None):
+        key = (business_id, phone_number)
+        with lock:
+            active[key] = active.get(key, 0) + 1
+            if active[key] > 1:
+                overlaps[0] += 1
+        try:
+            return generate(user_message, phone_number, business_id)
+        finally:
+            with lock:
+                active[key] -= 1
+
+    agent.generate_response = tracked
+
+    def post(start, offset, business_id, sender, message):
+        time.sleep(max(0.0, start + offset - time.perf_counter()))
+        posted = time.perf_counter()
+        path = f"/webhook/{business_id}" if business_id else "/webhook"
+        response = client.post(path, data={"Body": message, "From": sender, "To": "whatsapp:+14155238886"})
+        if b'<Message>' in response.data:
+            with lock:
+                replies.append(time.perf_counter() - posted)
+
+    FakeGenerativeModel.calls = 0
+    start = time.perf_counter() + 0.1
+    with ThreadPoolExecutor(max_workers=min(len(trace), 256)) as pool:
+        for offset, business_id, sender, message in trace:
+            pool.submit(post, start, offset, business_id, sender, message)
+    agent.generate_response = generate
+    return FakeGenerativeModel.calls, replies, overlaps[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--senders', type=int, default=40)
+    parser.add_argument('--bursts', type=int, default=3)
+    parser.add_argument('--window', type=float, default=1.0)
+    parser.add_argument('--max-wait', type=float, default=4.0)
+    parser.add_argument('--llm-latency', type=float, default=1.0)
+    parser.add_argument('--log')
+    parser.add_argument('--speed', type=float, default=1.0)
+    args = parser.parse_args()
+
+    trace = log_trace(args.log, args.speed) if args.log else synthetic_trace(args.senders, args.bursts)
+    print(f"{len(trace)} messages from {len({(b, s) for _, b, s, _ in trace})} conversations "
+          f"over {trace[-1][0]:.1f}s")
+
+    install_fake_gemini(args.llm_latency)
+    with FakeBackend() as backend:
+        app_module = import_app(BACKEND_API_URL=backend.url, BACKEND_API_KEY='')
+        from coalescer import MessageCoalescer
+
+        for label, coalescer in (("off", None), ("on", MessageCoalescer(args.window, args.max_wait))):
+            app_module.message_coalescer = coalescer
+            calls, replies, overlaps, wall = replay(app_module, trace)
+            print(f"coalescing {label:<4} llm_calls={calls:4d} replies={len(replies):4d} "
+                  f"overlapping_generations={overlaps:3d} reply p50={percentile(replies, 50):5.2f}s "
+                  f"p99={percentile(replies, 99):5.2f}s wall={wall:5.1f}s")
+            if coalescer:
+                stats = coalescer.stats()
+                print(f"{'':<16}avg batch {stats['avg_batch_size']} messages, {stats['merged']} merged")
+
+
+if __name__ == '__main__':
+    main()
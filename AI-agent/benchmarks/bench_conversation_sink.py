@@ -0,0 +1,78 @@
+"""
+Conversation persistence: inline POST per message vs. the batched sink,
+plus a backend outage that is absorbed by the spool and replayed.
+
+Usage: python -m benchmarks.bench_conversation_sink [--requests 300] [--backend-latency 0.05]
+"""
+
+import argparse
+import os
+import time
+
+from benchmarks.fakes import FakeBackend, import_app, install_fake_gemini, percentile
+
+
+def drive(client, count, offset=0):
+    latencies = []
+    for index in range(offset, offset + count):
+        started = time.perf_counter()
+        client.post('/webhook/bench-business', data={
+            "Body": f"Hello #{index}",
+            "From": f"whatsapp:+1555{index:07d}",
+            "To": "whatsapp:+14155238886"
+        })
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(label, latencies):
+    print(f"{label:<22} p50={percentile(latencies, 50) * 1000:8.2f}ms p99={percentile(latencies, 99) * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--backend-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    install_fake_gemini(0.0)
+    with FakeBackend(latency=args.backend_latency) as backend:
+        app_module = import_app(BACKEND_API_URL=backend.url, BACKEND_API_KEY='bench-key',
+                                PERSIST_FLUSH_INTERVAL='0.2', PERSIST_REPLAY_INTERVAL='0.5',
+                                BACKEND_BREAKER_RESET='1')
+        client = app_module.app.test_client()
+        sink = app_module.agent.conversation_sink
+        drive(client, 5)
+        sink.flush()
+
+        app_module.agent.conversation_sink = None
+        report("inline POST", drive(client, args.requests))
+
+        app_module.agent.conversation_sink = sink
+        before = len(backend.conversations)
+        report("batched sink", drive(client, args.requests))
+        sink.flush()
+        stats = sink.stats()
+        print(f"  delivered {len(backend.conversations) - before} records in "
+              f"{stats['batches']} batches (p50 batch {stats['batch_latency']['p50']}s)")
+
+        backend.down = True
+        report("sink, backend down", drive(client, args.requests))
+        sink.flush()
+        print(f"  spooled {sink.stats()['spool_pending']} records, "
+              f"spool file {os.path.getsize(sink.spool_path)} bytes")
+
+        backend.down = False
+        started = time.perf_counter()
+        report("sink, recovering", drive(client, args.requests))
+        while sink.stats()['spool_pending'] and time.perf_counter() - started < 30:
+            time.sleep(0.05)
+        sink.flush()
+        stats = sink.stats()
+        expected = 5 + args.requests * 4
+        print(f"  replayed {stats['replayed']} records; backend has {len(backend.conversations)}/{expected} "
+              f"conversations, {stats['spool_pending']} still spooled")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Memory footprint of conversation history under many distinct senders.
+
+Compares the original unbounded dict-of-lists-of-dicts layout against
+InMemoryConversationStore with its LRU cap and __slots__ turns.
+
+Usage: python -m benchmarks.bench_conversation_store [--senders 1000000] [--max-conversations 10000]
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+
+from benchmarks.fakes import AGENT_DIR
+
+sys.path.insert(0, AGENT_DIR)
+
+from conversation_store import InMemoryConversationStore  # noqa: E402
+
+
+def fill_dict(senders, max_turns):
+    history = {}
+    for index in range(senders):
+        phone_number = f"whatsapp:+1{index:010d}"
+        if phone_number not in history:
+            history[phone_number] = []
+        history[phone_number].append({"role": "user", "message": "What are your business hours?"})
+        history[phone_number].append({"role": "assistant", "message": "We are open 24/7."})
+        if len(history[phone_number]) > max_turns:
+            history[phone_number] = history[phone_number][-max_turns:]
+    return history
+
+
+def fill_store(senders, max_turns, max_conversations):
+    store = InMemoryConversationStore(max_conversations=max_conversations, max_turns=max_turns)
+    for index in range(senders):
+        store.append(f"whatsapp:+1{index:010d}", [
+            ("user", "What are your business hours?"),
+            ("assistant", "We are open 24/7.")
+        ])
+    return store
+
+
+def measure(label, fill):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fill()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} retained={current / 2**20:9.1f} MiB  peak={peak / 2**20:9.1f} MiB  "
+          f"conversations={len(result):>9}  {elapsed:6.2f}s")
+    del result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--senders', type=int, default=1_000_000)
+    parser.add_argument('--max-turns', type=int, default=20)
+    parser.add_argument('--max-conversations', type=int, default=10000)
+    args = parser.parse_args()
+
+    measure("dict", lambda: fill_dict(args.senders, args.max_turns))
+    measure("store", lambda: fill_store(args.senders, args.max_turns, args.max_conversations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Webhook latency with and without a request deadline when a dependency stalls.
+
+Each scenario posts --requests webhooks at once, every one for a new
+business so the config is fetched from the backend, with inline
+(non-batched) conversation saves:
+
+- healthy:       backend and Gemini answer quickly
+- slow_backend:  config fetches and saves take --stall seconds
+- stalled_llm:   Gemini takes --stall seconds
+
+With the deadline on, config loads and saves are cut short or skipped
+and Gemini is abandoned in time to send the fallback reply, so no
+webhook runs past --deadline (Twilio gives up after 15s).
+
+Usage: python -m benchmarks.bench_deadlines [--requests 20] [--deadline 3] [--stall 6]
+"""
+
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeBackend, FakeGenerativeModel, import_app, install_fake_gemini, percentile
+
+
+def run(app_module, backend, label, requests):
+    client = app_module.app.test_client()
+    saved_before = len(backend.conversations)
+    misses_before = dict(app_module.deadline.stats.snapshot()['misses'])
+
+    def post(index):
+        started = time.perf_counter()
+        response = client.post(f"/webhook/{label}-{index}", data={
+            "Body": "Where is my order?",
+            "From": f"whatsapp:+1555{index:07d}",
+            "To": "whatsapp:+14155238886"
+        })
+        return time.perf_counter() - started, b'having trouble' in response.data
+
+    with ThreadPoolExecutor(requests) as pool:
+        results = list(pool.map(post, range(requests)))
+    latencies = [latency for latency, _ in results]
+    misses = {stage: count - misses_before.get(stage, 0)
+              for stage, count in app_module.deadline.stats.snapshot()['misses'].items()
+              if count > misses_before.get(stage, 0)}
+    return latencies, sum(fallback for _, fallback in results), len(backend.conversations) - saved_before, misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--deadline', type=float, default=3.0)
+    parser.add_argument('--stall', type=float, default=6.0)
+    parser.add_argument('--llm-latency', type=float, default=0.3)
+    parser.add_argument('--backend-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    install_fake_gemini(args.llm_latency)
+    with FakeBackend(latency=args.backend_latency) as backend:
+        # One pooled connection per request: waiting for a free connection isn't bounded by the deadline
+        app_module = import_app(BACKEND_API_URL=backend.url, BACKEND_API_KEY='bench', PERSIST_ASYNC='false',
+                                BACKEND_POOL_SIZE=args.requests)
+        # Every request misses its deadline in the stalled scenarios; don't log each one
+        logging.getLogger().setLevel(logging.CRITICAL)
+        # Scale the time kept free for Gemini down with the benchmark's shorter deadline
+        app_module.DEADLINE_LLM_MIN_TIME = args.deadline / 3
+
+        scenarios = [
+            ("healthy", args.backend_latency, args.llm_latency),
+            ("slow_backend", args.stall, args.llm_latency),
+            ("stalled_llm", args.backend_latency, args.stall),
+        ]
+        for name, backend_latency, llm_latency in scenarios:
+            backend.latency = backend_latency
+            FakeGenerativeModel.latency = llm_latency
+            for budget in (0, args.deadline):
+                app_module.REQUEST_DEADLINE = budget
+                label = f"{name}-{'on' if budget else 'off'}"
+                latencies, fallbacks, saved, misses = run(app_module, backend, label, args.requests)
+                print(f"{name:<13} deadline={'off' if not budget else f'{budget:.0f}s':<4} "
+                      f"p50={percentile(latencies, 50):5.2f}s p99={percentile(latencies, 99):5.2f}s "
+                      f"max={max(latencies):5.2f}s fallbacks={fallbacks:3d} saved={saved:3d} misses={misses}")
+                # Let abandoned backend calls and Gemini threads drain before the next run
+                if budget and backend_latency + llm_latency > budget:
+                    time.sleep(args.stall)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark FAQ retrieval on a large synthetic FAQ.
+
+Builds a FAQIndex over --entries generated question/answer pairs, then
+queries it with paraphrases of known entries and with unrelated questions,
+reporting index build time, p50/p99 search latency and how often a
+question would be answered directly (no LLM call) at the configured
+threshold.
+
+Usage: python -m benchmarks.bench_faq_index [--entries 10000] [--queries 2000] [--threshold 0.8]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from benchmarks.fakes import AGENT_DIR, percentile
+
+sys.path.insert(0, AGENT_DIR)
+
+from faq_index import FAQEntry, FAQIndex  # noqa: E402
+
+TOPICS = ["order", "refund", "shipping", "invoice", "password", "account", "subscription", "warranty",
+          "delivery", "payment", "appointment", "reservation", "membership", "voucher", "return"]
+ACTIONS = ["cancel", "change", "track", "update", "renew", "transfer", "pause", "extend", "confirm", "upgrade"]
+QUALIFIERS = ["international", "express", "monthly", "annual", "business", "family", "student", "premium",
+              "gift", "corporate", "weekend", "holiday", "online", "in-store", "mobile"]
+PHRASINGS = ["How do I {action} my {qualifier} {topic}?", "Can I {action} a {qualifier} {topic}?",
+             "Is it possible to {action} the {qualifier} {topic}?"]
+
+
+def synthetic_faq(count, seed=11):
+    rng = random.Random(seed)
+    seen = set()
+    entries = []
+    while len(entries) < count:
+        action, qualifier, topic = rng.choice(ACTIONS), rng.choice(QUALIFIERS), rng.choice(TOPICS)
+        code = rng.randint(1, 9999)
+        key = (action, qualifier, topic, code)
+        if key in seen:
+            continue
+        seen.add(key)
+        question = f"How do I {action} my {qualifier} {topic} {code}?"
+        entries.append((key, FAQEntry(question, f"To {action} a {qualifier} {topic} {code}, visit your account.")))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    args = parser.parse_args()
+
+    faq = synthetic_faq(args.entries)
+    started = time.perf_counter()
+    index = FAQIndex(entry for _, entry in faq)
+    print(f"built index over {len(index)} entries in {(time.perf_counter() - started) * 1000:.1f}ms "
+          f"({len(index.postings)} terms)")
+
+    rng = random.Random(3)
+    for label, known in (("paraphrased", True), ("unrelated", False)):
+        latencies = []
+        direct = correct = 0
+        for _ in range(args.queries):
+            if known:
+                key, entry = rng.choice(faq)
+                action, qualifier, topic, code = key
+                question = rng.choice(PHRASINGS).format(action=action, qualifier=qualifier, topic=f"{topic} {code}")
+            else:
+                entry = None
+                question = f"Do you sell {rng.choice(['bikes', 'shoes', 'phones'])} in {rng.choice(['Paris', 'Rome'])}?"
+            started = time.perf_counter()
+            matches = index.search(question, 3)
+            latencies.append(time.perf_counter() - started)
+            if matches and matches[0][1] >= args.threshold:
+                direct += 1
+                correct += matches[0][0] is entry
+        print(f"{label:<12} queries={args.queries} direct={direct / args.queries:.1%} "
+              f"correct_direct={correct}/{direct} "
+              f"p50={percentile(latencies, 50) * 1e6:.0f}us p99={percentile(latencies, 99) * 1e6:.0f}us")
+
+
+if __name__ == '__main__':
+    main()
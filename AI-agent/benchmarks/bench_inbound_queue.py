@@ -0,0 +1,179 @@
+"""
+Durable inbound queue: ack cost, drain throughput, dedup and crash recovery.
+
+Replies are "generated" by a handler that sleeps --llm-latency and sent
+to the fake Twilio API. Scenarios:
+
+- submit:   time to accept one webhook (the ack path), in-memory queue vs
+            SQLite queue
+- drain:    messages answered per second by --workers workers; every
+            message comes from a different sender, so none are merged
+- dedup:    every message is delivered once more with probability
+            --retry-ratio, right away or after it was answered, as Twilio
+            does when it gives up on a webhook. Reports the LLM calls the
+            duplicates caused and the share of duplicates dropped.
+- recovery: a child process drains the queue and dies (os._exit) after
+            --crash-after replies. A new dispatcher on the same file picks
+            up the leased and queued messages once the lease runs out.
+            Messages come from --senders senders, so a conversation's
+            waiting messages are answered together. Reports how many were
+            recovered, the time to drain them, and messages answered twice
+            (delivery is at-least-once).
+
+Usage: python -m benchmarks.bench_inbound_queue [--messages 500] [--workers 8] [--llm-latency 0.05]
+           [--retry-ratio 0.2] [--crash-after 50] [--lease 1]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from benchmarks.fakes import AGENT_DIR, FakeTwilio, percentile
+
+sys.path.insert(0, AGENT_DIR)
+
+from inbound_queue import DurableReplyDispatcher, InboundQueue  # noqa: E402
+from reply_dispatcher import ReplyDispatcher, TwilioReplySender  # noqa: E402
+
+
+class Handler:
+    """Stands in for process_message: sleeps like an LLM call and counts calls"""
+
+    def __init__(self, latency, crash_after=None):
+        self.latency = latency
+        self.crash_after = crash_after
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, business_id, from_number, to_number, message):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            if self.crash_after is not None and self.calls > self.crash_after:
+                os._exit(1)
+        return f"Reply to {message}"
+
+
+def messages(count, senders):
+    """(MessageSid, business_id, From, To, Body) for `count` webhooks"""
+    return [(f"SM{index:032x}", f"business-{index % 10}", f"whatsapp:+1555{index % senders:07d}",
+             "whatsapp:+14155238886", f"Message #{index}") for index in range(count)]
+
+
+def build(kind, handler, twilio, path, args, **queue_options):
+    sender = TwilioReplySender('AC' + '0' * 32, 'token', api_url=twilio.url)
+    if kind == 'memory':
+        return ReplyDispatcher(handler, sender, workers=args.workers, queue_size=args.messages * 2)
+    inbound = InboundQueue(path, **queue_options)
+    return DurableReplyDispatcher(handler, sender, inbound, workers=args.workers, queue_size=args.messages * 2,
+                                  poll_interval=0.05)
+
+
+def submit(dispatcher, message):
+    sid, business_id, from_number, to_number, body = message
+    return dispatcher.submit(business_id, from_number, to_number, body, message_sid=sid)
+
+
+def bench_submit_and_drain(kind, twilio, args):
+    workdir = tempfile.mkdtemp(prefix='ai-agent-bench-')
+    handler = Handler(args.llm_latency)
+    dispatcher = build(kind, handler, twilio, os.path.join(workdir, 'inbound.db'), args)
+    batch = messages(args.messages, args.messages)
+    latencies = []
+    started = time.perf_counter()
+    for message in batch:
+        submitted = time.perf_counter()
+        submit(dispatcher, message)
+        latencies.append(time.perf_counter() - submitted)
+    dispatcher.join()
+    wall = time.perf_counter() - started
+    dispatcher.shutdown()
+    print(f"{kind:<8} submit p50={percentile(latencies, 50) * 1e6:7.1f}us p99={percentile(latencies, 99) * 1e6:7.1f}us  "
+          f"drain {args.messages / wall:7.1f} msg/s ({handler.calls} LLM calls, {args.workers} workers)")
+
+
+def bench_dedup(kind, twilio, args):
+    workdir = tempfile.mkdtemp(prefix='ai-agent-bench-')
+    handler = Handler(args.llm_latency)
+    dispatcher = build(kind, handler, twilio, os.path.join(workdir, 'inbound.db'), args)
+    rng = random.Random(args.seed)
+    batch = messages(args.messages, args.messages)
+    late = []
+    duplicates = 0
+    for message in batch:
+        submit(dispatcher, message)
+        if rng.random() < args.retry_ratio:
+            duplicates += 1
+            if rng.random() < 0.5:
+                submit(dispatcher, message)
+            else:
+                late.append(message)
+    dispatcher.join()
+    for message in late:
+        submit(dispatcher, message)
+    dispatcher.join()
+    dispatcher.shutdown()
+    extra = handler.calls - args.messages
+    dropped = getattr(dispatcher, 'duplicates', None)
+    dropped = dropped.value if dropped is not None else 0
+    print(f"{kind:<8} duplicates sent={duplicates} dropped={dropped} ({dropped / max(duplicates, 1) * 100:.0f}%) "
+          f"extra LLM calls={extra}")
+
+
+def bench_recovery(twilio, args):
+    workdir = tempfile.mkdtemp(prefix='ai-agent-bench-')
+    path = os.path.join(workdir, 'inbound.db')
+    batch = messages(args.messages, args.senders)
+    pid = os.fork()
+    if pid == 0:
+        dispatcher = build('durable', Handler(args.llm_latency, crash_after=args.crash_after), twilio, path, args,
+                           lease=args.lease)
+        for message in batch:
+            submit(dispatcher, message)
+        dispatcher.join()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    crashed_at = time.perf_counter()
+    counts = InboundQueue(path).counts()
+    handler = Handler(args.llm_latency)
+    dispatcher = build('durable', handler, twilio, path, args, lease=args.lease)
+    dispatcher.join()
+    drained = time.perf_counter() - crashed_at
+    stats = dispatcher.stats()
+    dispatcher.shutdown()
+    # A reply covers every message of its conversation that was claimed with it, one per line
+    replies = Counter(body for sent in twilio.messages for body in sent['Body'][len("Reply to "):].split("\n"))
+    answered = sum(1 for _, _, _, _, body in batch if replies[body])
+    twice = sum(1 for count in replies.values() if count > 1)
+    print(f"recovery left by crash: {counts}  recovered={stats['recovered']} answered by new process="
+          f"{handler.calls} calls in {drained:.2f}s  messages answered={answered}/{len(batch)} answered twice={twice}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--senders', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--llm-latency', type=float, default=0.05)
+    parser.add_argument('--retry-ratio', type=float, default=0.2)
+    parser.add_argument('--crash-after', type=int, default=50)
+    parser.add_argument('--lease', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with FakeTwilio() as twilio:
+        for kind in ('memory', 'durable'):
+            bench_submit_and_drain(kind, twilio, args)
+        for kind in ('memory', 'durable'):
+            bench_dedup(kind, twilio, args)
+        twilio.requests.clear()
+        bench_recovery(twilio, args)
+
+
+if __name__ == '__main__':
+    main()
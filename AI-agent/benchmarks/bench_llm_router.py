@@ -0,0 +1,100 @@
+"""
+LLM router: tail latency with hedging, and failover when a provider breaks.
+
+Provider "primary" is fast but has a slow tail (--tail-ratio of calls take
+--tail-latency); "secondary" is slower but steady. Each scenario sends
+--requests calls from --concurrency threads:
+
+- single:   primary only, no router features
+- routed:   both providers, routed by latency, no hedging
+- hedged:   both providers, second request after the primary's p95
+- failover: hedged router where the primary starts failing halfway through
+
+A final check sends one call and one stream through GeminiRESTProvider
+against the local fake Gemini REST API.
+
+Usage: python -m benchmarks.bench_llm_router [--requests 400] [--concurrency 16] [--tail-ratio 0.03]
+"""
+
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import AGENT_DIR, FakeGeminiAPI, FakeProvider, percentile
+
+sys.path.insert(0, AGENT_DIR)
+
+from llm_providers import GeminiRESTProvider, LLMRouter, RoutedModel  # noqa: E402
+
+
+def drive(router, args, break_primary=None):
+    model = RoutedModel(router, "You are a helpful assistant.")
+    latencies = []
+    failures = [0]
+
+    def one(index):
+        if break_primary is not None and index == args.requests // 2:
+            break_primary.error_rate = 1.0
+        started = time.perf_counter()
+        try:
+            model.generate_content([{"role": "user", "parts": [f"Question #{index}"]}])
+        except Exception:
+            failures[0] += 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    return latencies, failures[0]
+
+
+def providers(args):
+    primary = FakeProvider("primary", latency=args.latency, tail_latency=args.tail_latency,
+                           tail_ratio=args.tail_ratio, seed=4)
+    secondary = FakeProvider("secondary", latency=args.latency * 2, seed=2)
+    return primary, secondary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--tail-latency', type=float, default=2.0)
+    parser.add_argument('--tail-ratio', type=float, default=0.03)
+    args = parser.parse_args()
+    # Failover warnings are expected here
+    logging.getLogger().setLevel(logging.ERROR)
+
+    scenarios = [
+        ("single", lambda p, s: LLMRouter([p], explore=0.0), False),
+        ("routed", lambda p, s: LLMRouter([p, s]), False),
+        ("hedged", lambda p, s: LLMRouter([p, s], hedge=True, hedge_delay=args.latency * 3), False),
+        ("failover", lambda p, s: LLMRouter([p, s], hedge=True, hedge_delay=args.latency * 3, cooldown=5), True),
+    ]
+    for label, build, breaks in scenarios:
+        primary, secondary = providers(args)
+        router = build(primary, secondary)
+        latencies, failures = drive(router, args, primary if breaks else None)
+        stats = router.stats()
+        hedges = sum(provider['hedges'] for provider in stats['providers'].values())
+        print(f"{label:<9} p50={percentile(latencies, 50) * 1000:7.0f}ms p95={percentile(latencies, 95) * 1000:7.0f}ms "
+              f"p99={percentile(latencies, 99) * 1000:7.0f}ms failed={failures:3d} "
+              f"calls primary/secondary={primary.calls}/{secondary.calls} hedges={hedges} "
+              f"failovers={stats['failovers']}")
+
+    with FakeGeminiAPI(latency=0.01) as api:
+        provider = GeminiRESTProvider('fake-key', 'gemini-1.5-flash', api_url=api.url)
+        started = time.perf_counter()
+        text = provider.generate([{"role": "user", "parts": ["Hello"]}], system="Be brief.")
+        chunks = list(provider.stream("Hello"))
+        path, payload = api.requests[0]
+        assert payload['systemInstruction']['parts'][0]['text'] == "Be brief."
+        print(f"gemini_rest generate+stream {(time.perf_counter() - started) * 1000:.0f}ms: "
+              f"{text[:30]!r}, {len(chunks)} chunks")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Query a multi-GB message log: readlines() vs. tail seek vs. the SQLite index.
+
+Generates --size-mb of synthetic message log lines spread over --days daily
+files (skipped if they already exist in --dir), then times:
+  - the original /messages read (readlines() of today's file), only for
+    files up to --legacy-max-mb since it holds the whole file in memory
+  - tail_lines for the latest page
+  - the initial index build and an incremental catch-up
+  - filtered queries (phone number, business, direction, date range) and
+    deep cursor pagination
+
+Usage: python -m benchmarks.bench_message_index [--size-mb 2048] [--days 4] [--dir /tmp/msglog]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.fakes import AGENT_DIR, percentile
+
+sys.path.insert(0, AGENT_DIR)
+
+from message_index import MessageLogIndex, tail_lines  # noqa: E402
+
+PHONES = 50000
+BUSINESSES = 200
+
+
+def generate(directory, size_mb, days, seed=5):
+    """Write roughly size_mb of log lines split evenly across `days` daily files"""
+    rng = random.Random(seed)
+    first_day = date(2024, 1, 1)
+    per_day = size_mb * 1024 * 1024 // days
+    for index in range(days):
+        day = first_day + timedelta(days=index)
+        path = os.path.join(directory, f"messages_{day.strftime('%Y%m%d')}.log")
+        if os.path.exists(path) and os.path.getsize(path) >= per_day:
+            continue
+        written = 0
+        second = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            while written < per_day:
+                lines = []
+                for _ in range(1000):
+                    second += 1
+                    phone = f"whatsapp:+1555{rng.randrange(PHONES):07d}"
+                    direction = rng.choice(("incoming", "outgoing"))
+                    message = "Hello, I have a question about my order number %d" % rng.randrange(10 ** 6)
+                    lines.append(json.dumps({
+                        "timestamp": f"{day.isoformat()}T{second // 3600 % 24:02d}:{second // 60 % 60:02d}:"
+                                     f"{second % 60:02d}.{second % 1000000:06d}",
+                        "direction": direction,
+                        "phone_number": phone,
+                        "message": message,
+                        "response": message if direction == "outgoing" else None,
+                        "error": None,
+                        "business_id": f"biz-{rng.randrange(BUSINESSES)}"
+                    }))
+                chunk = "\n".join(lines) + "\n"
+                f.write(chunk)
+                written += len(chunk)
+    return [(first_day + timedelta(days=index)).strftime('%Y%m%d') for index in range(days)]
+
+
+def timed(label, fn, repeat=1):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    if repeat == 1:
+        print(f"{label:<44} {samples[0] * 1000:10.2f}ms")
+    else:
+        print(f"{label:<44} p50={percentile(samples, 50) * 1000:8.2f}ms p99={percentile(samples, 99) * 1000:8.2f}ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=2048)
+    parser.add_argument('--days', type=int, default=4)
+    parser.add_argument('--dir')
+    parser.add_argument('--legacy-max-mb', type=int, default=512)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix='ai-agent-msglog-')
+    os.makedirs(directory, exist_ok=True)
+    days = timed(f"generate {args.size_mb}MB over {args.days} files", lambda: generate(directory, args.size_mb, args.days))
+    latest = os.path.join(directory, f"messages_{days[-1]}.log")
+    latest_mb = os.path.getsize(latest) / 1024 / 1024
+
+    if latest_mb <= args.legacy_max_mb:
+        def legacy():
+            with open(latest, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+                return [json.loads(line.strip()) for line in lines[-20:]]
+        timed(f"readlines() last 20 of {latest_mb:.0f}MB file", legacy, repeat=3)
+    else:
+        print(f"readlines() skipped: {latest_mb:.0f}MB file exceeds --legacy-max-mb")
+
+    timed("tail_lines last 20", lambda: tail_lines(latest, 20), repeat=args.repeat)
+
+    index_path = os.path.join(directory, 'message_index.db')
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    index = MessageLogIndex(directory)
+    rows = timed("initial index build", lambda: sum(index.catch_up(day) for day in days))
+    print(f"  indexed {rows} lines, index size {os.path.getsize(index_path) / 1024 / 1024:.0f}MB")
+
+    with open(latest, 'a', encoding='utf-8') as f:
+        for second in range(100):
+            f.write(json.dumps({"timestamp": f"2099-01-01T00:00:{second % 60:02d}", "direction": "incoming",
+                                "phone_number": "whatsapp:+15550000001", "message": "new",
+                                "business_id": "biz-1"}) + "\n")
+    timed("catch-up after 100 new lines", lambda: index.catch_up(days[-1]))
+
+    rng = random.Random(9)
+    timed("latest page (no filters)", lambda: index.query(20), repeat=args.repeat)
+    timed("filter phone_number", lambda: index.query(
+        20, phone_number=f"whatsapp:+1555{rng.randrange(PHONES):07d}"), repeat=args.repeat)
+    timed("filter business_id + direction", lambda: index.query(
+        20, business_id=f"biz-{rng.randrange(BUSINESSES)}", direction="incoming"), repeat=args.repeat)
+    first, last = days[0], days[-1]
+    since = f"{first[:4]}-{first[4:6]}-{first[6:]}"
+    timed("date range (first day, 1h window)", lambda: index.query(
+        20, since=f"{since}T05:00:00", until=f"{since}T06:00:00"), repeat=args.repeat)
+
+    def paginate(pages):
+        cursor = None
+        for _ in range(pages):
+            _, cursor = index.query(100, cursor, business_id="biz-7")
+        return cursor
+    timed("100 pages x 100 (business_id)", lambda: paginate(100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Webhook latency with message/app logging off, inline, and queued.
+
+Modes:
+  off     no message log, app log at WARNING
+  legacy  open/append/close of the message log per entry, app log handlers run inline
+  sync    one open handle per day, app log handlers run inline
+  async   MessageLogWriter background batching, app log behind a QueueHandler
+
+--write-delay-ms adds a sleep to every write() on the log files to model a
+slow or contended disk (network volumes, log shippers, fsync stalls). On a
+fast local disk the modes are close; the queue matters when writes block.
+
+Usage: python -m benchmarks.bench_message_log [--requests 2000] [--concurrency 8] [--write-delay-ms 0]
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from logging.handlers import QueueHandler
+
+from benchmarks.fakes import FakeBackend, import_app, install_fake_gemini, percentile
+
+
+class SlowFile:
+    """File wrapper whose writes block for a fixed delay"""
+
+    def __init__(self, f, delay):
+        self._f = f
+        self._delay = delay
+
+    def write(self, data):
+        time.sleep(self._delay)
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+
+class LegacyMessageLog:
+    """The original per-message open/append/close"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def write(self, entry):
+        with SlowFile(open(self.path(), 'a', encoding='utf-8'), self.delay) as f:
+            f.write(f"{json.dumps(entry, ensure_ascii=False)}\n")
+
+    def path(self):
+        return f"messages_{datetime.now().strftime('%Y%m%d')}.log"
+
+
+def drive(app_module, count, concurrency):
+    def one(index):
+        client = app_module.app.test_client()
+        started = time.perf_counter()
+        client.post('/webhook/bench-business', data={
+            "Body": f"Hello, I have a question about my order #{index}",
+            "From": f"whatsapp:+1555{index:07d}",
+            "To": "whatsapp:+14155238886"
+        })
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(one, range(count)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--write-delay-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    delay = args.write_delay_ms / 1000.0
+
+    install_fake_gemini(0.0)
+    with FakeBackend() as backend:
+        app_module = import_app(BACKEND_API_URL=backend.url, BACKEND_API_KEY='')
+        from message_log import MessageLogWriter
+
+        root = logging.getLogger()
+        queue_handler = next(handler for handler in root.handlers if isinstance(handler, QueueHandler))
+        file_handler = app_module.log_handlers[0]
+        # Keep the console out of the measurement
+        app_module.log_listener.handlers = (file_handler,)
+        if delay:
+            file_handler.stream = SlowFile(file_handler.stream, delay)
+
+        def writer(background):
+            message_log = MessageLogWriter('.', background=background)
+            if delay:
+                message_log._file = SlowFile(open(message_log.path(), 'a', encoding='utf-8'), delay)
+                message_log._day = datetime.now().strftime('%Y%m%d')
+            return message_log
+
+        modes = {
+            "off": (None, [queue_handler], logging.WARNING),
+            "legacy": (LegacyMessageLog(delay), [file_handler], logging.INFO),
+            "sync": (writer(False), [file_handler], logging.INFO),
+            "async": (writer(True), [queue_handler], logging.INFO),
+        }
+        # Warm up imports, connection pool and caches
+        drive(app_module, 50, args.concurrency)
+        for label, (message_log, handlers, level) in modes.items():
+            app_module.agent.message_log = message_log
+            root.handlers = handlers
+            root.setLevel(level)
+            latencies = drive(app_module, args.requests, args.concurrency)
+            if hasattr(message_log, 'flush'):
+                message_log.flush()
+            print(f"{label:<7} p50={percentile(latencies, 50) * 1000:7.2f}ms "
+                  f"p99={percentile(latencies, 99) * 1000:7.2f}ms "
+                  f"mean={statistics.mean(latencies) * 1000:7.2f}ms")
+        root.handlers = [queue_handler]
+        stats = modes['async'][0].stats()
+        print(f"async writer: {stats['written']} entries in {stats['batches']} batches "
+              f"(avg {stats['avg_batch_size']}), dropped={stats['dropped']}, encoder={stats['encoder']}")
+
+
+if __name__ == '__main__':
+    main()
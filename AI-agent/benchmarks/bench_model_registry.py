@@ -0,0 +1,75 @@
+"""
+Per-request CPU overhead and prompt bytes: a new GenerativeModel and
+context f-string per request vs. the ModelRegistry.
+
+Uses the real google.generativeai classes (model construction makes no
+network calls), so the CPU numbers include SDK object setup.
+
+Usage: python -m benchmarks.bench_model_registry [--iterations 20000]
+"""
+
+import argparse
+import time
+
+from benchmarks.fakes import import_app
+
+CONFIG = {
+    'name': 'Acme Store',
+    'tone': 'friendly',
+    'language': 'English',
+    'specialties': 'Online retail of home goods',
+    'business_hours': '9am-5pm'
+}
+
+
+def cpu_per_call(fn, iterations):
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    app_module = import_app(BACKEND_API_KEY='')
+    import google.generativeai as genai
+    from history import build_contents
+    agent = app_module.agent
+    question = "What are your business hours?"
+    entries = [entry for entry, _ in agent.faqs.for_business(None, None).search(question, app_module.FAQ_TOP_K)]
+
+    def old_business():
+        context = agent.build_context(CONFIG)
+        model = genai.GenerativeModel(app_module.GEMINI_MODEL)
+        return model, build_contents(context, [], question)
+
+    def new_business():
+        model, context = agent.models.for_business('acme', CONFIG, agent.build_context)
+        return model, build_contents(context, [], question)
+
+    def old_faq():
+        model = genai.GenerativeModel(app_module.GEMINI_MODEL)
+        return model, agent.build_faq_prompt(question, entries)
+
+    def new_faq():
+        model, preamble_turn = agent.models.faq_model(app_module.FAQ_PREAMBLE)
+        return model, agent.build_faq_prompt(question, entries, inline_preamble=preamble_turn is not None)
+
+    print(f"system_instruction supported by SDK: {agent.models.supports_system_instruction}")
+    for label, old, new in (("business", old_business, new_business), ("faq", old_faq, new_faq)):
+        old_us = cpu_per_call(old, args.iterations)
+        new_us = cpu_per_call(new, args.iterations)
+        print(f"{label:<9} cpu/request old={old_us:7.2f}us new={new_us:7.2f}us")
+
+    old_bytes = len(agent.build_faq_prompt(question, entries).encode())
+    _, preamble_turn = agent.models.faq_model(app_module.FAQ_PREAMBLE)
+    new_bytes = len(agent.build_faq_prompt(question, entries, inline_preamble=preamble_turn is not None).encode())
+    print(f"faq prompt bytes per request old={old_bytes} new={new_bytes} "
+          f"(preamble {'bound to the model' if preamble_turn is None else 'sent inline'})")
+
+
+if __name__ == '__main__':
+    main()
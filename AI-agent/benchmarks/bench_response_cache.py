@@ -0,0 +1,77 @@
+"""
+Replay a stream of repeated customer questions through the response cache.
+
+By default a synthetic log of paraphrased FAQ questions mixed with unique
+ones is generated. Pass --log messages_YYYYMMDD.log to replay the
+incoming messages from a real message log instead.
+
+Usage: python -m benchmarks.bench_response_cache [--questions 20000] [--threshold 0.85] [--log FILE]
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from benchmarks.fakes import AGENT_DIR
+
+sys.path.insert(0, AGENT_DIR)
+
+from response_cache import ResponseCache  # noqa: E402
+
+PARAPHRASES = [
+    ["What are your business hours?", "what are your hours", "Business hours?", "what are your business hours??",
+     "What are the business hours", "Hours of business?"],
+    ["How can I contact support?", "how do I contact support", "Contact support?", "how can i contact your support"],
+    ["Where are you located?", "where are you located", "Where is your location?", "Located where?"],
+    ["What services do you offer?", "what services do you offer", "Which services do you offer?"],
+    ["How do I reset my password?", "how to reset my password", "reset password?", "How can I reset my password"],
+]
+
+
+def synthetic_log(count, unique_ratio, seed=7):
+    rng = random.Random(seed)
+    for index in range(count):
+        if rng.random() < unique_ratio:
+            yield f"Where is my order number {rng.randint(10000, 99999)}?"
+        else:
+            prefix = rng.choice(["", "Hi, ", "hello! ", "Hey "])
+            suffix = rng.choice(["", " please", " thanks", "?"])
+            yield prefix + rng.choice(rng.choice(PARAPHRASES)) + suffix
+
+
+def log_questions(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get('direction') == 'incoming' and entry.get('message'):
+                yield entry['message']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--questions', type=int, default=20000)
+    parser.add_argument('--unique-ratio', type=float, default=0.2)
+    parser.add_argument('--threshold', type=float, default=0.85)
+    parser.add_argument('--log')
+    args = parser.parse_args()
+
+    questions = list(log_questions(args.log) if args.log else synthetic_log(args.questions, args.unique_ratio))
+    for label, similarity in (("exact", False), ("exact+tfidf", True)):
+        cache = ResponseCache(maxsize_per_namespace=1000, similarity_threshold=args.threshold, similarity=similarity)
+        llm_calls = 0
+        started = time.perf_counter()
+        for question in questions:
+            if cache.get("faq", question) is None:
+                llm_calls += 1
+                cache.put("faq", question, f"answer to {question}")
+        elapsed = time.perf_counter() - started
+        stats = cache.stats()
+        print(f"{label:<12} questions={len(questions)} llm_calls={llm_calls} hit_rate={stats['hit_rate']:.3f} "
+              f"(exact={stats['exact_hits']} similar={stats['similar_hits']}) "
+              f"{elapsed / len(questions) * 1e6:7.1f}us/lookup")
+
+
+if __name__ == '__main__':
+    main()
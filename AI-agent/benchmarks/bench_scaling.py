@@ -0,0 +1,207 @@
+"""
+Scale-out: webhook throughput with 1 to N worker processes.
+
+Starts the fake backend and the fake Gemini REST API, then, for each
+worker count, serves the agent with gunicorn.conf.py and drives signed
+/webhook/<business_id> posts at a fixed concurrency. The response cache
+is off, so every message costs one LLM call. Two layouts:
+
+- workers: one gunicorn with -w N. The kernel spreads connections over
+           the workers; SHARED_STATE_URL (a SQLite file) gives all of
+           them the same history, configs and rate limits.
+- ring:    N single-worker nodes on their own ports, all listed in
+           CLUSTER_NODES. The client spreads requests evenly over the
+           nodes, and each webhook is forwarded to the node that owns its
+           conversation on the consistent-hash ring. A forwarding node
+           holds a thread while the owner answers, so ring nodes run
+           --ring-threads threads and forward at most half as many
+           requests at a time (CLUSTER_MAX_FORWARDS).
+
+Webhooks are signed for PUBLIC_URL, the address Twilio would post to in
+front of the nodes, and every node validates them against it
+(TWILIO_WEBHOOK_BASE_URL), forwarded or not. Each webhook is sent on a
+new connection, as Twilio does; with keep-alive, threaded gunicorn
+workers hold on to the connections they accepted and the load stops
+spreading evenly.
+
+Reported per run: RPS, p50/p99 latency, errors, config fetches that
+reached the backend (the shared config cache keeps these at about one per
+business), and for ring the share of webhooks that were forwarded.
+
+Usage: python -m benchmarks.bench_scaling [--workers 1,2,4,8] [--layout workers,ring]
+           [--threads 1] [--ring-threads 4] [--concurrency 32] [--duration 10] [--llm-latency 0.2]
+"""
+
+import argparse
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks.fakes import (
+    AGENT_DIR,
+    FakeBackend,
+    FakeGeminiAPI,
+    Latency,
+    WebhookGenerator,
+    percentile
+)
+from benchmarks.loadtest import AUTH_TOKEN, PUBLIC_URL, free_port
+
+
+def agent_env(backend, gemini, workdir, threads):
+    return dict(
+        os.environ,
+        BACKEND_API_URL=backend.url,
+        BACKEND_API_KEY='bench',
+        LLM_PROVIDERS='gemini_rest',
+        GEMINI_API_URL=gemini.url,
+        GEMINI_API_KEY='fake-key',
+        TWILIO_AUTH_TOKEN=AUTH_TOKEN,
+        TWILIO_VALIDATE_SIGNATURE='true',
+        TWILIO_WEBHOOK_BASE_URL=PUBLIC_URL,
+        ADMISSION_ENABLED='false',
+        RESPONSE_CACHE_ENABLED='false',
+        SHARED_STATE_URL=f"sqlite:///{os.path.join(workdir, 'agent_state.db')}",
+        MESSAGE_LOG_DIR=workdir,
+        PERSIST_SPOOL_PATH=os.path.join(workdir, 'spool.jsonl'),
+        BACKEND_POOL_SIZE=str(max(10, threads * 2)),
+        LLM_POOL_SIZE=str(max(10, threads * 2)),
+        GUNICORN_THREADS=str(threads),
+        CLUSTER_MAX_FORWARDS=str(max(1, threads // 2))
+    )
+
+
+def start_gunicorn(port, workers, env, workdir):
+    command = [
+        sys.executable, '-m', 'gunicorn', '-c', os.path.join(AGENT_DIR, 'gunicorn.conf.py'),
+        '--pythonpath', AGENT_DIR, '-b', f"127.0.0.1:{port}", '-w', str(workers),
+        '--log-level', 'warning', 'app:create_app()'
+    ]
+    log = open(os.path.join(workdir, f"gunicorn-{port}.log"), 'ab')
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(urls, timeout=60):
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            try:
+                if requests.get(f"{url}/health", timeout=1).ok:
+                    break
+            except requests.RequestException:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not start; see the gunicorn logs in the work directory")
+            time.sleep(0.1)
+
+
+def drive(urls, args):
+    """Send webhooks from --concurrency threads, round-robin over urls, for --duration seconds"""
+    generators = [WebhookGenerator(PUBLIC_URL, AUTH_TOKEN, businesses=args.businesses, senders=args.senders,
+                                   seed=args.seed + index) for index in range(len(urls))]
+    samples = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + args.duration
+
+    def worker(index):
+        turn = index
+        while time.perf_counter() < stop_at:
+            url, generator = urls[turn % len(urls)], generators[turn % len(generators)]
+            turn += 1
+            path, params, headers = generator.next()
+            started = time.perf_counter()
+            try:
+                ok = requests.post(url + path, data=params, headers=headers, timeout=30).ok
+            except requests.RequestException:
+                ok = False
+            with lock:
+                samples.append((time.perf_counter() - started, ok))
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def forwarded_share(urls):
+    forwarded = answered = 0
+    for url in urls:
+        stats = requests.get(f"{url}/stats?subsystem=cluster", timeout=5).json()["cluster"]["cluster"]
+        forwarded += stats["forwarded"]
+        answered += stats["local"] + stats["over_capacity"] + stats["received_forwarded"]
+    return forwarded / answered if answered else 0.0
+
+
+def run(layout, workers, backend, gemini, args):
+    workdir = tempfile.mkdtemp(prefix='ai-agent-bench-')
+    if layout == 'workers':
+        env = agent_env(backend, gemini, workdir, args.threads)
+        urls = [f"http://127.0.0.1:{free_port()}"]
+        processes = [start_gunicorn(urls[0].rsplit(':', 1)[1], workers, env, workdir)]
+    else:
+        env = agent_env(backend, gemini, workdir, args.ring_threads)
+        urls = [f"http://127.0.0.1:{free_port()}" for _ in range(workers)]
+        env['CLUSTER_NODES'] = ','.join(urls)
+        processes = [start_gunicorn(url.rsplit(':', 1)[1], 1, dict(env, CLUSTER_SELF_URL=url), workdir)
+                     for url in urls]
+    try:
+        wait_ready(urls)
+        with backend.lock:
+            backend.requests.clear()
+        samples, wall = drive(urls, args)
+        latencies = [elapsed for elapsed, _ in samples]
+        with backend.lock:
+            config_fetches = sum(1 for request in backend.requests
+                                 if request[0] == 'GET' and request[1].startswith('/api/setup/status/'))
+        line = (f"{layout:<8} workers={workers:<3d} rps={len(samples) / wall:7.1f} "
+                f"p50={percentile(latencies, 50) * 1000:7.1f}ms p99={percentile(latencies, 99) * 1000:7.1f}ms "
+                f"errors={sum(1 for _, ok in samples if not ok)} config_fetches={config_fetches}")
+        if layout == 'ring':
+            line += f" forwarded={forwarded_share(urls) * 100:.0f}%"
+        print(line, flush=True)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--layout', default='workers,ring')
+    parser.add_argument('--threads', type=int, default=1, help="Threads per worker (1 = sync workers)")
+    parser.add_argument('--ring-threads', type=int, default=4, help="Threads per node in the ring layout")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--llm-latency', default='0.2')
+    parser.add_argument('--backend-latency', default='0.02')
+    parser.add_argument('--businesses', type=int, default=10)
+    parser.add_argument('--senders', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if importlib.util.find_spec('gunicorn') is None:
+        sys.exit("gunicorn is not installed (pip install gunicorn)")
+    if args.ring_threads < 2:
+        sys.exit("Ring nodes need --ring-threads 2 or more")
+
+    with FakeBackend(latency=Latency(args.backend_latency, seed=args.seed)) as backend, \
+            FakeGeminiAPI(latency=Latency(args.llm_latency, seed=args.seed + 1)) as gemini:
+        for layout in args.layout.split(','):
+            for workers in (int(count) for count in args.workers.split(',')):
+                run(layout, workers, backend, gemini, args)
+
+
+if __name__ == '__main__':
+    main()
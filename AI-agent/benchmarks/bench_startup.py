@@ -0,0 +1,86 @@
+"""
+Cold start: time to import app.py, answer /health, and answer the first real request.
+
+Every run starts a fresh interpreter, so nothing is shared between runs:
+
+- import:       `import app`
+- health:       import, then the first GET /health (the SDKs are not loaded)
+- first_faq:    import, then the first POST /faq; the agent is created and the
+                Gemini SDK imported on this request (the answer comes from the FAQ index)
+- eager:        import, preload_sdks() and init_agent(), roughly what importing
+                app.py cost before initialization became lazy
+- forked_faq:   like a gunicorn --preload worker: the parent imports app.py and
+                the SDKs, then a forked child serves its first POST /faq
+
+Usage: python -m benchmarks.bench_startup [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.fakes import AGENT_DIR
+
+SCRIPT = r'''
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, AGENT_DIR)
+import app
+timings = {"import": time.perf_counter() - started}
+scenario = SCENARIO
+question = {"question": "What are your business hours?"}
+
+if scenario == "health":
+    app.app.test_client().get("/health")
+elif scenario == "first_faq":
+    app.app.test_client().post("/faq", json=question)
+elif scenario == "eager":
+    app.preload_sdks()
+    app.init_agent()
+elif scenario == "forked_faq":
+    app.preload_sdks()
+    timings["import"] = time.perf_counter() - started
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        forked = time.perf_counter()
+        app.app.test_client().post("/faq", json=question)
+        os.write(write_end, repr(time.perf_counter() - forked).encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    timings["child"] = float(os.read(read_end, 64))
+timings["total"] = time.perf_counter() - started
+print(json.dumps(timings))
+'''
+
+SCENARIOS = ("import", "health", "first_faq", "eager", "forked_faq")
+
+
+def run(scenario, workdir):
+    env = dict(os.environ, GEMINI_API_KEY='fake-key', ADMISSION_ENABLED='false', PERSIST_ASYNC='false',
+               BACKEND_API_KEY='', RESPONSE_CACHE_ENABLED='false')
+    script = SCRIPT.replace('AGENT_DIR', repr(AGENT_DIR)).replace('SCENARIO', repr(scenario))
+    output = subprocess.run([sys.executable, '-c', script], cwd=workdir, env=env, capture_output=True,
+                            text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ai-agent-bench-')
+    for scenario in SCENARIOS:
+        runs = [run(scenario, workdir) for _ in range(args.runs)]
+        line = f"{scenario:<11} " + " ".join(
+            f"{key}={statistics.median(timings[key] for timings in runs) * 1000:7.1f}ms" for key in runs[0])
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
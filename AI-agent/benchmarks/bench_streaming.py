@@ -0,0 +1,50 @@
+"""
+Compare time-to-first-byte of the JSON and SSE variants of /test.
+
+Gemini is faked with a reply whose latency is spread across word chunks,
+so the JSON endpoint waits for the whole generation while the streaming
+one can flush the first chunk almost immediately.
+
+Usage: python -m benchmarks.bench_streaming [--requests 20] [--llm-latency 1.0]
+"""
+
+import argparse
+import time
+
+from benchmarks.fakes import import_app, install_fake_gemini, percentile
+
+
+def run(client, count, stream):
+    first_byte, total = [], []
+    for index in range(count):
+        started = time.perf_counter()
+        response = client.post('/test', json={
+            'message': f'Question {index}', 'phone_number': f'bench_{index}', 'stream': stream
+        }, buffered=False)
+        first = None
+        for _ in response.response:
+            if first is None:
+                first = time.perf_counter()
+        finished = time.perf_counter()
+        first_byte.append(first - started)
+        total.append(finished - started)
+    return first_byte, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--llm-latency', type=float, default=1.0)
+    args = parser.parse_args()
+
+    install_fake_gemini(args.llm_latency)
+    client = import_app(BACKEND_API_KEY='').app.test_client()
+    for label, stream in (("json", False), ("sse", True)):
+        first_byte, total = run(client, args.requests, stream)
+        print(f"{label:<5} first byte p50={percentile(first_byte, 50) * 1000:7.1f}ms "
+              f"p99={percentile(first_byte, 99) * 1000:7.1f}ms  "
+              f"total p50={percentile(total, 50) * 1000:7.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
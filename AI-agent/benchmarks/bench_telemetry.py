@@ -0,0 +1,75 @@
+"""
+Cost of the metrics and tracing on the request path, and of rendering /metrics.
+
+- stage:   one telemetry.stage() block inside a traced request, tracing off and on
+- request: start()/finish() of a request with six stages, tracing off and on
+- render:  GET /metrics text for --businesses businesses with every stage populated
+
+Usage: python -m benchmarks.bench_telemetry [--iterations 200000] [--businesses 1000]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import AGENT_DIR
+
+sys.path.insert(0, AGENT_DIR)
+
+import telemetry  # noqa: E402
+from message_log import MessageLogWriter  # noqa: E402
+
+STAGES = ("log", "config", "admission", "llm", "persist", "twiml")
+
+
+def per_call(fn, iterations):
+    started = time.perf_counter()
+    fn(iterations)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def stages(iterations):
+    with telemetry.request("webhook", "acme"):
+        for _ in range(iterations):
+            with telemetry.stage("llm"):
+                pass
+
+
+def requests(iterations):
+    for index in range(iterations):
+        with telemetry.request("webhook", f"business-{index % 100}"):
+            for name in STAGES:
+                with telemetry.stage(name):
+                    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--businesses', type=int, default=1000)
+    args = parser.parse_args()
+
+    writer = MessageLogWriter(tempfile.mkdtemp(prefix='ai-agent-bench-'), prefix='traces_')
+    for label, trace_writer in (("off", None), ("on", writer)):
+        telemetry.configure(max_businesses=args.businesses, trace_writer=trace_writer)
+        stage_us = per_call(stages, args.iterations)
+        request_us = per_call(requests, args.iterations // 10)
+        print(f"tracing {label:<3} stage={stage_us:6.2f}us request+{len(STAGES)} stages={request_us:6.2f}us")
+    writer.close()
+    print(f"trace lines written={writer.stats()['written']} dropped={writer.stats()['dropped']}")
+
+    telemetry.configure(max_businesses=args.businesses)
+    for index in range(args.businesses):
+        with telemetry.request("webhook", f"tenant-{index}"):
+            for name in STAGES:
+                with telemetry.stage(name):
+                    pass
+    started = time.perf_counter()
+    text = telemetry.registry.render()
+    print(f"render {args.businesses} businesses: {(time.perf_counter() - started) * 1000:.1f}ms, "
+          f"{len(text.splitlines())} lines, {len(text) / 1024:.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
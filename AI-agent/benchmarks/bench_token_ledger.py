@@ -0,0 +1,150 @@
+"""
+Token accounting: cost on the request path, prompt compaction and budget
+accuracy across workers.
+
+Scenarios:
+
+- record:   µs per TokenLedger.record() and per budget check, from
+            --threads threads, with --businesses businesses
+- compact:  tokens in the business context and a FAQ reference before and
+            after compact_prompt(), for configs like the backend returns
+            (estimated at 4 characters per token)
+- budget:   --workers forked processes share one token_usage file and
+            spend on one business with a --budget token budget, each
+            calling an "LLM" of --tokens tokens every --llm-latency
+            seconds until the budget check says no. Reports the tokens
+            spent past the budget for each --flush-interval; the ledger
+            only sees other workers' spending once they flush.
+
+Usage: python -m benchmarks.bench_token_ledger [--iterations 200000] [--workers 4] [--budget 50000]
+           [--flush-interval 0.1,1,5]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fakes import AGENT_DIR
+
+sys.path.insert(0, AGENT_DIR)
+
+from faq_index import FAQEntry, format_entries  # noqa: E402
+from history import compact_prompt, estimate_tokens  # noqa: E402
+from token_ledger import TokenLedger  # noqa: E402
+
+CONFIGS = [
+    {'name': 'Acme Shoes', 'specialties': 'Running shoes, trail shoes and sports socks', 'tone': 'friendly',
+     'language': 'English', 'business_hours': 'Mon-Fri 9:00-18:00'},
+    {'name': 'Dr. Lina Dental Clinic', 'specialties': 'Dental check-ups, whitening, implants', 'tone': 'professional',
+     'language': 'French', 'business_hours': 'Mon-Sat 8:30-17:00'},
+]
+
+
+def indented_context(config):
+    """The business context as build_context() formatted it before compaction"""
+    return f"""You are a helpful customer support agent for {config['name']}.
+                Business Context: {config['specialties']}
+                Communication Style: {config['tone']}
+                Language: {config['language']}
+                Business Hours: {config['business_hours']}
+
+                Please provide helpful, professional, and friendly responses to customer inquiries.
+                Keep responses concise but informative."""
+
+
+def bench_record(args):
+    workdir = tempfile.mkdtemp(prefix='ai-agent-bench-')
+    ledger = TokenLedger(workdir, flush_interval=1.0, default_budget=10 ** 12)
+    per_thread = args.iterations // args.threads
+
+    def run(method):
+        def worker(index):
+            for i in range(per_thread):
+                business_id = f"business-{(index * per_thread + i) % args.businesses}"
+                if method == 'record':
+                    ledger.record(business_id, 'webhook', 900, 60)
+                else:
+                    ledger.exhausted(business_id)
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return (time.perf_counter() - started) / (per_thread * args.threads)
+
+    recorded = run('record')
+    checked = run('check')
+    ledger.close()
+    print(f"record   {recorded * 1e6:6.2f}us per record()   {checked * 1e6:6.2f}us per budget check  "
+          f"({args.threads} threads, {args.businesses} businesses, {ledger.lines_written.value} lines flushed)")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_compact():
+    entries = [FAQEntry(f"  What are your opening hours on day {index}?  ",
+                        "We are open\t\tevery day   from 9am to 6pm.\n\n\n\nCall us   any time.")
+               for index in range(5)]
+    samples = [("context", indented_context(config)) for config in CONFIGS]
+    samples.append(("faq reference", format_entries(entries)))
+    for label, text in samples:
+        before, after = estimate_tokens(text), estimate_tokens(compact_prompt(text))
+        print(f"compact  {label:<14} {before:4d} -> {after:4d} tokens ({(before - after) / before * 100:4.1f}% saved)")
+
+
+def spend(path, budget, tokens, latency, flush_interval, deadline):
+    """Worker: call the 'LLM' until the shared budget is used up"""
+    ledger = TokenLedger(path, flush_interval=flush_interval, budgets={'business-1': budget})
+    while time.monotonic() < deadline and not ledger.exhausted('business-1'):
+        time.sleep(latency)
+        ledger.record('business-1', 'webhook', tokens - tokens // 10, tokens // 10)
+    ledger.close()
+
+
+def bench_budget(args):
+    for flush_interval in (float(value) for value in args.flush_interval.split(',')):
+        workdir = tempfile.mkdtemp(prefix='ai-agent-bench-')
+        deadline = time.monotonic() + 120
+        started = time.perf_counter()
+        pids = []
+        for _ in range(args.workers):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    spend(workdir, args.budget, args.tokens, args.llm_latency, flush_interval, deadline)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        elapsed = time.perf_counter() - started
+        used = TokenLedger(workdir, flush_interval=0).used('business-1')
+        rate = args.workers * args.tokens / args.llm_latency
+        print(f"budget   flush={flush_interval:<4g}s workers={args.workers} spent={used} of {args.budget} "
+              f"(+{(used - args.budget) / args.budget * 100:.1f}%, {rate:.0f} tokens/s for {elapsed:.1f}s)")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--businesses', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--budget', type=int, default=50000)
+    parser.add_argument('--tokens', type=int, default=1000)
+    parser.add_argument('--llm-latency', type=float, default=0.05)
+    parser.add_argument('--flush-interval', default='0.1,1,5')
+    args = parser.parse_args()
+
+    bench_record(args)
+    bench_compact()
+    bench_budget(args)
+
+
+if __name__ == '__main__':
+    main()
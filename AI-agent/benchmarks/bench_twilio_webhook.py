@@ -0,0 +1,140 @@
+"""
+Webhook hot path: Twilio signature validation and TwiML rendering.
+
+Compares the SDK's RequestValidator and MessagingResponse against
+twilio_webhook.SignatureValidator (HMAC keyed once, copied per request)
+and twiml_message() (escaped template). Scenarios:
+
+- render:   replies of --reply-chars characters, some with &, < and >.
+            Both paths must produce the same bytes.
+- validate: a WhatsApp webhook with the parameters Twilio sends. Both
+            validators must accept it and reject a tampered Body.
+- webhook:  signed posts through the Flask app with process_message
+            stubbed out, so only the per-request cost of the webhook
+            remains. Compared: no validation + MessagingResponse (before),
+            RequestValidator + MessagingResponse (the SDK added naively)
+            and SignatureValidator + template (now).
+
+Reported as µs per call and as the share of one CPU core spent on it at
+--rps webhooks per second.
+
+Usage: python -m benchmarks.bench_twilio_webhook [--iterations 50000] [--requests 5000] [--rps 1000]
+"""
+
+import argparse
+import time
+
+from benchmarks.fakes import WebhookGenerator, import_app
+
+AUTH_TOKEN = 'fake-auth-token'
+REPLIES = [
+    "Our opening hours are 9am to 5pm, Monday to Friday.",
+    "Orders over $50 ship free & arrive in 3-5 days. Track yours at <https://example.com/track>.",
+    "You can return any item within 30 days. Reply with your order number and we'll send a label."
+]
+
+
+def sdk_twiml(message):
+    from twilio.twiml.messaging_response import MessagingResponse
+    resp = MessagingResponse()
+    resp.message(message)
+    return str(resp)
+
+
+class SDKValidator:
+    """RequestValidator behind the SignatureValidator interface used by app.py"""
+
+    def __init__(self, auth_token):
+        from twilio.request_validator import RequestValidator
+        self.validator = RequestValidator(auth_token)
+
+    def url(self, request_url, path):
+        return request_url
+
+    def validate(self, url, params, signature):
+        return self.validator.validate(url, dict(params), signature or '')
+
+
+def time_per_call(func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations
+
+
+def report(name, seconds, baseline, rps):
+    print(f"  {name:<36} {seconds * 1e6:8.1f}us/call  {1 / seconds:10.0f}/s  "
+          f"{seconds * rps * 100:5.1f}% CPU at {rps} rps  x{baseline / seconds:.1f}")
+
+
+def bench_render(twiml_message, args):
+    replies = [(reply * (args.reply_chars // len(reply) + 1))[:args.reply_chars] for reply in REPLIES]
+    for reply in replies:
+        assert sdk_twiml(reply) == twiml_message(reply), reply
+    print(f"render ({args.reply_chars} chars, output identical)")
+    sdk = time_per_call(lambda: [sdk_twiml(reply) for reply in replies], args.iterations // 10) / len(replies)
+    fast = time_per_call(lambda: [twiml_message(reply) for reply in replies], args.iterations) / len(replies)
+    report("MessagingResponse", sdk, sdk, args.rps)
+    report("template", fast, sdk, args.rps)
+
+
+def bench_validate(SignatureValidator, args):
+    path, params, headers = WebhookGenerator('https://agent.example.com', AUTH_TOKEN, seed=1).next()
+    url = 'https://agent.example.com' + path
+    signature = headers['X-Twilio-Signature']
+    tampered = dict(params, Body="Send me a refund")
+    sdk, fast = SDKValidator(AUTH_TOKEN), SignatureValidator(AUTH_TOKEN)
+    for validator in (sdk, fast):
+        assert validator.validate(url, params.items(), signature)
+        assert not validator.validate(url, tampered.items(), signature)
+    print(f"validate ({len(params)} params, both accept the webhook and reject a tampered Body)")
+    sdk_time = time_per_call(lambda: sdk.validate(url, params.items(), signature), args.iterations // 5)
+    fast_time = time_per_call(lambda: fast.validate(url, params.items(), signature), args.iterations)
+    report("RequestValidator", sdk_time, sdk_time, args.rps)
+    report("SignatureValidator", fast_time, sdk_time, args.rps)
+
+
+def bench_webhook(app, args):
+    app.process_message = lambda business_id, from_number, to_number, message: REPLIES[1]
+    client = app.create_app().test_client()
+    generator = WebhookGenerator('http://localhost', AUTH_TOKEN, seed=2)
+    posts = [generator.next() for _ in range(args.requests)]
+    fast_validator, fast_twiml = app.signature_validator, app.twiml_message
+    variants = [
+        ("before: no validation + SDK", None, sdk_twiml),
+        ("RequestValidator + SDK", SDKValidator(AUTH_TOKEN), sdk_twiml),
+        ("now: SignatureValidator + template", fast_validator, fast_twiml),
+    ]
+    print(f"webhook ({args.requests} signed posts through Flask, process_message stubbed)")
+    baseline = None
+    for name, validator, twiml_message in variants:
+        app.signature_validator, app.twiml_message = validator, twiml_message
+        started = time.perf_counter()
+        for path, params, headers in posts:
+            response = client.post(path, data=params, headers=headers)
+            assert response.status_code == 200, response.data
+        seconds = (time.perf_counter() - started) / len(posts)
+        baseline = baseline or seconds
+        report(name, seconds, baseline, args.rps)
+    app.signature_validator, app.twiml_message = fast_validator, fast_twiml
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--reply-chars', type=int, default=300)
+    parser.add_argument('--rps', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = import_app(TWILIO_AUTH_TOKEN=AUTH_TOKEN, TWILIO_VALIDATE_SIGNATURE='true',
+                     TWILIO_WEBHOOK_BASE_URL='http://localhost', MESSAGE_LOG_MODE='off',
+                     RESPONSE_CACHE_ENABLED='false')
+    from twilio_webhook import SignatureValidator
+    bench_render(app.twiml_message, args)
+    bench_validate(SignatureValidator, args)
+    bench_webhook(app, args)
+
+
+if __name__ == '__main__':
+    main()
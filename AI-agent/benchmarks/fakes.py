@@ -0,0 +1,638 @@
+"""
+Local stand-ins for the external services the agent talks to.
+
+Benchmarks import these instead of hitting live Gemini / Twilio / backend
+APIs. Every fake runs in-process on an ephemeral localhost port. A fake's
+latency is either a number of seconds or a Latency distribution, and can
+be changed while a benchmark runs. WebhookGenerator produces signed
+Twilio webhook posts.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import random
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Latency:
+    """Latency distribution parsed from a spec string
+
+    "0.2" or "const:0.2"   fixed delay in seconds
+    "uniform:0.1,0.5"      uniform between two bounds
+    "normal:0.3,0.05"      mean and standard deviation, clamped at 0
+    "lognormal:0.3,0.5"    median and sigma; the long right tail of LLM APIs
+    "exp:0.2"              exponential with the given mean
+    "tail:0.2,3.0,0.02"    base delay, with a share (0.02) of calls taking the slow one (3.0)
+    """
+
+    def __init__(self, spec, seed=None):
+        self.spec = str(spec)
+        kind, _, args = self.spec.partition(':')
+        if not args:
+            kind, args = 'const', kind
+        self.kind = kind
+        self.args = [float(arg) for arg in args.split(',')]
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        if kind not in ('const', 'uniform', 'normal', 'lognormal', 'exp', 'tail'):
+            raise ValueError(f"Unknown latency distribution: {self.spec}")
+
+    def sample(self):
+        args = self.args
+        if self.kind == 'const':
+            return args[0]
+        with self.lock:
+            if self.kind == 'uniform':
+                return self.rng.uniform(args[0], args[1])
+            if self.kind == 'normal':
+                return max(0.0, self.rng.normalvariate(args[0], args[1]))
+            if self.kind == 'lognormal':
+                return self.rng.lognormvariate(math.log(args[0]), args[1])
+            if self.kind == 'exp':
+                return self.rng.expovariate(1.0 / args[0])
+            return args[1] if self.rng.random() < args[2] else args[0]
+
+    def __str__(self):
+        return self.spec
+
+
+def delay(latency):
+    """Seconds to wait for a latency given as a number or a Latency"""
+    return latency.sample() if isinstance(latency, Latency) else latency
+
+
+# The fake backend's FAQ for every business, as the setup status payload carries it
+BUSINESS_FAQS = [
+    {"question": "What are your business hours?", "answer": "We are open 9am to 5pm, Monday to Friday."},
+    {"question": "How can I contact support?", "answer": "Reply here or email support@example.com."},
+    {"question": "How long does shipping take?", "answer": "Orders arrive in 3 to 5 business days."},
+]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+
+def import_app(quiet=True, **env):
+    """Import app.py from a scratch directory so log files don't land in the repo"""
+    os.environ.setdefault('GEMINI_API_KEY', 'fake-key')
+    # Benchmarks send bursts from one business; rate limits would turn most of them into canned replies
+    os.environ.setdefault('ADMISSION_ENABLED', 'false')
+    # Test clients post unsigned webhooks; benchmarks that sign them turn validation on themselves
+    os.environ.setdefault('TWILIO_VALIDATE_SIGNATURE', 'false')
+    os.environ.update({key: str(value) for key, value in env.items()})
+    if AGENT_DIR not in sys.path:
+        sys.path.insert(0, AGENT_DIR)
+    os.chdir(tempfile.mkdtemp(prefix='ai-agent-bench-'))
+    import app
+    app.init_agent()
+    if quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+    return app
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeAsyncStream:
+    def __init__(self, chunks, delay):
+        self.chunks = chunks
+        self.delay = delay
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield FakeResponse(chunk)
+
+
+class FakeGenerativeModel:
+    """Drop-in for genai.GenerativeModel that sleeps instead of calling Gemini
+
+    With stream=True the reply is split into word chunks and `latency` is
+    spread evenly across them, like tokens arriving from the API.
+    """
+
+    latency = 0.0
+    calls = 0
+    last_contents = None
+    reply = "Thanks for reaching out! How can I help you today?"
+
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+
+    def _chunks(self):
+        words = self.reply.split(' ')
+        return [word + ' ' for word in words[:-1]] + words[-1:]
+
+    def _stream(self, chunks):
+        total = delay(self.latency)
+        for chunk in chunks:
+            time.sleep(total / len(chunks))
+            yield FakeResponse(chunk)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        FakeGenerativeModel.calls += 1
+        FakeGenerativeModel.last_contents = contents
+        if stream:
+            return self._stream(self._chunks())
+        time.sleep(delay(self.latency))
+        return FakeResponse(self.reply)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        FakeGenerativeModel.calls += 1
+        FakeGenerativeModel.last_contents = contents
+        if stream:
+            chunks = self._chunks()
+            return _FakeAsyncStream(chunks, delay(self.latency) / len(chunks))
+        await asyncio.sleep(delay(self.latency))
+        return FakeResponse(self.reply)
+
+
+def install_fake_gemini(latency=0.0):
+    """Patch google.generativeai so every model is a FakeGenerativeModel"""
+    import google.generativeai as genai
+    FakeGenerativeModel.latency = latency
+    genai.GenerativeModel = FakeGenerativeModel
+    return FakeGenerativeModel
+
+
+class FakeProvider:
+    """In-process LLM provider for the router, with a latency distribution and a failure rate
+
+    Each call takes `latency` seconds, or `tail_latency` for a `tail_ratio`
+    share of calls; a `error_rate` share raises instead. All three can be
+    changed while a benchmark runs.
+    """
+
+    def __init__(self, name, latency=0.1, tail_latency=None, tail_ratio=0.0, error_rate=0.0, seed=None,
+                 reply="Thanks for reaching out! How can I help you today?"):
+        self.name = name
+        self.latency = latency
+        self.tail_latency = tail_latency
+        self.tail_ratio = tail_ratio
+        self.error_rate = error_rate
+        self.reply = reply
+        self.calls = 0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def _sample(self):
+        with self.lock:
+            self.calls += 1
+            failed = self.rng.random() < self.error_rate
+            tail = self.tail_latency is not None and self.rng.random() < self.tail_ratio
+        return (self.tail_latency if tail else self.latency), failed
+
+    def generate(self, contents, system=None):
+        delay, failed = self._sample()
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError(f"{self.name} unavailable")
+        return self.reply
+
+    async def generate_async(self, contents, system=None):
+        delay, failed = self._sample()
+        await asyncio.sleep(delay)
+        if failed:
+            raise RuntimeError(f"{self.name} unavailable")
+        return self.reply
+
+    def stream(self, contents, system=None):
+        yield self.generate(contents, system)
+
+    async def stream_async(self, contents, system=None):
+        yield await self.generate_async(contents, system)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Default backlog of 5 drops SYNs under concurrent benchmarks
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up (timeouts, deadlines) close the socket before the reply is written
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _FakeServer:
+    """Run a BaseHTTPRequestHandler subclass on a background thread"""
+
+    handler_class = None
+
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+        outer = self
+
+        class Handler(self.handler_class):
+            server_state = outer
+            # Headers and body go out in separate writes; avoid delayed-ACK stalls on keep-alive
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = _Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def record(self, item):
+        with self.lock:
+            self.requests.append(item)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _TwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        state = self.server_state
+        state.record(form)
+        time.sleep(delay(state.latency))
+        body = json.dumps({"sid": f"SM{len(state.requests):032d}", "status": "queued"}).encode()
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTwilio(_FakeServer):
+    """Records every message created through the Messages.json endpoint"""
+
+    handler_class = _TwilioHandler
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        super().__init__()
+
+    @property
+    def messages(self):
+        return self.requests
+
+
+def twilio_signature(auth_token, url, params):
+    """X-Twilio-Signature: base64 HMAC-SHA1 of the URL followed by every POST param name and value, sorted by name"""
+    payload = url + ''.join(f"{key}{params[key]}" for key in sorted(params))
+    return base64.b64encode(hmac.new(auth_token.encode(), payload.encode(), hashlib.sha1).digest()).decode()
+
+
+WEBHOOK_MESSAGES = ["hi", "What are your opening hours?", "Where is my order?", "Do you ship internationally?",
+                    "How do I return an item?", "I was charged twice", "Can I change my delivery address?",
+                    "What payment methods do you accept?", "Is this item in stock?", "thanks!"]
+
+
+class WebhookGenerator:
+    """WhatsApp webhook posts as Twilio sends them, signed with X-Twilio-Signature
+
+    base_url is the URL Twilio is configured with (the agent's public
+    URL); the signature covers it, so it must match what the server sees.
+    """
+
+    def __init__(self, base_url, auth_token='fake-auth-token', businesses=10, senders=1000,
+                 messages=WEBHOOK_MESSAGES, seed=None, to_number='whatsapp:+14155238886'):
+        self.base_url = base_url.rstrip('/')
+        self.auth_token = auth_token
+        self.businesses = [f"business-{index}" for index in range(businesses)]
+        self.senders = senders
+        self.messages = messages
+        self.to_number = to_number
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def next(self):
+        """(path, form params, headers) for one incoming message"""
+        with self.lock:
+            business_id = self.rng.choice(self.businesses)
+            sender = f"+1555{self.rng.randrange(self.senders):07d}"
+            body = self.rng.choice(self.messages)
+            sid = f"SM{self.rng.getrandbits(128):032x}"
+        path = f"/webhook/{business_id}"
+        params = {
+            "AccountSid": "AC" + "0" * 32,
+            "ApiVersion": "2010-04-01",
+            "Body": body,
+            "From": f"whatsapp:{sender}",
+            "MessageSid": sid,
+            "NumMedia": "0",
+            "NumSegments": "1",
+            "ProfileName": "Load Test",
+            "SmsMessageSid": sid,
+            "SmsStatus": "received",
+            "To": self.to_number,
+            "WaId": sender.lstrip('+')
+        }
+        headers = {"X-Twilio-Signature": twilio_signature(self.auth_token, self.base_url + path, params)}
+        return path, params, headers
+
+
+class _BackendHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server_state
+        state.record(('GET', self.path))
+        time.sleep(delay(state.latency))
+        if self.path.startswith('/api/setup/status/'):
+            business_id = self.path.rsplit('/', 1)[-1]
+            if business_id in state.missing:
+                return self._reply(404, {"error": "Business not found"})
+            return self._reply(200, {
+                "name": f"Business {business_id}",
+                "bot_configs": [{
+                    "tone": "friendly",
+                    "language": "English",
+                    "specialties": "Online retail",
+                    "businessHours": "9am-5pm"
+                }],
+                "faqs": BUSINESS_FAQS
+            })
+        self._reply(404, {"error": "Not found"})
+
+    def do_POST(self):
+        state = self.server_state
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'null')
+        state.record(('POST', self.path, payload))
+        time.sleep(delay(state.latency))
+        if self.path.startswith('/api/conversations'):
+            if state.down:
+                return self._reply(503, {"error": "Service unavailable"})
+            records = payload['conversations'] if self.path.endswith('/bulk') else [payload]
+            # Same per-record check as the backend: rows missing a field are skipped and reported
+            rejected = [index for index, record in enumerate(records)
+                        if not all(record.get(field) for field in ('phone_number', 'user_message', 'ai_response'))]
+            if rejected and not self.path.endswith('/bulk'):
+                return self._reply(400, {"error": "Missing required fields"})
+            records = [record for index, record in enumerate(records) if index not in rejected]
+            with state.lock:
+                state.conversations.extend(records)
+            return self._reply(201, {"success": True, "inserted": len(records), "rejected": rejected})
+        self._reply(404, {"error": "Not found"})
+
+
+class FakeBackend(_FakeServer):
+    """Serves /api/setup/status/<id> and accepts /api/conversations (single and bulk)
+
+    Set `down = True` to answer conversation writes with 503.
+    """
+
+    handler_class = _BackendHandler
+
+    def __init__(self, latency=0.0, missing=()):
+        self.latency = latency
+        self.missing = set(missing)
+        self.down = False
+        self.conversations = []
+        super().__init__()
+
+
+class _GeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        state = self.server_state
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'null')
+        state.record((self.path, payload))
+        time.sleep(delay(state.latency))
+        reply = {"candidates": [{"content": {"role": "model", "parts": [{"text": state.reply}]}}]}
+        if ':streamGenerateContent' in self.path:
+            words = state.reply.split(' ')
+            events = [{"candidates": [{"content": {"role": "model", "parts": [{"text": word + ' '}]}}]}
+                      for word in words[:-1]] + [{"candidates": [{"content": {"parts": [{"text": words[-1]}]}}]}]
+            body = ''.join(f"data: {json.dumps(event)}\r\n\r\n" for event in events).encode()
+            content_type = 'text/event-stream'
+        elif ':generateContent' in self.path:
+            body = json.dumps(reply).encode()
+            content_type = 'application/json'
+        else:
+            body = json.dumps({"error": {"code": 404, "message": "Not found"}}).encode()
+            self.send_response(404)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeGeminiAPI(_FakeServer):
+    """Serves Gemini's generateContent and streamGenerateContent (alt=sse) REST endpoints"""
+
+    handler_class = _GeminiHandler
+
+    def __init__(self, latency=0.0, reply="Thanks for reaching out! How can I help you today?"):
+        self.latency = latency
+        self.reply = reply
+        super().__init__()
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            self.wfile.write(self.server.fake.dispatch(command))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+class _RedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+class FakeRedis:
+    """In-memory server speaking enough RESP2 for the agent's Redis backends"""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.commands = 0
+        self.lock = threading.Lock()
+        self.server = _RedisServer(('127.0.0.1', 0), _RedisHandler)
+        self.server.fake = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"redis://{host}:{port}/0"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(FakeRedis._encode(item) for item in value)
+        if isinstance(value, str):
+            return b'+%s\r\n' % value.encode()
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def _alive(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and time.time() >= expires_at:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def dispatch(self, args):
+        name = args[0].decode().upper()
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        with self.lock:
+            self.commands += 1
+            if handler is None:
+                return b'-ERR unknown command %s\r\n' % name.encode()
+            try:
+                return self._encode(handler(*args[1:]))
+            except Exception as e:
+                return b'-ERR %s\r\n' % str(e).encode()
+
+    def cmd_ping(self, *args):
+        return 'PONG'
+
+    def cmd_auth(self, *args):
+        return 'OK'
+
+    def cmd_select(self, db):
+        return 'OK'
+
+    def cmd_get(self, key):
+        return self.data.get(key) if self._alive(key) else None
+
+    def cmd_set(self, key, value, *options):
+        options = [option.decode().upper() for option in options]
+        if 'NX' in options and self._alive(key):
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if 'EX' in options:
+            self.expires[key] = time.time() + int(options[options.index('EX') + 1])
+        if 'PX' in options:
+            self.expires[key] = time.time() + int(options[options.index('PX') + 1]) / 1000.0
+        return 'OK'
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                removed += 1
+        return removed
+
+    def cmd_incrby(self, key, amount):
+        value = int(self.data[key]) if self._alive(key) else 0
+        value += int(amount)
+        self.data[key] = str(value).encode()
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, b'1')
+
+    def cmd_expire(self, key, seconds):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.time() + int(seconds)
+        return 1
+
+    def cmd_pexpire(self, key, milliseconds):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.time() + int(milliseconds) / 1000.0
+        return 1
+
+    def cmd_rpush(self, key, *values):
+        self._alive(key)
+        items = self.data.setdefault(key, [])
+        items.extend(values)
+        return len(items)
+
+    def cmd_lrange(self, key, start, stop):
+        if not self._alive(key):
+            return []
+        items = self.data[key]
+        start, stop = int(start), int(stop)
+        stop = len(items) + stop if stop < 0 else stop
+        start = max(0, len(items) + start if start < 0 else start)
+        return items[start:stop + 1]
+
+    def cmd_ltrim(self, key, start, stop):
+        if self._alive(key):
+            self.data[key] = self.cmd_lrange(key, start, stop)
+        return 'OK'
+
+    def cmd_llen(self, key):
+        return len(self.data[key]) if self._alive(key) else 0
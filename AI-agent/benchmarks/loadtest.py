@@ -0,0 +1,365 @@
+"""
+Load test: drive /webhook/<business_id>, /test and /faq at a fixed concurrency.
+
+Starts the fake backend (/api/setup/status, /api/conversations), the fake
+Gemini REST API and, with --async-replies, the fake Twilio API. Each takes
+a latency spec (see fakes.Latency: "0.2", "uniform:0.1,0.5",
+"lognormal:0.4,0.5", "tail:0.3,4,0.02", ...). The agent is then served
+over real HTTP, either Flask (werkzeug, threaded) or the ASGI app under
+uvicorn. Webhooks carry a valid X-Twilio-Signature for PUBLIC_URL, the
+address Twilio would post to, which the agent is configured with.
+
+--concurrency workers send requests back to back, mixed by --mix, until
+--requests have completed or --duration seconds have passed. Reported per
+endpoint and in total:
+- RPS, and p50/p95/p99/max latency
+- errors (non-2xx or connection failures)
+- fallbacks (the canned "having trouble" reply)
+
+Results are written as JSON to --output; pass a previous file to
+--compare to print the change.
+
+--url targets an agent you started yourself. Use --fakes-only to start
+just the fakes and print the environment to point that agent at them.
+
+Usage:
+    python -m benchmarks.loadtest [--server flask|asgi] [--requests 1000] [--concurrency 32]
+        [--mix webhook=6,test=2,faq=2] [--llm-latency lognormal:0.4,0.4] [--backend-latency 0.02]
+        [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from benchmarks.fakes import (
+    AGENT_DIR,
+    WEBHOOK_MESSAGES,
+    FakeBackend,
+    FakeGeminiAPI,
+    FakeTwilio,
+    Latency,
+    WebhookGenerator,
+    import_app,
+    percentile,
+    twilio_signature
+)
+
+AUTH_TOKEN = 'fake-auth-token'
+PUBLIC_URL = 'https://agent.example.com'
+FALLBACK_MARKER = b'having trouble'
+FAQ_QUESTIONS = ["What are your business hours?", "How can I contact support?", "Do you offer refunds?",
+                 "Where are you located?", "How long does shipping take?", "Can I cancel my order?"]
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('webhook', 'test', 'faq'):
+            raise ValueError(f"Unknown endpoint in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def agent_env(args, backend, gemini, twilio):
+    """Environment that points the agent at the fakes"""
+    env = {
+        'BACKEND_API_URL': backend.url,
+        'BACKEND_API_KEY': 'loadtest',
+        'LLM_PROVIDERS': 'gemini_rest',
+        'GEMINI_API_URL': gemini.url,
+        'GEMINI_API_KEY': 'fake-key',
+        'TWILIO_AUTH_TOKEN': AUTH_TOKEN,
+        'TWILIO_VALIDATE_SIGNATURE': 'true',
+        'TWILIO_WEBHOOK_BASE_URL': PUBLIC_URL,
+        'ADMISSION_ENABLED': str(args.admission).lower(),
+        'RESPONSE_CACHE_ENABLED': str(not args.no_cache).lower(),
+        # Size the keep-alive pools for the request threads plus the reply workers
+        'BACKEND_POOL_SIZE': str(max(10, args.concurrency * 2)),
+        'LLM_POOL_SIZE': str(max(10, args.concurrency * 2))
+    }
+    if twilio is not None:
+        env.update({
+            'ASYNC_REPLIES': 'true',
+            'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32,
+            'TWILIO_API_URL': twilio.url
+        })
+    return env
+
+
+class FlaskServer:
+    """The Flask app on werkzeug's threaded server"""
+
+    def __init__(self, app_module):
+        from werkzeug.serving import make_server
+        self.httpd = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+
+
+class ASGIServer:
+    """asgi.py under uvicorn in a background thread"""
+
+    def __init__(self):
+        import uvicorn
+
+        import asgi
+        port = free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(asgi.app, host='127.0.0.1', port=port, log_level='warning'))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+class RemoteServer:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class LoadTest:
+    def __init__(self, base_url, args):
+        self.base_url = base_url
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.webhooks = WebhookGenerator(PUBLIC_URL, AUTH_TOKEN, businesses=args.businesses,
+                                         senders=args.senders, seed=args.seed)
+        self.results = {name: [] for name in self.mix}
+        self.lock = threading.Lock()
+        self.limit = 0
+        self.issued = 0
+
+    def build(self, endpoint, rng):
+        """(path, kwargs for requests) for one request to `endpoint`"""
+        suffix = f" #{rng.getrandbits(32):08x}" if self.args.no_cache else ""
+        business_id = f"business-{rng.randrange(self.args.businesses)}"
+        if endpoint == 'webhook':
+            path, params, headers = self.webhooks.next()
+            if suffix:
+                params["Body"] += suffix
+                headers = {"X-Twilio-Signature": twilio_signature(AUTH_TOKEN, PUBLIC_URL + path, params)}
+            return path, {'data': params, 'headers': headers}
+        if endpoint == 'test':
+            return '/test', {'json': {
+                "message": rng.choice(WEBHOOK_MESSAGES) + suffix,
+                "phone_number": f"whatsapp:+1555{rng.randrange(self.args.senders):07d}",
+                "business_id": business_id
+            }}
+        return '/faq', {'json': {"question": rng.choice(FAQ_QUESTIONS) + suffix, "business_id": business_id}}
+
+    def _claim(self, stop_at):
+        with self.lock:
+            if self.issued >= self.limit or (stop_at and time.perf_counter() >= stop_at):
+                return False
+            self.issued += 1
+            return True
+
+    def worker(self, index, stop_at):
+        rng = random.Random(self.args.seed * 1000 + index)
+        names, weights = list(self.mix), list(self.mix.values())
+        session = requests.Session()
+        while self._claim(stop_at):
+            endpoint = rng.choices(names, weights)[0]
+            path, kwargs = self.build(endpoint, rng)
+            started = time.perf_counter()
+            try:
+                response = session.post(self.base_url + path, timeout=self.args.timeout, **kwargs)
+                ok = 200 <= response.status_code < 300
+                fallback = FALLBACK_MARKER in response.content
+            except requests.RequestException:
+                ok, fallback = False, False
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.results[endpoint].append((elapsed, ok, fallback))
+
+    def run(self, limit):
+        self.limit, self.issued = limit, 0
+        stop_at = time.perf_counter() + self.args.duration if self.args.duration else None
+        threads = [threading.Thread(target=self.worker, args=(index, stop_at))
+                   for index in range(self.args.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def summarize(samples, wall):
+    latencies = [elapsed for elapsed, _, _ in samples]
+    if not latencies:
+        return {"requests": 0}
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, ok, _ in samples if not ok),
+        "fallbacks": sum(1 for _, _, fallback in samples if fallback),
+        "rps": round(len(samples) / wall, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=AGENT_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    rows = [("total", report["total"], (baseline or {}).get("total"))]
+    rows += [(name, stats, (baseline or {}).get("endpoints", {}).get(name))
+             for name, stats in report["endpoints"].items()]
+    for name, stats, previous in rows:
+        if not stats["requests"]:
+            continue
+        line = (f"{name:<8} n={stats['requests']:5d} rps={stats['rps']:8.1f} p50={stats['p50_ms']:8.1f}ms "
+                f"p95={stats['p95_ms']:8.1f}ms p99={stats['p99_ms']:8.1f}ms max={stats['max_ms']:8.1f}ms "
+                f"errors={stats['errors']} fallbacks={stats['fallbacks']}")
+        if previous and previous.get("requests"):
+            changes = []
+            for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+                if previous[key]:
+                    changes.append(f"{key} {(stats[key] - previous[key]) / previous[key] * 100:+.1f}%")
+            line += "\n" + " " * 9 + "vs baseline: " + ", ".join(changes)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--url', help="Drive an agent that is already running instead of starting one")
+    parser.add_argument('--fakes-only', action='store_true', help="Start the fakes, print their env and wait")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--mix', default='webhook=6,test=2,faq=2')
+    parser.add_argument('--llm-latency', default='lognormal:0.4,0.4')
+    parser.add_argument('--backend-latency', default='0.02')
+    parser.add_argument('--twilio-latency', default='0.05')
+    parser.add_argument('--async-replies', action='store_true')
+    parser.add_argument('--admission', action='store_true', help="Keep rate limits and LLM admission on")
+    parser.add_argument('--no-cache', action='store_true', help="Make every message unique so caches miss")
+    parser.add_argument('--businesses', type=int, default=20)
+    parser.add_argument('--senders', type=int, default=5000)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=f"loadtest-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    parser.add_argument('--compare')
+    args = parser.parse_args()
+    # import_app switches to a scratch directory; keep result paths relative to where we were started
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    with FakeBackend(latency=Latency(args.backend_latency, seed=args.seed)) as backend, \
+            FakeGeminiAPI(latency=Latency(args.llm_latency, seed=args.seed + 1)) as gemini, \
+            FakeTwilio(latency=Latency(args.twilio_latency, seed=args.seed + 2)) as twilio:
+        env = agent_env(args, backend, gemini, twilio if args.async_replies else None)
+        if args.fakes_only:
+            print("\n".join(f"export {key}={value}" for key, value in env.items()))
+            print("Fakes running; Ctrl+C to stop")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                return
+
+        server_is_local = not args.url
+        if args.url:
+            server = RemoteServer(args.url)
+        else:
+            app_module = import_app(**env)
+            # One access log line per request would swamp the report
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)
+            server = FlaskServer(app_module) if args.server == 'flask' else ASGIServer()
+
+        with server:
+            test = LoadTest(server.url, args)
+            if args.warmup:
+                test.run(args.warmup)
+                test.results = {name: [] for name in test.mix}
+            wall = test.run(args.requests)
+            # Webhooks were only acknowledged; wait for the replies before stopping the fakes
+            dispatcher = getattr(app_module, 'reply_dispatcher', None) if server_is_local else None
+            drain = None
+            if dispatcher is not None:
+                started = time.perf_counter()
+                dispatcher.join()
+                drain = time.perf_counter() - started
+                dispatcher.shutdown()
+
+        samples = [sample for endpoint_samples in test.results.values() for sample in endpoint_samples]
+        report = {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": git_revision(),
+            "target": args.url or args.server,
+            "config": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            "wall_seconds": round(wall, 3),
+            "async_drain_seconds": None if drain is None else round(drain, 3),
+            "total": summarize(samples, wall),
+            "endpoints": {name: summarize(endpoint_samples, wall) for name, endpoint_samples in test.results.items()},
+            "fakes": {
+                "gemini_calls": len(gemini.requests),
+                "backend_calls": len(backend.requests),
+                "twilio_messages": len(twilio.messages)
+            }
+        }
+
+    print(f"{report['target']} {report['total']['requests']} requests @ concurrency {args.concurrency} "
+          f"in {wall:.2f}s ({report['total']['rps']} req/s), llm={args.llm_latency} backend={args.backend_latency}")
+    if drain is not None:
+        print(f"async replies drained in {drain:.2f}s, fake Twilio received {len(twilio.messages)} messages")
+    print_report(report, baseline)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Consistent-hash routing of conversations to agent nodes.
+
+Each conversation (business_id, sender) is owned by one node. Its
+history, summary and coalescing batch then stay in one process, and so
+do the cached config, model and FAQ index of its business. Twilio can
+post to any node, e.g. through a plain round-robin load balancer. A node
+that doesn't own the conversation forwards the webhook to the owner and
+relays the reply.
+
+If the owner can't be reached, the node answers the message itself.
+With SHARED_STATE_URL set any node can do that; it only starts with
+colder caches. The same happens when `max_forwards` forwards are already
+in flight from this process. A forward holds a worker thread until the
+owner replies, so without the cap every thread of two nodes could end up
+waiting on the other, with none left to answer.
+
+Forwarded requests carry FORWARDED_HEADER and are always answered where
+they land. That way two nodes whose node lists disagree, e.g. during a
+rolling deploy, can't bounce a request between them.
+
+Each node is placed on the ring at `vnodes` points, so adding or
+removing a node moves only about 1/N of the conversations.
+"""
+
+import bisect
+import hashlib
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+FORWARDED_HEADER = 'X-Agent-Forwarded'
+# Headers relayed to the owner; Twilio's signature has to reach it unchanged
+FORWARDED_HEADERS = ('X-Twilio-Signature', 'User-Agent', 'I-Twilio-Idempotency-Token')
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Maps keys to nodes; each node owns the arcs ending at its `vnodes` points"""
+
+    def __init__(self, nodes, vnodes=100):
+        self.nodes = list(dict.fromkeys(nodes))
+        if not self.nodes:
+            raise ValueError("HashRing needs at least one node")
+        self.vnodes = vnodes
+        points = sorted((_hash(f"{node}#{index}"), node) for node in self.nodes for index in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class ClusterRouter:
+    """Decides which node answers a conversation and forwards webhooks to it"""
+
+    def __init__(self, nodes, self_url, vnodes=100, timeout=13.0, connect_timeout=1.0, pool_size=10,
+                 max_forwards=4):
+        self.self_url = self_url.rstrip('/')
+        self.ring = HashRing([node.rstrip('/') for node in nodes], vnodes)
+        if self.self_url not in self.ring.nodes:
+            raise ValueError(f"CLUSTER_SELF_URL {self_url} is not one of CLUSTER_NODES")
+        self.timeout = (connect_timeout, timeout)
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=len(self.ring.nodes), pool_maxsize=pool_size,
+                                                  max_retries=0))
+        self.session.mount('https://', HTTPAdapter(pool_connections=len(self.ring.nodes), pool_maxsize=pool_size,
+                                                   max_retries=0))
+        self.forward_latency = Histogram()
+        self.max_forwards = max_forwards
+        self._slots = threading.BoundedSemaphore(max_forwards)
+        self._lock = threading.Lock()
+        self._stats = {"local": 0, "forwarded": 0, "forward_failures": 0, "received_forwarded": 0,
+                       "over_capacity": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def owner(self, business_id, sender, headers):
+        """The node to forward this conversation to, or None to answer it here
+
+        A returned node holds a forward slot; pass it to forward() or release it with release().
+        """
+        if headers.get(FORWARDED_HEADER):
+            self._count("received_forwarded")
+            return None
+        # Same key as the conversation history, so a conversation and its history live together
+        node = self.ring.node_for(f"{business_id}:{sender}" if business_id else sender)
+        if node == self.self_url:
+            self._count("local")
+            return None
+        if not self._slots.acquire(blocking=False):
+            self._count("over_capacity")
+            return None
+        return node
+
+    def release(self):
+        self._slots.release()
+
+    def forward_headers(self, headers):
+        forwarded = {name: headers[name] for name in FORWARDED_HEADERS if headers.get(name)}
+        forwarded[FORWARDED_HEADER] = self.self_url
+        return forwarded
+
+    def record(self, node, started, error=None):
+        """Count one forwarded request; a failed one is answered locally by the caller"""
+        if error is None:
+            self._count("forwarded")
+            self.forward_latency.observe(time.perf_counter() - started)
+        else:
+            self._count("forward_failures")
+            logger.warning(f"Could not reach {node}, answering locally: {str(error)}")
+
+    def forward(self, node, path, data, headers):
+        """POST a webhook to its owner; returns the response, or None if the owner is unreachable"""
+        started = time.perf_counter()
+        try:
+            response = self.session.post(node + path, data=data, headers=self.forward_headers(headers),
+                                         timeout=self.timeout)
+        except requests.ConnectionError as e:
+            # Connection refused or connect timeout: the owner never saw the message
+            self.record(node, started, e)
+            return None
+        finally:
+            self.release()
+        self.record(node, started)
+        return response
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            **stats,
+            "self": self.self_url,
+            "nodes": self.ring.nodes,
+            "vnodes": self.ring.vnodes,
+            "max_forwards": self.max_forwards,
+            "forward_latency": self.forward_latency.snapshot()
+        }
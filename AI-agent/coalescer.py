@@ -0,0 +1,141 @@
+"""
+Debounce rapid-fire messages per conversation.
+
+WhatsApp users often split one question over several short messages. With
+coalescing on, the first message of a burst opens a batch for its
+(business_id, From) key and later messages join it. The window is
+extended by `window` seconds on every new message, up to `max_wait` after
+the first one. The caller that opened the batch then answers all of its
+messages with one generation, and the others get no reply of their own.
+
+A batch only starts generating after the previous batch for the same
+conversation has finished, so replies go out in order and the history
+the model sees already contains the previous answer.
+"""
+
+import asyncio
+import threading
+import time
+
+from metrics import Counter, Gauge, Histogram
+
+
+class CoalescedBatch:
+    """Messages from one conversation that will be answered together"""
+
+    __slots__ = ('key', 'messages', 'first_at', 'deadline', 'previous', 'finished', '_waiters')
+
+    def __init__(self, key, message, now, deadline, previous=None):
+        self.key = key
+        self.messages = [message]
+        self.first_at = now
+        self.deadline = deadline
+        self.previous = previous
+        self.finished = threading.Event()
+        self._waiters = []
+
+
+class MessageCoalescer:
+    """Batch messages per conversation key and keep one generation in flight per key"""
+
+    def __init__(self, window=1.5, max_wait=5.0, separator="\n"):
+        self.window = window
+        self.max_wait = max_wait
+        self.separator = separator
+        self._lock = threading.Lock()
+        # key -> batch still collecting messages
+        self._open = {}
+        # key -> latest batch that stopped collecting and hasn't finished yet
+        self._running = {}
+
+        self.received = Counter()
+        self.batches = Counter()
+        self.merged = Counter()
+        self.pending = Gauge()
+        self.collect_time = Histogram()
+
+    def submit(self, key, message):
+        """Add a message; returns a new batch for the caller to answer, or None if it joined a pending one"""
+        now = time.monotonic()
+        self.received.inc()
+        with self._lock:
+            batch = self._open.get(key)
+            if batch is not None:
+                batch.messages.append(message)
+                batch.deadline = min(now + self.window, batch.first_at + self.max_wait)
+                self.merged.inc()
+                return None
+            batch = CoalescedBatch(key, message, now, now + self.window, self._running.get(key))
+            self._open[key] = batch
+            self.batches.inc()
+            self.pending.inc()
+            return batch
+
+    def _close(self, batch):
+        """Stop accepting messages once the window has passed; otherwise return the seconds left"""
+        with self._lock:
+            remaining = batch.deadline - time.monotonic()
+            if remaining > 0:
+                return remaining
+            del self._open[batch.key]
+            self._running[batch.key] = batch
+            self.pending.dec()
+            return 0
+
+    def collect(self, batch):
+        """Block until the window closes and the previous reply is done; returns the merged message"""
+        remaining = self._close(batch)
+        while remaining > 0:
+            time.sleep(remaining)
+            remaining = self._close(batch)
+        if batch.previous is not None:
+            batch.previous.finished.wait()
+        self.collect_time.observe(time.monotonic() - batch.first_at)
+        return self.separator.join(batch.messages)
+
+    async def collect_async(self, batch):
+        """collect() for the event loop"""
+        remaining = self._close(batch)
+        while remaining > 0:
+            await asyncio.sleep(remaining)
+            remaining = self._close(batch)
+        previous = batch.previous
+        if previous is not None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with self._lock:
+                if previous.finished.is_set():
+                    future.set_result(True)
+                else:
+                    previous._waiters.append((loop, future))
+            await future
+        self.collect_time.observe(time.monotonic() - batch.first_at)
+        return self.separator.join(batch.messages)
+
+    def finish(self, batch):
+        """Mark the batch answered so the conversation's next batch can start"""
+        with self._lock:
+            if self._running.get(batch.key) is batch:
+                del self._running[batch.key]
+            batch.finished.set()
+            waiters, batch._waiters = batch._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def stats(self):
+        batches = self.batches.value
+        return {
+            "window": self.window,
+            "max_wait": self.max_wait,
+            "received": self.received.value,
+            "batches": batches,
+            "merged": self.merged.value,
+            "avg_batch_size": round(self.received.value / batches, 2) if batches else 0.0,
+            "pending": self.pending.value,
+            "collect_seconds": self.collect_time.snapshot()
+        }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
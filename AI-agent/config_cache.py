@@ -0,0 +1,205 @@
+"""
+Bounded TTL + LRU cache for per-business configuration.
+
+Failed lookups (loader returned None) are cached for a shorter negative
+TTL so a bad business_id doesn't hit the backend on every message, and
+concurrent misses for the same key share a single backend call. A ttl of
+None keeps entries until they are evicted or invalidated.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import Counter
+
+_MISSING = object()
+
+
+class _Flight:
+    """A load in progress that other callers can wait on; async loads are awaited through `future`"""
+
+    def __init__(self, future=None):
+        self.done = threading.Event()
+        self.future = future
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class ConfigCache:
+    """Thread-safe LRU cache with TTL, negative caching and single-flight loads"""
+
+    def __init__(self, maxsize=1000, ttl=300.0, negative_ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+
+        self.hits = Counter()
+        self.negative_hits = Counter()
+        self.misses = Counter()
+        self.coalesced = Counter()
+        self.evictions = Counter()
+        self.expirations = Counter()
+        self.invalidations = Counter()
+
+    def _lookup(self, key, current=None):
+        """Return the cached value (possibly None) or _MISSING; caller holds the lock"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.expirations.inc()
+            return _MISSING
+        if current is not None and not current(value):
+            return _MISSING
+        self._entries.move_to_end(key)
+        if value is None:
+            self.negative_hits.inc()
+        else:
+            self.hits.inc()
+        return value
+
+    def _store(self, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions.inc()
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[1] is None or time.monotonic() < entry[1])
+
+    def get(self, key, default=None, current=None):
+        """Cached value or `default`, counted as a miss; `current(value)` False treats the entry as outdated"""
+        with self._lock:
+            value = self._lookup(key, current)
+            if value is _MISSING:
+                self.misses.inc()
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        self._store(key, value)
+
+    def get_or_load(self, key, loader):
+        """Return the cached value, calling loader(key) at most once per miss"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self.misses.inc()
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced.inc()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader(key)
+            # Don't cache a value that was invalidated while it was loading
+            if not flight.stale:
+                self._store(key, flight.value)
+            return flight.value
+        except Exception as e:
+            # Errors are not cached; waiters see the same exception
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def get_or_load_async(self, key, loader):
+        """Async variant of get_or_load; loader is a coroutine function"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+            flight = self._async_flights.get(key)
+            if flight is None:
+                self.misses.inc()
+                future = asyncio.get_running_loop().create_future()
+                self._async_flights[key] = _Flight(future)
+            else:
+                self.coalesced.inc()
+
+        if flight is not None:
+            try:
+                return await asyncio.shield(flight.future)
+            except asyncio.CancelledError:
+                if not flight.future.cancelled():
+                    raise
+                # Only the leader was cancelled; load it ourselves
+                return await self.get_or_load_async(key, loader)
+
+        try:
+            value = await loader(key)
+            # Don't cache a value that was invalidated while it was loading
+            if not self._async_flights[key].stale:
+                self._store(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure isn't reported at GC time
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                del self._async_flights[key]
+            if not future.done():
+                # The leader was cancelled (e.g. by its deadline); waiters must not hang on its load
+                future.cancel()
+
+    def invalidate(self, key):
+        with self._lock:
+            removed = self._entries.pop(key, _MISSING) is not _MISSING
+            for flights in (self._flights, self._async_flights):
+                if key in flights:
+                    flights[key].stale = True
+        if removed:
+            self.invalidations.inc()
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits.value + self.negative_hits.value + self.misses.value
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "negative_ttl_seconds": self.negative_ttl,
+            "hits": self.hits.value,
+            "negative_hits": self.negative_hits.value,
+            "misses": self.misses.value,
+            "coalesced": self.coalesced.value,
+            "evictions": self.evictions.value,
+            "expirations": self.expirations.value,
+            "invalidations": self.invalidations.value,
+            "hit_rate": round((self.hits.value + self.negative_hits.value) / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,275 @@
+"""
+Batched, asynchronous conversation persistence.
+
+save_conversation only enqueues the record. A background thread collects
+records into batches (by size or after flush_interval seconds) and sends
+each batch to the backend's bulk endpoint in one request. When the backend
+is unreachable or returns a 5xx, the batch is appended to a local JSONL
+spool file instead of being dropped. The spool is replayed once the backend
+accepts writes again. Delivery is at-least-once: a batch that times out
+after the backend committed it may be replayed.
+
+Spool files are shared safely between worker processes. A replaying
+process first renames the spool to a file tagged with its pid, and
+leftovers from dead processes are picked up on the next replay.
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+BULK_PATH = "/api/conversations/bulk"
+SINGLE_PATH = "/api/conversations"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ConversationSink:
+    """Queue conversations and write them to the backend in batches, spooling on failure"""
+
+    def __init__(self, backend, batch_size=50, flush_interval=1.0, queue_size=10000,
+                 spool_path='conversation_spool.jsonl', replay_interval=30.0):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.replay_interval = replay_interval
+        self.bulk_supported = True
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._spool_lock = threading.Lock()
+        self._next_replay = 0.0
+        self._stopping = threading.Event()
+        self._sending = None
+
+        self.submitted = Counter()
+        self.sent = Counter()
+        self.batches = Counter()
+        self.failed_batches = Counter()
+        self.spooled = Counter()
+        self.replayed = Counter()
+        self.rejected = Counter()
+        self.spool_pending = Gauge()
+        self.batch_latency = Histogram()
+
+        spool_dir = os.path.dirname(spool_path)
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        self.spool_pending.set(self._count_spooled())
+
+        self._thread = threading.Thread(target=self._run, name="conversation-sink", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, record):
+        """Queue one conversation record; spools it directly if the queue is full"""
+        self.submitted.inc()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            logger.warning("Conversation queue full, spooling to disk")
+            self._spool([record])
+
+    def _count_spooled(self):
+        total = 0
+        for path in [self.spool_path, *glob.glob(f"{self.spool_path}.*.replay")]:
+            try:
+                with open(path, 'rb') as f:
+                    total += sum(1 for _ in f)
+            except FileNotFoundError:
+                pass
+        return total
+
+    def _spool(self, records):
+        """Append records to the spool and fsync, so they survive a crash"""
+        data = ''.join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self._spool_lock:
+            with open(self.spool_path, 'a', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        self.spooled.inc(len(records))
+        self.spool_pending.inc(len(records))
+
+    def _send(self, records):
+        """Write one batch; returns True when the backend accepted it or rejected it for good"""
+        started = time.perf_counter()
+        try:
+            if self.bulk_supported:
+                response = self.backend.post(BULK_PATH, endpoint="conversations_bulk", json={"conversations": records})
+                if response.status_code in (404, 405):
+                    logger.warning("Backend has no bulk conversation endpoint, falling back to single inserts")
+                    self.bulk_supported = False
+                elif 400 <= response.status_code < 500:
+                    # One bad record fails the whole batch on older backends; find it one insert at a time
+                    logger.warning(f"Backend rejected a batch of {len(records)} conversations "
+                                   f"({response.status_code}), retrying them one by one")
+                else:
+                    return self._accepted(response, len(records))
+            for index, record in enumerate(records):
+                response = self.backend.post(SINGLE_PATH, endpoint="conversations", json=record)
+                if not self._accepted(response, 1):
+                    # Keep only what has not been written yet
+                    del records[:index]
+                    return False
+            return True
+        except Exception as e:
+            logger.warning(f"Conversation batch of {len(records)} not delivered: {str(e)}")
+            return False
+        finally:
+            self.batch_latency.observe(time.perf_counter() - started)
+
+    def _accepted(self, response, count):
+        if response.status_code < 300:
+            rejected = len(self._rejected_rows(response)) if count > 1 else 0
+            self.sent.inc(count - rejected)
+            if rejected:
+                self.rejected.inc(rejected)
+                logger.error(f"Backend rejected {rejected} of {count} conversations in a batch")
+            return True
+        if response.status_code < 500:
+            # A single malformed record will never be accepted; drop it instead of spooling forever
+            self.rejected.inc(count)
+            logger.error(f"Backend rejected {count} conversations: {response.status_code} - {response.text}")
+            return True
+        logger.warning(f"Backend returned {response.status_code} for {count} conversations")
+        return False
+
+    def _rejected_rows(self, response):
+        """Indexes of the records a bulk insert skipped, as the backend reports them"""
+        try:
+            body = response.json()
+        except ValueError:
+            return []
+        if not isinstance(body, dict):
+            return []
+        return body.get('rejected') or []
+
+    def _deliver(self, records):
+        self.batches.inc()
+        if self._send(records):
+            return True
+        self.failed_batches.inc()
+        self._spool(records)
+        return False
+
+    def replay(self):
+        """Send spooled conversations; stops at the first failure and keeps the rest"""
+        claimed = []
+        mine = f"{self.spool_path}.{os.getpid()}.replay"
+        for path in glob.glob(f"{self.spool_path}.*.replay"):
+            pid = path[len(self.spool_path) + 1:-len(".replay")]
+            if path == mine or (pid.isdigit() and not _pid_alive(int(pid))):
+                claimed.append(path)
+        with self._spool_lock:
+            if os.path.exists(self.spool_path) and not os.path.exists(mine):
+                os.replace(self.spool_path, mine)
+                claimed.append(mine)
+        if not claimed:
+            return 0
+
+        replayed = 0
+        for path in dict.fromkeys(claimed):
+            with open(path, 'r', encoding='utf-8') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            for start in range(0, len(records), self.batch_size):
+                batch = records[start:start + self.batch_size]
+                if not self._send(batch):
+                    remaining = batch + records[start + self.batch_size:]
+                    self.spool_pending.dec(len(records) - len(remaining))
+                    # Put the rest back in the claimed file for the next attempt
+                    tmp = f"{path}.tmp"
+                    with open(tmp, 'w', encoding='utf-8') as out:
+                        out.write(''.join(json.dumps(record, ensure_ascii=False) + "\n" for record in remaining))
+                        out.flush()
+                        os.fsync(out.fileno())
+                    os.replace(tmp, path)
+                    self.replayed.inc(replayed)
+                    return replayed
+                replayed += len(batch)
+            os.remove(path)
+            self.spool_pending.dec(len(records))
+        self.replayed.inc(replayed)
+        if replayed:
+            logger.info(f"Replayed {replayed} spooled conversations")
+        return replayed
+
+    def _run(self):
+        while not self._stopping.is_set() or not self._queue.empty():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._sending = batch
+            delivered = self._deliver(batch) if batch else None
+            self._sending = None
+            # Replay the spool once the backend takes writes again (or periodically when idle)
+            if self.spool_pending.value > 0 and delivered is not False and time.monotonic() >= self._next_replay:
+                try:
+                    self.replay()
+                except Exception as e:
+                    logger.error(f"Error replaying conversation spool: {str(e)}")
+                self._next_replay = time.monotonic() + self.replay_interval
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued conversation has been sent or spooled"""
+        self._queue.join()
+
+    def close(self, timeout=10.0):
+        """Flush what is queued; anything the backend doesn't take within `timeout` ends up in the spool"""
+        if not self._thread.is_alive():
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            return
+        # Stuck sending, e.g. on a connection pool that urllib3 already drained at exit
+        leftover = list(self._sending or [])
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            logger.warning(f"Conversation sink still busy at shutdown, spooling {len(leftover)} conversations")
+            self._spool(leftover)
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "submitted": self.submitted.value,
+            "sent": self.sent.value,
+            "batches": self.batches.value,
+            "failed_batches": self.failed_batches.value,
+            "spooled": self.spooled.value,
+            "spool_pending": self.spool_pending.value,
+            "replayed": self.replayed.value,
+            "rejected": self.rejected.value,
+            "bulk_supported": self.bulk_supported,
+            "spool_path": self.spool_path,
+            "batch_latency": self.batch_latency.snapshot()
+        }
@@ -0,0 +1,254 @@
+"""
+Conversation history storage.
+
+Every backend keeps at most `max_turns` turns per conversation and drops
+conversations that have been idle longer than `idle_ttl` seconds:
+
+- InMemoryConversationStore: per-process, LRU-capped on the number of
+  conversations, compact __slots__ turn records
+- SQLiteConversationStore: shared between workers on one host
+- RedisConversationStore: shared between hosts (any Redis-protocol server)
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import Counter
+
+
+class Turn:
+    """One message in a conversation"""
+
+    __slots__ = ('role', 'message')
+
+    def __init__(self, role, message):
+        self.role = role
+        self.message = message
+
+    def to_dict(self):
+        return {"role": self.role, "message": self.message}
+
+    def __repr__(self):
+        return f"Turn({self.role!r}, {self.message!r})"
+
+
+class ConversationStore:
+    """Interface for conversation history backends"""
+
+    def __init__(self, max_turns=20, idle_ttl=86400.0):
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+
+    def get(self, key):
+        """Return the stored turns for a conversation, oldest first"""
+        raise NotImplementedError
+
+    def append(self, key, turns):
+        """Append (role, message) pairs and trim to max_turns"""
+        raise NotImplementedError
+
+    def clear(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"backend": self.__class__.__name__, "max_turns": self.max_turns, "idle_ttl_seconds": self.idle_ttl}
+
+
+class InMemoryConversationStore(ConversationStore):
+    """LRU-capped, idle-expiring in-process store"""
+
+    def __init__(self, max_conversations=10000, max_turns=20, idle_ttl=86400.0):
+        super().__init__(max_turns, idle_ttl)
+        self.max_conversations = max_conversations
+        # key -> [deque of Turn, last_seen]; ordered oldest-touched first
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = Counter()
+        self.expirations = Counter()
+
+    def _expire(self, now):
+        """Drop idle conversations from the cold end; caller holds the lock"""
+        cutoff = now - self.idle_ttl
+        while self._conversations:
+            key, entry = next(iter(self._conversations.items()))
+            if entry[1] > cutoff:
+                break
+            del self._conversations[key]
+            self.expirations.inc()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._conversations.get(key)
+            if entry is None:
+                return []
+            return list(entry[0])
+
+    def append(self, key, turns):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._conversations.get(key)
+            if entry is None:
+                entry = self._conversations[key] = [deque(maxlen=self.max_turns), now]
+            else:
+                entry[1] = now
+                self._conversations.move_to_end(key)
+            entry[0].extend(Turn(role, message) for role, message in turns)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+                self.evictions.inc()
+
+    def clear(self, key):
+        with self._lock:
+            self._conversations.pop(key, None)
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "conversations": len(self._conversations),
+            "max_conversations": self.max_conversations,
+            "evictions": self.evictions.value,
+            "expirations": self.expirations.value
+        }
+
+
+class SQLiteConversationStore(ConversationStore):
+    """SQLite-backed store; safe to share between processes on one host"""
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, path='conversations.db', max_turns=20, idle_ttl=86400.0):
+        super().__init__(max_turns, idle_ttl)
+        self.path = path
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        conn = self._conn()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_turns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_key TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_conversation_turns_key
+                ON conversation_turns (conversation_key, id)
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS conversations (
+                    conversation_key TEXT PRIMARY KEY,
+                    last_seen REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_conversations_last_seen ON conversations (last_seen)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _sweep(self, conn, now):
+        if now - self._last_sweep < self.SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        cutoff = now - self.idle_ttl
+        with conn:
+            conn.execute('''
+                DELETE FROM conversation_turns WHERE conversation_key IN
+                (SELECT conversation_key FROM conversations WHERE last_seen < ?)
+            ''', (cutoff,))
+            conn.execute('DELETE FROM conversations WHERE last_seen < ?', (cutoff,))
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute('SELECT last_seen FROM conversations WHERE conversation_key = ?', (key,)).fetchone()
+        if row is None or row[0] < time.time() - self.idle_ttl:
+            return []
+        rows = conn.execute('''
+            SELECT role, message FROM conversation_turns
+            WHERE conversation_key = ? ORDER BY id DESC LIMIT ?
+        ''', (key, self.max_turns)).fetchall()
+        return [Turn(role, message) for role, message in reversed(rows)]
+
+    def append(self, key, turns):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT INTO conversation_turns (conversation_key, role, message, created_at) VALUES (?, ?, ?, ?)',
+                [(key, role, message, now) for role, message in turns]
+            )
+            conn.execute('''
+                DELETE FROM conversation_turns WHERE conversation_key = ? AND id NOT IN
+                (SELECT id FROM conversation_turns WHERE conversation_key = ? ORDER BY id DESC LIMIT ?)
+            ''', (key, key, self.max_turns))
+            conn.execute('''
+                INSERT INTO conversations (conversation_key, last_seen) VALUES (?, ?)
+                ON CONFLICT(conversation_key) DO UPDATE SET last_seen = excluded.last_seen
+            ''', (key, now))
+        self._sweep(conn, now)
+
+    def clear(self, key):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM conversation_turns WHERE conversation_key = ?', (key,))
+            conn.execute('DELETE FROM conversations WHERE conversation_key = ?', (key,))
+
+    def stats(self):
+        count = self._conn().execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+        return {**super().stats(), "path": self.path, "conversations": count}
+
+
+class RedisConversationStore(ConversationStore):
+    """Redis list per conversation, trimmed with LTRIM and expired with EXPIRE"""
+
+    def __init__(self, client, max_turns=20, idle_ttl=86400.0, prefix='conv:'):
+        super().__init__(max_turns, idle_ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        items = self.client.execute('LRANGE', self.prefix + key, 0, -1) or []
+        return [Turn(*json.loads(item)) for item in items]
+
+    def append(self, key, turns):
+        redis_key = self.prefix + key
+        self.client.pipeline([
+            ('RPUSH', redis_key, *[json.dumps([role, message], ensure_ascii=False) for role, message in turns]),
+            ('LTRIM', redis_key, -self.max_turns, -1),
+            ('EXPIRE', redis_key, int(self.idle_ttl))
+        ])
+
+    def clear(self, key):
+        self.client.execute('DEL', self.prefix + key)
+
+    def stats(self):
+        return {**super().stats(), "url": f"redis://{self.client.host}:{self.client.port}/{self.client.db}"}
+
+
+def create_conversation_store(url='memory://', max_conversations=10000, max_turns=20, idle_ttl=86400.0):
+    """Build a store from a URL: memory://, sqlite:///path/to.db or redis://host:port/db"""
+    if url.startswith('sqlite://'):
+        return SQLiteConversationStore(url[len('sqlite:///'):] or 'conversations.db', max_turns, idle_ttl)
+    if url.startswith('redis://'):
+        from redis_client import RedisClient
+        return RedisConversationStore(RedisClient(url), max_turns, idle_ttl)
+    if url.startswith('memory://'):
+        return InMemoryConversationStore(max_conversations, max_turns, idle_ttl)
+    raise ValueError(f"Unsupported CONVERSATION_STORE_URL: {url}")
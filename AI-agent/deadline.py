@@ -0,0 +1,260 @@
+"""
+Per-request deadlines.
+
+A Deadline is started when a webhook arrives and kept in a context
+variable. Every outbound call made while handling that request can then
+see how much time is left without threading it through each signature.
+Context variables are per thread in the Flask workers and per task in
+the ASGI app. Code without an active deadline behaves as before.
+
+Callers use it in three ways:
+- check() skips optional work (config refresh, summaries, persistence)
+  that can't finish in time; leaving() keeps time back for later stages
+- cap() shortens network timeouts
+- call() / wait_for() bound blocking and async calls such as Gemini;
+  holding() keeps a resource (an LLM slot) until the blocking calls that
+  call() gave up on have actually finished
+
+Each miss is counted under the stage it happened in.
+
+call() runs on a bounded pool of threads (configure() sizes it). A call
+starts on a free thread right away or not at all: when every thread is
+still busy, e.g. with abandoned calls to a stalled provider, it fails
+fast instead of spending its deadline in the pool's queue.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from metrics import Counter, Gauge, Histogram
+
+_current = contextvars.ContextVar('deadline', default=None)
+# Futures of timed-out call()s inside the innermost holding() block
+_abandoned = contextvars.ContextVar('abandoned', default=None)
+
+
+class CallPool:
+    """Threads for blocking calls that can't take a timeout, so the caller can stop waiting for them"""
+
+    def __init__(self, workers, name="deadline"):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._free = threading.Semaphore(workers)
+        self.busy = Gauge()
+        self.saturated = Counter()
+
+    def submit(self, fn, *args, **kwargs):
+        """Start fn on a free thread and return its future; None when every thread is busy"""
+        if not self._free.acquire(blocking=False):
+            self.saturated.inc()
+            return None
+        self.busy.inc()
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        self.busy.dec()
+        self._free.release()
+
+    def stats(self):
+        return {"workers": self.workers, "busy": self.busy.value, "saturated": self.saturated.value}
+
+
+_pool = CallPool(64)
+
+
+def configure(workers):
+    """Size the pool call() runs on; abandoned calls keep their thread until they return"""
+    global _pool
+    if workers != _pool.workers:
+        _pool = CallPool(workers)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage can't start or finish within the request's deadline"""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, budget):
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+
+class DeadlineStats:
+    """Requests run under a deadline, time used, and misses per stage"""
+
+    def __init__(self):
+        self.requests = Counter()
+        self.elapsed = Histogram()
+        self._misses = {}
+        self._lock = threading.Lock()
+
+    def missed(self, stage):
+        with self._lock:
+            counter = self._misses.get(stage)
+            if counter is None:
+                counter = self._misses[stage] = Counter()
+        counter.inc()
+
+    def snapshot(self):
+        with self._lock:
+            misses = {stage: counter.value for stage, counter in self._misses.items()}
+        return {
+            "requests": self.requests.value,
+            "misses": misses,
+            "elapsed_seconds": self.elapsed.snapshot(),
+            "call_pool": _pool.stats()
+        }
+
+
+stats = DeadlineStats()
+
+
+@contextmanager
+def deadline_scope(budget):
+    """Run the block under a deadline of `budget` seconds; a falsy budget means no deadline"""
+    deadline = Deadline(budget) if budget else None
+    token = _current.set(deadline)
+    if deadline is not None:
+        stats.requests.inc()
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+        if deadline is not None:
+            stats.elapsed.observe(deadline.elapsed())
+
+
+def with_deadline(budget, fn):
+    """Wrap fn so each call runs in its own deadline_scope"""
+    def run(*args, **kwargs):
+        with deadline_scope(budget):
+            return fn(*args, **kwargs)
+    return run
+
+
+def remaining():
+    """Seconds left on the current deadline, or None when there is none"""
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def fits(seconds):
+    """True when there is no deadline or more than `seconds` are left"""
+    left = remaining()
+    return left is None or left > seconds
+
+
+def check(stage, needed=0.0):
+    """Raise DeadlineExceeded, counted against `stage`, unless more than `needed` seconds are left"""
+    if not fits(needed):
+        stats.missed(stage)
+        raise DeadlineExceeded(stage)
+
+
+@contextmanager
+def leaving(seconds):
+    """Run the block under the current deadline brought forward by `seconds`, keeping that time for later stages"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    token = _current.set(Deadline(max(0.0, parent.remaining() - seconds)))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def cap(timeout, reserve=0.0):
+    """Shorten a timeout (a number or a (connect, read) pair) to the time left minus `reserve`"""
+    left = remaining()
+    if left is None:
+        return timeout
+    left = max(0.001, left - reserve)
+    if isinstance(timeout, tuple):
+        return tuple(min(part, left) for part in timeout)
+    return left if timeout is None else min(timeout, left)
+
+
+def call(stage, fn, *args, reserve=0.0, **kwargs):
+    """Run a blocking call, giving up `reserve` seconds before the deadline; the call finishes in the background"""
+    left = remaining()
+    if left is None:
+        return fn(*args, **kwargs)
+    check(stage, reserve)
+    future = _pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    if future is None:
+        # Queueing behind calls that have already missed their deadlines would only miss this one too
+        stats.missed(stage)
+        raise DeadlineExceeded(stage)
+    try:
+        return future.result(timeout=left - reserve)
+    except FutureTimeout:
+        stats.missed(stage)
+        abandoned = _abandoned.get()
+        if abandoned is not None:
+            abandoned.append(future)
+        raise DeadlineExceeded(stage) from None
+
+
+@contextmanager
+def holding(release):
+    """Run the block, then call `release` once the block and every call() it gave up on have finished"""
+    abandoned = []
+    token = _abandoned.set(abandoned)
+    try:
+        yield
+    finally:
+        _abandoned.reset(token)
+        running = [future for future in abandoned if not future.done()]
+        if not running:
+            release()
+        else:
+            # A call cut off by the deadline is still using whatever was held for it
+            left = [len(running)]
+            lock = threading.Lock()
+
+            def finished(_):
+                with lock:
+                    left[0] -= 1
+                    last = left[0] == 0
+                if last:
+                    release()
+
+            for future in running:
+                future.add_done_callback(finished)
+
+
+async def wait_for(stage, awaitable, reserve=0.0):
+    """Await with the time left minus `reserve` as timeout; the awaitable is cancelled when it runs out"""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    if left <= reserve:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        stats.missed(stage)
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, left - reserve)
+    except asyncio.TimeoutError:
+        stats.missed(stage)
+        raise DeadlineExceeded(stage) from None
@@ -0,0 +1,150 @@
+"""
+Per-business FAQ retrieval.
+
+FAQIndex ranks FAQ entries against a customer question with BM25 over an
+inverted index of the entry questions. A match whose confidence clears the
+direct-answer threshold is answered from the FAQ without calling the LLM;
+otherwise only the top-k entries are injected into the prompt instead of
+the whole FAQ.
+
+Entries come from, in order of precedence:
+- FAQ_DIR/<business_id>.json: a list of {"question": ..., "answer": ...}
+- the "faqs" list in the backend's /api/setup/status payload
+- the built-in CONTEXT_FAQ text for requests without a business
+"""
+
+import heapq
+import json
+import logging
+import math
+import os
+import re
+
+from config_cache import ConfigCache
+from response_cache import normalize, tokenize
+
+logger = logging.getLogger(__name__)
+
+_NUMBERED_ENTRY = re.compile(r'^\s*\d+\.\s*(.+?)\s*\n(.+?)\s*$', re.MULTILINE)
+
+
+class FAQEntry:
+    __slots__ = ('question', 'answer')
+
+    def __init__(self, question, answer):
+        self.question = question
+        self.answer = answer
+
+
+def parse_numbered_faq(text):
+    """Parse 'N. Question\\nAnswer' blocks (the CONTEXT_FAQ format)"""
+    return [FAQEntry(question, answer) for question, answer in _NUMBERED_ENTRY.findall(text)]
+
+
+def format_entries(entries):
+    return "\n".join(f"{index}. {entry.question}\n{entry.answer}" for index, entry in enumerate(entries, 1))
+
+
+class FAQIndex:
+    """BM25 index over FAQ questions"""
+
+    def __init__(self, entries, k1=1.5, b=0.75):
+        self.entries = list(entries)
+        self.k1 = k1
+        self.b = b
+        documents = [tokenize(normalize(entry.question)) for entry in self.entries]
+        self.count = len(documents)
+        self.avgdl = (sum(len(doc) for doc in documents) / self.count) if self.count else 0.0
+
+        # term -> list of (entry id, precomputed BM25 weight)
+        self.postings = {}
+        frequencies = []
+        for doc_id, doc in enumerate(documents):
+            counts = {}
+            for term in doc:
+                counts[term] = counts.get(term, 0) + 1
+            frequencies.append(counts)
+        # BM25 term weights only depend on the entry, so compute them once at build time
+        document_frequency = {}
+        for counts in frequencies:
+            for term in counts:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        self.idf = {
+            term: math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+        self.unknown_idf = math.log(1 + (self.count + 0.5) / 0.5)
+        # Score of each entry against its own question, used to normalize confidence
+        self.self_scores = []
+        for doc_id, counts in enumerate(frequencies):
+            norm = self.k1 * (1 - self.b + self.b * len(documents[doc_id]) / self.avgdl)
+            self_score = 0.0
+            for term, tf in counts.items():
+                weight = self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+                self.postings.setdefault(term, []).append((doc_id, weight))
+                self_score += weight
+            self.self_scores.append(self_score)
+
+    def __len__(self):
+        return self.count
+
+    def _score_terms(self, terms):
+        scores = {}
+        for term in set(terms):
+            for doc_id, weight in self.postings.get(term, ()):
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight
+        return scores
+
+    def search(self, question, k=3):
+        """Return up to k (entry, confidence) pairs, best first; confidence is in [0, 1]"""
+        terms = tokenize(normalize(question))
+        if not terms or not self.count:
+            return []
+        scores = self._score_terms(terms)
+        # Extra, unmatched words in the question lower confidence just like missing ones
+        query_mass = sum(self.idf.get(term, self.unknown_idf) for term in set(terms))
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [
+            (self.entries[doc_id], min(1.0, score / max(self.self_scores[doc_id], query_mass)))
+            for doc_id, score in best
+        ]
+
+
+class FAQRegistry:
+    """Builds and caches one FAQIndex per business; the default entries only serve requests without a business"""
+
+    def __init__(self, default_entries, faq_dir=None, maxsize=1000):
+        self.default_index = FAQIndex(default_entries)
+        self.empty_index = FAQIndex([])
+        self.faq_dir = faq_dir
+        # business_id -> (business config the index was built from, index)
+        self._indexes = ConfigCache(maxsize, ttl=None)
+
+    def _load_entries(self, business_id, business_config):
+        if self.faq_dir and business_id:
+            path = os.path.join(self.faq_dir, f"{os.path.basename(business_id)}.json")
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return [FAQEntry(item['question'], item['answer']) for item in json.load(f)]
+        if business_config and business_config.get('faqs'):
+            return [FAQEntry(item['question'], item['answer']) for item in business_config['faqs']]
+        return None
+
+    def for_business(self, business_id, business_config=None):
+        if business_id is None:
+            return self.default_index
+        entry = self._indexes.get(business_id, current=lambda entry: entry[0] is business_config)
+        if entry is None:
+            try:
+                entries = self._load_entries(business_id, business_config)
+            except Exception as e:
+                logger.error(f"Error loading FAQ for {business_id}: {str(e)}")
+                entries = None
+            # A business without FAQs gets none: the demo FAQ's answers (hours, contact) aren't its own
+            index = FAQIndex(entries) if entries else self.empty_index
+            entry = (business_config, index)
+            self._indexes.set(business_id, entry)
+        return entry[1]
+
+    def invalidate(self, business_id):
+        return self._indexes.invalidate(business_id)
@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for running the agent with several worker processes.
+
+    gunicorn -c gunicorn.conf.py 'app:create_app()'
+
+Gunicorn picks this file up by itself when started from this directory.
+Each worker has its own caches. Set SHARED_STATE_URL so the workers
+share conversation history, business configs and rate limits:
+sqlite:///path/to.db on one host, redis://host:port/db across hosts.
+Command-line flags override these settings, e.g. `-w 8`.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 8000)}")
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Requests spend most of their time waiting on Gemini and the backend, so each worker runs threads
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_class = 'gthread' if threads > 1 else 'sync'
+# Above REQUEST_DEADLINE, so a slow LLM call gets the fallback reply instead of a killed worker
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Import app.py (and the SDKs, with PRELOAD_SDKS) once in the master and fork the workers from it
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+# Recycle workers now and then; the jitter keeps them from restarting together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0)) or max_requests // 10
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+
+
+def on_starting(server):
+    shared = os.getenv('SHARED_STATE_URL', 'memory://')
+    if server.cfg.workers > 1 and shared.startswith('memory://'):
+        server.log.warning(
+            f"{server.cfg.workers} workers without SHARED_STATE_URL: each keeps its own conversation history, "
+            "config cache and rate limits")
+
+
+def post_worker_init(worker):
+    # Build the agent before the worker accepts connections, so no webhook waits for it
+    import app
+    app.init_agent()
@@ -0,0 +1,100 @@
+"""
+Turn conversation history into Gemini multi-turn contents.
+
+HistoryTruncator keeps the most recent turns that fit a token budget and,
+optionally, folds the turns that fell out of the window into a running
+summary that is cached per conversation. compact_prompt() strips the
+indentation and repeated spaces of prompt text, which cost tokens
+without telling the model anything.
+"""
+
+import hashlib
+import re
+
+from config_cache import ConfigCache
+
+# Rough chars-per-token ratio for English text with Gemini's tokenizer
+CHARS_PER_TOKEN = 4
+
+GEMINI_ROLES = {"user": "user", "assistant": "model"}
+
+
+def estimate_tokens(text):
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+_SPACES = re.compile(r'[ \t\f\v]+')
+_BLANK_LINES = re.compile(r'\n{3,}')
+
+
+def compact_prompt(text):
+    """Collapse runs of spaces, strip every line and keep at most one blank line between paragraphs"""
+    text = '\n'.join(_SPACES.sub(' ', line).strip() for line in text.splitlines())
+    return _BLANK_LINES.sub('\n\n', text).strip()
+
+
+def _turn_digest(turn):
+    return hashlib.blake2b(f"{turn.role}\0{turn.message}".encode('utf-8'), digest_size=8).digest()
+
+
+class HistoryTruncator:
+    """Token-budgeted history window with an optional cached running summary"""
+
+    def __init__(self, token_budget=1500, summarize=False, summary_cache_size=10000, summary_ttl=86400.0):
+        self.token_budget = token_budget
+        self.summarize = summarize
+        # key -> (summary text, digests of the turns it covers)
+        self.summaries = ConfigCache(summary_cache_size, summary_ttl)
+
+    def split(self, turns):
+        """Return (older, recent): recent is the newest suffix that fits the budget"""
+        used = 0
+        start = len(turns)
+        for index in range(len(turns) - 1, -1, -1):
+            used += estimate_tokens(turns[index].message)
+            if used > self.token_budget:
+                break
+            start = index
+        # Gemini expects the conversation to open with a user turn
+        while start < len(turns) and turns[start].role != "user":
+            start += 1
+        return turns[:start], turns[start:]
+
+    def summary_prompt(self, key, older):
+        """Return (prompt, cached summary); prompt is None when the cache is current"""
+        if not self.summarize or not older:
+            return None, None
+        entry = self.summaries.get(key)
+        previous, covered = entry if entry else (None, frozenset())
+        new_turns = [turn for turn in older if _turn_digest(turn) not in covered]
+        if not new_turns:
+            return None, previous
+
+        transcript = "\n".join(f"{turn.role.capitalize()}: {turn.message}" for turn in new_turns)
+        prompt = "Summarize this customer support conversation in a few sentences. " \
+                 "Keep names, order numbers, requests and anything promised to the customer.\n\n"
+        if previous:
+            prompt += f"Summary so far: {previous}\n\n"
+        return prompt + transcript, previous
+
+    def save_summary(self, key, older, summary):
+        self.summaries.set(key, (summary, frozenset(_turn_digest(turn) for turn in older)))
+
+
+def build_contents(context, turns, user_message, summary=None, reference=None):
+    """Build a Gemini contents list: context, earlier turns, then the new message.
+
+    context is None when it is already bound to the model as a system instruction.
+    reference is extra material (e.g. FAQ entries) sent alongside the new message only.
+    """
+    preamble = context or ""
+    if summary:
+        preamble += f"\n\nSummary of the earlier conversation: {summary}"
+    contents = []
+    if preamble:
+        contents.append({"role": "user", "parts": [preamble.strip()]})
+        contents.append({"role": "model", "parts": ["Understood."]})
+    for turn in turns:
+        contents.append({"role": GEMINI_ROLES[turn.role], "parts": [turn.message]})
+    contents.append({"role": "user", "parts": [reference, user_message] if reference else [user_message]})
+    return contents
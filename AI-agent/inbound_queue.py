@@ -0,0 +1,331 @@
+"""
+Durable inbound queue for async replies.
+
+With ASYNC_REPLY_QUEUE_URL=sqlite:///path the webhook writes each
+incoming message to a SQLite table (WAL) keyed by Twilio's MessageSid
+before acknowledging it, and a pool of worker threads answers from the
+table:
+
+- Deduplication: Twilio retries a webhook it thinks failed. A MessageSid
+  that is already in the table is acknowledged without a second reply.
+  Answered messages are kept for `retention` seconds so late retries
+  still match.
+- Crash recovery: a claimed message carries a lease. If the process dies
+  mid-reply, the message can be claimed again once the lease runs out, by
+  any process using the same file, including the restarted one.
+- Retries: a failed reply is retried with exponential backoff up to
+  `max_attempts` times, then kept with status 'failed'. The generated
+  reply is stored before it is sent, so when only the Twilio send failed
+  the retry doesn't call the LLM again.
+- Ordering: only one worker handles a conversation at a time. Messages
+  that arrive while it is busy are claimed together next and answered
+  with one reply, so replies go out in order.
+
+Delivery is at-least-once: a process that dies after sending a reply but
+before marking it done sends it again after recovery.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+CLAIMABLE = "((status = 'queued' AND available_at <= :now) OR (status = 'processing' AND lease_expires < :now))"
+
+
+class InboundQueue:
+    """Messages keyed by MessageSid in a SQLite table, claimed one conversation at a time"""
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, path='inbound_queue.db', lease=90.0, max_attempts=5, retry_backoff=2.0,
+                 max_backoff=300.0, retention=86400.0, max_batch=20):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.retention = retention
+        self.max_batch = max_batch
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        conn = self._conn()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS inbound_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message_sid TEXT NOT NULL UNIQUE,
+                    conversation_key TEXT NOT NULL,
+                    business_id TEXT,
+                    from_number TEXT NOT NULL,
+                    to_number TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    reply TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    available_at REAL NOT NULL,
+                    lease_expires REAL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_inbound_status ON inbound_messages (status, available_at)')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_inbound_conversation
+                ON inbound_messages (conversation_key, status)
+            ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, work):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = work(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def enqueue(self, message_sid, business_id, from_number, to_number, body):
+        """Store a message; returns False when its MessageSid is already queued or answered"""
+        now = time.time()
+        cursor = self._conn().execute('''
+            INSERT OR IGNORE INTO inbound_messages
+            (message_sid, conversation_key, business_id, from_number, to_number, body, status,
+             created_at, available_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)
+        ''', (message_sid, f"{business_id}:{from_number}", business_id, from_number, to_number, body, now, now, now))
+        return cursor.rowcount == 1
+
+    def claim(self):
+        """Lease the oldest claimable conversation's waiting messages; [] when there is nothing to do"""
+        now = time.time()
+
+        def work(conn):
+            # Skip conversations another worker is answering or whose earlier message is backing off
+            row = conn.execute(f'''
+                SELECT conversation_key FROM inbound_messages AS m
+                WHERE {CLAIMABLE} AND NOT EXISTS (
+                    SELECT 1 FROM inbound_messages AS b
+                    WHERE b.conversation_key = m.conversation_key
+                    AND ((b.status = 'processing' AND b.lease_expires >= :now)
+                         OR (b.status = 'queued' AND b.available_at > :now AND b.id < m.id))
+                )
+                ORDER BY id LIMIT 1
+            ''', {"now": now}).fetchone()
+            if row is None:
+                return []
+            rows = conn.execute(f'''
+                SELECT * FROM inbound_messages WHERE conversation_key = :key AND {CLAIMABLE}
+                ORDER BY id LIMIT :limit
+            ''', {"key": row['conversation_key'], "now": now, "limit": self.max_batch}).fetchall()
+            ids = [message['id'] for message in rows]
+            conn.execute(f'''
+                UPDATE inbound_messages SET status = 'processing', attempts = attempts + 1,
+                lease_expires = ?, updated_at = ? WHERE id IN ({','.join('?' * len(ids))})
+            ''', (now + self.lease, now, *ids))
+            return [{**dict(message), "attempts": message['attempts'] + 1} for message in rows]
+
+        claimed = self._transaction(work)
+        if now - self._last_sweep >= self.SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.sweep(now)
+        return claimed
+
+    def _update(self, messages, sql, *params):
+        ids = [message['id'] for message in messages]
+        self._conn().execute(f"{sql} WHERE id IN ({','.join('?' * len(ids))})", (*params, *ids))
+
+    def store_reply(self, messages, reply):
+        """Keep the generated reply so a retry only has to send it"""
+        self._update(messages, 'UPDATE inbound_messages SET reply = ?, updated_at = ?', reply, time.time())
+
+    def complete(self, messages):
+        self._update(messages, '''
+            UPDATE inbound_messages SET status = 'done', error = NULL, lease_expires = NULL, updated_at = ?
+        ''', time.time())
+
+    def fail(self, messages, error):
+        """Requeue with backoff, or mark failed after max_attempts; returns how many were given up on"""
+        now = time.time()
+        self._update(messages, '''
+            UPDATE inbound_messages SET
+                status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                available_at = ? + MIN(?, ? * (1 << MAX(attempts - 1, 0))),
+                error = ?, lease_expires = NULL, updated_at = ?
+        ''', self.max_attempts, now, self.max_backoff, self.retry_backoff, error[:1000], now)
+        return sum(1 for message in messages if message['attempts'] >= self.max_attempts)
+
+    def pending(self):
+        """Messages queued or being answered"""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM inbound_messages WHERE status IN ('queued', 'processing')"
+        ).fetchone()[0]
+
+    def counts(self):
+        rows = self._conn().execute('SELECT status, COUNT(*) FROM inbound_messages GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def sweep(self, now=None):
+        """Forget answered and failed messages older than the retention window"""
+        cutoff = (now or time.time()) - self.retention
+        self._conn().execute(
+            "DELETE FROM inbound_messages WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+        )
+
+
+class DurableReplyDispatcher:
+    """ReplyDispatcher whose jobs live in an InboundQueue instead of memory"""
+
+    def __init__(self, handler, sender, inbound_queue, workers=4, queue_size=10000, poll_interval=0.5,
+                 separator="\n"):
+        self.handler = handler
+        self.sender = sender
+        self.queue = inbound_queue
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.separator = separator
+        self.workers = []
+        self._wakeup = threading.Condition()
+        self._stopping = False
+
+        self.submitted = Counter()
+        self.duplicates = Counter()
+        self.rejected = Counter()
+        self.completed = Counter()
+        self.retried = Counter()
+        self.failed = Counter()
+        self.recovered = Counter()
+        self.reused_replies = Counter()
+        self.in_flight = Gauge()
+        self.queue_wait = Histogram()
+        self.processing_time = Histogram()
+        self.end_to_end = Histogram()
+
+        for index in range(workers):
+            worker = threading.Thread(target=self._run, name=f"reply-worker-{index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, business_id, from_number, to_number, message, message_sid=None):
+        """Persist a message; returns False when the queue is full. A repeated MessageSid is accepted and dropped"""
+        if self.queue_size and self.queue.pending() >= self.queue_size:
+            self.rejected.inc()
+            return False
+        if not self.queue.enqueue(message_sid or f"local-{uuid.uuid4().hex}", business_id, from_number,
+                                  to_number, message):
+            self.duplicates.inc()
+            logger.info(f"Duplicate webhook for {message_sid} ignored")
+            return True
+        self.submitted.inc()
+        with self._wakeup:
+            self._wakeup.notify()
+        return True
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                messages = self.queue.claim()
+            except Exception as e:
+                logger.error(f"Error claiming queued messages: {str(e)}")
+                messages = []
+            if not messages:
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(self.poll_interval)
+                continue
+            self._process(messages)
+
+    def _process(self, messages):
+        first = messages[0]
+        started = time.perf_counter()
+        self.queue_wait.observe(max(0.0, time.time() - first['created_at']))
+        self.recovered.inc(sum(1 for message in messages if message['status'] == 'processing'))
+        self.in_flight.inc()
+        try:
+            replies = {message['reply'] for message in messages}
+            if len(replies) == 1 and None not in replies:
+                # Generated on an earlier attempt whose send failed
+                ai_response = replies.pop()
+                self.reused_replies.inc()
+            else:
+                ai_response = self.handler(
+                    first['business_id'], first['from_number'], first['to_number'],
+                    self.separator.join(message['body'] for message in messages)
+                )
+                self.queue.store_reply(messages, ai_response)
+            # Reply goes back to the sender from the number they wrote to
+            self.sender.send(first['from_number'], first['to_number'], ai_response)
+            self.queue.complete(messages)
+            self.completed.inc(len(messages))
+        except Exception as e:
+            logger.error(f"Error delivering async reply to {first['from_number']}: {str(e)}")
+            try:
+                given_up = self.queue.fail(messages, str(e))
+            except Exception as fail_error:
+                # The lease runs out and the messages are claimed again
+                logger.error(f"Error requeueing messages for {first['from_number']}: {str(fail_error)}")
+                given_up = 0
+            self.failed.inc(given_up)
+            self.retried.inc(len(messages) - given_up)
+        finally:
+            finished = time.perf_counter()
+            self.processing_time.observe(finished - started)
+            self.end_to_end.observe(max(0.0, time.time() - first['created_at']))
+            self.in_flight.dec()
+
+    def join(self, timeout=None):
+        """Block until no message is queued or being answered (retries waiting on backoff included)"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while self.queue.pending():
+            if deadline and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def shutdown(self):
+        """Stop the workers after their current message; queued messages stay in the file"""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+    def stats(self):
+        return {
+            "durable": True,
+            "path": self.queue.path,
+            "messages": self.queue.counts(),
+            "queue_depth": self.queue.pending(),
+            "queue_capacity": self.queue_size,
+            "workers": len(self.workers),
+            "in_flight": self.in_flight.value,
+            "submitted": self.submitted.value,
+            "duplicates": self.duplicates.value,
+            "rejected": self.rejected.value,
+            "completed": self.completed.value,
+            "retried": self.retried.value,
+            "failed": self.failed.value,
+            "recovered": self.recovered.value,
+            "reused_replies": self.reused_replies.value,
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+            "processing_seconds": self.processing_time.snapshot(),
+            "end_to_end_seconds": self.end_to_end.snapshot(),
+            "twilio_send_seconds": self.sender.send_latency.snapshot()
+        }
@@ -0,0 +1,560 @@
+"""
+LLM providers behind one interface, and a router across them.
+
+Each provider turns the agent's Gemini-style contents (a prompt string, or
+a list of {"role": "user"|"model", "parts": [...]} turns) plus an optional
+system text into a reply:
+
+- GeminiSDKProvider: google.generativeai, as used so far
+- GeminiRESTProvider: the generateContent REST endpoint over a pooled session
+- CohereProvider: the cohere SDK's chat endpoint
+
+LLMRouter keeps a rolling window of latencies and failures per provider
+and sends each request to the fastest healthy one, with a small share of
+traffic explored on the others so their numbers stay current. On an
+error it fails over to the next provider. With hedging on, a request that
+is still running after the primary's p95 latency is also sent to the next
+provider, and whichever answers first wins.
+
+RoutedModel wraps a router in the generate_content / generate_content_async
+interface of genai.GenerativeModel, so the rest of the agent is unchanged.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from config_cache import ConfigCache
+from deadline import CallPool
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_URL = 'https://generativelanguage.googleapis.com'
+
+
+def to_turns(contents):
+    """Normalize contents to [(role, text)] with roles 'user' / 'model'"""
+    if isinstance(contents, str):
+        return [("user", contents)]
+    turns = []
+    for content in contents:
+        parts = content.get("parts", [])
+        text = "\n\n".join(part if isinstance(part, str) else part.get("text", "") for part in parts)
+        turns.append((content.get("role", "user"), text))
+    return turns
+
+
+class LLMResponse:
+    """Minimal stand-in for a GenerateContentResponse"""
+
+    def __init__(self, text, provider=None):
+        self.text = text
+        self.provider = provider
+
+
+class LLMProvider:
+    """Base class; subclasses implement generate and may override the async and streaming variants"""
+
+    name = 'provider'
+
+    def generate(self, contents, system=None):
+        raise NotImplementedError
+
+    async def generate_async(self, contents, system=None):
+        return await asyncio.to_thread(self.generate, contents, system)
+
+    def stream(self, contents, system=None):
+        yield self.generate(contents, system)
+
+    async def stream_async(self, contents, system=None):
+        yield await self.generate_async(contents, system)
+
+
+class GeminiSDKProvider(LLMProvider):
+    """google.generativeai; the system text becomes an opening turn when the SDK can't bind it"""
+
+    name = 'gemini'
+
+    def __init__(self, model_name, maxsize=1000):
+        import google.generativeai as genai
+        self.genai = genai
+        self.model_name = model_name
+        self.supports_system_instruction = \
+            'system_instruction' in inspect.signature(genai.GenerativeModel).parameters
+        # system text (or None) -> GenerativeModel
+        self._models = ConfigCache(maxsize, ttl=None)
+
+    def _prepare(self, contents, system):
+        """Model to call and the contents to send it"""
+        bound = system if self.supports_system_instruction else None
+        if system and not bound:
+            opening = [{"role": "user", "parts": [system]}, {"role": "model", "parts": ["Understood."]}]
+            contents = opening + ([{"role": "user", "parts": [contents]}] if isinstance(contents, str) else list(contents))
+        key = bound or ''
+        model = self._models.get(key)
+        if model is None:
+            if bound:
+                model = self.genai.GenerativeModel(self.model_name, system_instruction=bound)
+            else:
+                model = self.genai.GenerativeModel(self.model_name)
+            self._models.set(key, model)
+        return model, contents
+
+    def generate(self, contents, system=None):
+        model, contents = self._prepare(contents, system)
+        return model.generate_content(contents).text
+
+    async def generate_async(self, contents, system=None):
+        model, contents = self._prepare(contents, system)
+        return (await model.generate_content_async(contents)).text
+
+    def stream(self, contents, system=None):
+        model, contents = self._prepare(contents, system)
+        for chunk in model.generate_content(contents, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+    async def stream_async(self, contents, system=None):
+        model, contents = self._prepare(contents, system)
+        async for chunk in await model.generate_content_async(contents, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class GeminiRESTProvider(LLMProvider):
+    """Gemini generateContent over HTTP, with a keep-alive session and native system instructions"""
+
+    name = 'gemini_rest'
+
+    def __init__(self, api_key, model_name, api_url=GEMINI_API_URL, timeout=(3.05, 30), pool_size=10):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Keep one connection per concurrent call; past pool_size they are closed after each request
+        self.session.mount(self.api_url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0))
+        self._async_client = None
+
+    def _url(self, method):
+        return f"{self.api_url}/v1beta/models/{self.model_name}:{method}"
+
+    def _body(self, contents, system):
+        body = {"contents": [{"role": role, "parts": [{"text": text}]} for role, text in to_turns(contents)]}
+        if system:
+            body["systemInstruction"] = {"parts": [{"text": system}]}
+        return body
+
+    @staticmethod
+    def _text(payload):
+        candidates = payload.get('candidates') or []
+        if not candidates:
+            raise RuntimeError(f"Gemini returned no candidates: {payload.get('promptFeedback')}")
+        return ''.join(part.get('text', '') for part in candidates[0].get('content', {}).get('parts', []))
+
+    @staticmethod
+    def _check(status_code, text):
+        if status_code != 200:
+            raise RuntimeError(f"Gemini REST returned {status_code}: {text[:200]}")
+
+    def generate(self, contents, system=None):
+        response = self.session.post(self._url('generateContent'), params={"key": self.api_key},
+                                     json=self._body(contents, system), timeout=self.timeout)
+        self._check(response.status_code, response.text)
+        return self._text(response.json())
+
+    def _client(self):
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]))
+        return self._async_client
+
+    async def generate_async(self, contents, system=None):
+        response = await self._client().post(self._url('generateContent'), params={"key": self.api_key},
+                                             json=self._body(contents, system))
+        self._check(response.status_code, response.text)
+        return self._text(response.json())
+
+    def stream(self, contents, system=None):
+        with self.session.post(self._url('streamGenerateContent'), params={"key": self.api_key, "alt": "sse"},
+                               json=self._body(contents, system), timeout=self.timeout, stream=True) as response:
+            self._check(response.status_code, response.text if response.status_code != 200 else '')
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith('data:'):
+                    text = self._text(json.loads(line[5:]))
+                    if text:
+                        yield text
+
+    async def stream_async(self, contents, system=None):
+        async with self._client().stream('POST', self._url('streamGenerateContent'),
+                                         params={"key": self.api_key, "alt": "sse"},
+                                         json=self._body(contents, system)) as response:
+            if response.status_code != 200:
+                await response.aread()
+                self._check(response.status_code, response.text)
+            async for line in response.aiter_lines():
+                if line and line.startswith('data:'):
+                    text = self._text(json.loads(line[5:]))
+                    if text:
+                        yield text
+
+
+class CohereProvider(LLMProvider):
+    """Cohere chat; earlier turns go in chat_history and the system text in the preamble"""
+
+    name = 'cohere'
+
+    def __init__(self, api_key, model_name='command'):
+        import cohere
+        self.client = cohere.Client(api_key)
+        self.model_name = model_name
+
+    def _request(self, contents, system):
+        turns = to_turns(contents)
+        history = [{"role": "USER" if role == "user" else "CHATBOT", "message": text} for role, text in turns[:-1]]
+        request = {"message": turns[-1][1], "model": self.model_name, "chat_history": history}
+        if system:
+            request["preamble_override"] = system
+        return request
+
+    def generate(self, contents, system=None):
+        return self.client.chat(**self._request(contents, system)).text
+
+    def stream(self, contents, system=None):
+        for event in self.client.chat(stream=True, **self._request(contents, system)):
+            if getattr(event, 'event_type', None) == 'text-generation' and event.text:
+                yield event.text
+
+
+class ProviderStats:
+    """Rolling latency and error rate over the last `window` calls"""
+
+    def __init__(self, window=100):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = Counter()
+        self.failures = Counter()
+        self.hedges = Counter()
+        self.hedge_wins = Counter()
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.requests.inc()
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(latency)
+                self.consecutive_failures = 0
+            else:
+                self.failures.inc()
+                self.consecutive_failures += 1
+
+    def percentile(self, q):
+        with self._lock:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+    @property
+    def error_rate(self):
+        outcomes = list(self.outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def snapshot(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "requests": self.requests.value,
+            "failures": self.failures.value,
+            "error_rate": round(self.error_rate, 3),
+            "p50": round(p50, 4) if p50 is not None else None,
+            "p95": round(p95, 4) if p95 is not None else None,
+            "hedges": self.hedges.value,
+            "hedge_wins": self.hedge_wins.value,
+            "healthy": self.down_until <= time.monotonic()
+        }
+
+
+class LLMRouter:
+    """Route to the fastest healthy provider, failing over and optionally hedging slow calls"""
+
+    def __init__(self, providers, hedge=False, hedge_delay=2.0, hedge_min_samples=20, explore=0.05,
+                 max_error_rate=0.5, failure_threshold=3, cooldown=30.0, window=100, hedge_threads=32):
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider")
+        self.providers = list(providers)
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.explore = explore
+        self.max_error_rate = max_error_rate
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.stats_by_provider = {provider.name: ProviderStats(window) for provider in self.providers}
+        # Hedged sync calls run here; with no thread free a call goes out unhedged instead of queueing
+        self._pool = CallPool(hedge_threads, name="llm-hedge") if hedge else None
+
+        self.failovers = Counter()
+        self.exhausted = Counter()
+
+    def _healthy(self, provider):
+        stats = self.stats_by_provider[provider.name]
+        if stats.down_until > time.monotonic():
+            return False
+        return len(stats.outcomes) < 10 or stats.error_rate <= self.max_error_rate
+
+    def ranked(self):
+        """Providers in the order to try: healthy ones fastest first (configured order breaks ties)"""
+        def latency(item):
+            index, provider = item
+            p50 = self.stats_by_provider[provider.name].percentile(50)
+            return (p50 if p50 is not None else 0.0, index)
+
+        indexed = list(enumerate(self.providers))
+        healthy = [provider for _, provider in sorted(
+            (item for item in indexed if self._healthy(item[1])), key=latency)]
+        unhealthy = [provider for _, provider in indexed if not self._healthy(provider)]
+        if len(healthy) > 1 and random.random() < self.explore:
+            # Keep latency numbers fresh for providers that aren't currently first
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        return healthy + unhealthy
+
+    def _record(self, provider, started, ok):
+        stats = self.stats_by_provider[provider.name]
+        stats.record(time.perf_counter() - started, ok)
+        if not ok and stats.consecutive_failures >= self.failure_threshold:
+            stats.down_until = time.monotonic() + self.cooldown
+            logger.warning(f"LLM provider {provider.name} marked down for {self.cooldown}s")
+
+    def _hedge_after(self, provider):
+        stats = self.stats_by_provider[provider.name]
+        if len(stats.latencies) < self.hedge_min_samples:
+            return self.hedge_delay
+        return stats.percentile(95)
+
+    def _call(self, provider, contents, system):
+        started = time.perf_counter()
+        try:
+            text = provider.generate(contents, system)
+        except Exception:
+            self._record(provider, started, False)
+            raise
+        self._record(provider, started, True)
+        return LLMResponse(text, provider.name)
+
+    async def _call_async(self, provider, contents, system):
+        started = time.perf_counter()
+        try:
+            text = await provider.generate_async(contents, system)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._record(provider, started, False)
+            raise
+        self._record(provider, started, True)
+        return LLMResponse(text, provider.name)
+
+    def _failed(self, provider, error, remaining):
+        logger.warning(f"LLM provider {provider.name} failed: {str(error)}")
+        if remaining:
+            self.failovers.inc()
+
+    def generate(self, contents, system=None):
+        order = self.ranked()
+        last_error = None
+        while order:
+            provider = order.pop(0)
+            primary = self._pool.submit(self._call, provider, contents, system) if self.hedge and order else None
+            if primary is None:
+                try:
+                    return self._call(provider, contents, system)
+                except Exception as e:
+                    last_error = e
+                    self._failed(provider, e, order)
+                    continue
+            done, _ = wait([primary], timeout=self._hedge_after(provider))
+            if done:
+                try:
+                    return primary.result()
+                except Exception as e:
+                    last_error = e
+                    self._failed(provider, e, order)
+                    continue
+            backup_provider = order[0]
+            backup = self._pool.submit(self._call, backup_provider, contents, system)
+            if backup is None:
+                # No thread free for the hedge: keep waiting on the primary alone
+                pending = {primary: provider}
+            else:
+                order.pop(0)
+                self.stats_by_provider[backup_provider.name].hedges.inc()
+                pending = {primary: provider, backup: backup_provider}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished_provider = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        last_error = e
+                        self._failed(finished_provider, e, order or pending)
+                        continue
+                    if future is backup:
+                        self.stats_by_provider[backup_provider.name].hedge_wins.inc()
+                    # The slower call finishes in the background and still updates its provider's stats
+                    return response
+        self.exhausted.inc()
+        raise last_error
+
+    async def generate_async(self, contents, system=None):
+        order = self.ranked()
+        last_error = None
+        tasks = []
+        try:
+            while order:
+                provider = order.pop(0)
+                primary = asyncio.ensure_future(self._call_async(provider, contents, system))
+                tasks.append(primary)
+                timeout = self._hedge_after(provider) if self.hedge and order else None
+                done, _ = await asyncio.wait([primary], timeout=timeout)
+                if done:
+                    try:
+                        return primary.result()
+                    except Exception as e:
+                        last_error = e
+                        self._failed(provider, e, order)
+                        continue
+                backup_provider = order.pop(0)
+                self.stats_by_provider[backup_provider.name].hedges.inc()
+                backup = asyncio.ensure_future(self._call_async(backup_provider, contents, system))
+                tasks.append(backup)
+                pending = {primary: provider, backup: backup_provider}
+                while pending:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        finished_provider = pending.pop(task)
+                        try:
+                            response = task.result()
+                        except Exception as e:
+                            last_error = e
+                            self._failed(finished_provider, e, order or pending)
+                            continue
+                        if task is backup:
+                            self.stats_by_provider[backup_provider.name].hedge_wins.inc()
+                        return response
+            self.exhausted.inc()
+            raise last_error
+        finally:
+            # The losing call of a hedge, or every call when the caller was cancelled (e.g. by its deadline)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stream(self, contents, system=None):
+        """Stream from the best provider; fails over only until the first chunk has been sent"""
+        last_error = None
+        for provider in self.ranked():
+            started = time.perf_counter()
+            sent = False
+            try:
+                for text in provider.stream(contents, system):
+                    sent = True
+                    yield text
+                self._record(provider, started, True)
+                return
+            except Exception as e:
+                self._record(provider, started, False)
+                if sent:
+                    raise
+                last_error = e
+                self._failed(provider, e, True)
+        self.exhausted.inc()
+        raise last_error
+
+    async def stream_async(self, contents, system=None):
+        last_error = None
+        for provider in self.ranked():
+            started = time.perf_counter()
+            sent = False
+            try:
+                async for text in provider.stream_async(contents, system):
+                    sent = True
+                    yield text
+                self._record(provider, started, True)
+                return
+            except Exception as e:
+                self._record(provider, started, False)
+                if sent:
+                    raise
+                last_error = e
+                self._failed(provider, e, True)
+        self.exhausted.inc()
+        raise last_error
+
+    def stats(self):
+        return {
+            "providers": {name: stats.snapshot() for name, stats in self.stats_by_provider.items()},
+            "order": [provider.name for provider in self.ranked()],
+            "hedge": self.hedge,
+            "hedge_pool": self._pool.stats() if self._pool else None,
+            "failovers": self.failovers.value,
+            "exhausted": self.exhausted.value
+        }
+
+
+class _AsyncChunks:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        async for text in self.chunks:
+            yield LLMResponse(text)
+
+
+class RoutedModel:
+    """genai.GenerativeModel-compatible view of a router with an optional bound system text"""
+
+    def __init__(self, router, system=None):
+        self.router = router
+        self.system = system
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        if stream:
+            return (LLMResponse(text) for text in self.router.stream(contents, self.system))
+        return self.router.generate(contents, self.system)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        if stream:
+            return _AsyncChunks(self.router.stream_async(contents, self.system))
+        return await self.router.generate_async(contents, self.system)
+
+
+def create_router(names, gemini_model, gemini_api_key=None, gemini_api_url=GEMINI_API_URL, cohere_api_key=None,
+                  cohere_model='command', pool_size=10, **kwargs):
+    """Build a router from provider names: gemini, gemini_rest, cohere"""
+    providers = []
+    for name in names:
+        if name == 'gemini':
+            providers.append(GeminiSDKProvider(gemini_model))
+        elif name == 'gemini_rest':
+            providers.append(GeminiRESTProvider(gemini_api_key, gemini_model, api_url=gemini_api_url,
+                                                pool_size=pool_size))
+        elif name == 'cohere':
+            if not cohere_api_key:
+                raise RuntimeError('The cohere provider requires COHERE_API_KEY')
+            providers.append(CohereProvider(cohere_api_key, cohere_model))
+        else:
+            raise ValueError(f"Unknown LLM provider: {name}")
+    return LLMRouter(providers, **kwargs)
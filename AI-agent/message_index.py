@@ -0,0 +1,335 @@
+"""
+Queries over the daily message logs without reading whole files.
+
+tail_lines reads the last lines of a file by seeking backwards from the
+end in fixed-size blocks, so the cost depends on how much is returned
+rather than on the file size.
+
+MessageLogIndex keeps a SQLite sidecar index with one row per log line:
+the day and byte offset of the line, plus the fields used for filtering.
+Log files are append-only, so the index catches up lazily before each
+query by reading only the bytes written since the last recorded offset.
+Matching lines are then read back with a seek each. A running count of
+the lines indexed per file is kept next to the offset, so counting a
+day's messages doesn't scan its rows.
+
+LineCounter counts the lines of an append-only file the same way: only
+the bytes written since the last call are read.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+_DAY = re.compile(r'(\d{8})\.log$')
+INDEX_BATCH_SIZE = 10000
+
+
+def tail_lines(path, count, block_size=65536):
+    """Return up to `count` (offset, line) pairs from the end of a file, oldest first"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        position = end
+        buffer = b''
+        # Read blocks backwards until the buffer holds count complete lines
+        while position > 0 and buffer.count(b'\n') <= count:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            buffer = f.read(step) + buffer
+
+    lines = buffer.split(b'\n')
+    if buffer.endswith(b'\n'):
+        lines.pop()
+    # The first piece is a partial line unless we reached the start of the file
+    offset = position
+    result = []
+    for index, line in enumerate(lines):
+        if index > 0 or position == 0:
+            result.append((offset, line.decode('utf-8', errors='replace')))
+        offset += len(line) + 1
+    return result[-count:] if count else []
+
+
+class LineCounter:
+    """Line counts of append-only files, updated from the bytes appended since the last call"""
+
+    def __init__(self, block_size=1024 * 1024):
+        self.block_size = block_size
+        # path -> (bytes counted, lines in them)
+        self._counted = {}
+        self._lock = threading.Lock()
+
+    def count(self, path):
+        with self._lock:
+            size = os.path.getsize(path)
+            offset, lines = self._counted.get(path, (0, 0))
+            if size < offset:
+                # The file was replaced or truncated: count it again
+                offset, lines = 0, 0
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                while offset < size:
+                    block = f.read(min(self.block_size, size - offset))
+                    if not block:
+                        break
+                    lines += block.count(b'\n')
+                    offset += len(block)
+            self._counted[path] = (offset, lines)
+            return lines
+
+
+def encode_cursor(day, offset):
+    return f"{day}:{offset}"
+
+
+def decode_cursor(cursor):
+    day, offset = cursor.split(':', 1)
+    return day, int(offset)
+
+
+def _day_bound(value):
+    """'2024-05-01' or '2024-05-01T10:00:00' -> '20240501'"""
+    return value[:10].replace('-', '')
+
+
+class MessageLogIndex:
+    """SQLite index over messages_YYYYMMDD.log files, caught up incrementally"""
+
+    def __init__(self, directory='.', prefix='messages_', index_path=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.index_path = index_path or os.path.join(directory, 'message_index.db')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._catching_up = False
+        conn = self._conn()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS message_index (
+                    day TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    timestamp TEXT,
+                    phone_number TEXT,
+                    business_id TEXT,
+                    direction TEXT,
+                    PRIMARY KEY (day, offset)
+                ) WITHOUT ROWID
+            ''')
+            # direction only has two values, so it is filtered on the primary key order instead
+            for column in ('phone_number', 'business_id'):
+                conn.execute(f'''
+                    CREATE INDEX IF NOT EXISTS idx_message_index_{column}
+                    ON message_index ({column}, day, offset)
+                ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS message_files (
+                    day TEXT PRIMARY KEY,
+                    indexed_offset INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    lines INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(message_files)')]
+            if 'lines' not in columns:
+                # Index written before line counts were kept: count what it holds once
+                conn.execute('ALTER TABLE message_files ADD COLUMN lines INTEGER NOT NULL DEFAULT 0')
+                conn.execute('''
+                    UPDATE message_files SET lines = (
+                        SELECT COUNT(*) FROM message_index WHERE message_index.day = message_files.day
+                    )
+                ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def path(self, day):
+        return os.path.join(self.directory, f"{self.prefix}{day}.log")
+
+    def days(self, since_day=None, until_day=None):
+        """Days that have a log file, oldest first, optionally limited to a range"""
+        days = []
+        for name in os.listdir(self.directory or '.'):
+            if not name.startswith(self.prefix):
+                continue
+            match = _DAY.search(name)
+            if not match:
+                continue
+            day = match.group(1)
+            if (since_day and day < since_day) or (until_day and day > until_day):
+                continue
+            days.append(day)
+        return sorted(days)
+
+    def catch_up(self, day):
+        """Index lines appended to one day's file since the last call; returns lines added"""
+        path = self.path(day)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+        conn = self._conn()
+        row = conn.execute('SELECT indexed_offset FROM message_files WHERE day = ?', (day,)).fetchone()
+        offset = row[0] if row else 0
+        if size < offset:
+            # The file was replaced or truncated: rebuild this day
+            with conn:
+                conn.execute('DELETE FROM message_index WHERE day = ?', (day,))
+                conn.execute('UPDATE message_files SET indexed_offset = 0, lines = 0 WHERE day = ?', (day,))
+            offset = 0
+        if size == offset:
+            return 0
+
+        added = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                rows = []
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # A write in progress; pick it up next time
+                        break
+                    length = len(line)
+                    try:
+                        entry = _loads(line)
+                    except ValueError:
+                        offset += length
+                        continue
+                    rows.append((
+                        day, offset, length - 1,
+                        entry.get('timestamp'), entry.get('phone_number'),
+                        entry.get('business_id'), entry.get('direction')
+                    ))
+                    offset += length
+                    if len(rows) >= INDEX_BATCH_SIZE:
+                        break
+                with conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    # Rows another worker indexed first are ignored, and so not counted twice
+                    inserted = conn.executemany(
+                        'INSERT OR IGNORE INTO message_index VALUES (?, ?, ?, ?, ?, ?, ?)', rows
+                    ).rowcount if rows else 0
+                    conn.execute('''
+                        INSERT INTO message_files (day, indexed_offset, size, lines) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(day) DO UPDATE SET
+                            indexed_offset = MAX(indexed_offset, excluded.indexed_offset),
+                            size = excluded.size,
+                            lines = lines + excluded.lines
+                    ''', (day, offset, size, inserted))
+                added += len(rows)
+                if len(rows) < INDEX_BATCH_SIZE:
+                    return added
+                f.seek(offset)
+
+    def query(self, limit=20, cursor=None, since=None, until=None, phone_number=None, business_id=None,
+              direction=None):
+        """Return (messages oldest first, cursor for the previous page or None)"""
+        since_day = _day_bound(since) if since else None
+        until_day = _day_bound(until) if until else None
+        for day in self.days(since_day, until_day):
+            self.catch_up(day)
+
+        clauses, params = [], []
+        for column, value in (('phone_number', phone_number), ('business_id', business_id),
+                              ('direction', direction)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since_day:
+            clauses.append("day >= ?")
+            params.append(since_day)
+            if len(since) > 10:
+                clauses.append("timestamp >= ?")
+                params.append(since)
+        if until_day:
+            clauses.append("day <= ?")
+            params.append(until_day)
+            if len(until) > 10:
+                clauses.append("timestamp <= ?")
+                params.append(until)
+        if cursor:
+            clauses.append("(day, offset) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(f'''
+            SELECT day, offset, length FROM message_index {where}
+            ORDER BY day DESC, offset DESC LIMIT ?
+        ''', (*params, limit + 1)).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        messages = self._read(rows)
+        next_cursor = encode_cursor(rows[-1][0], rows[-1][1]) if has_more else None
+        messages.reverse()
+        return messages, next_cursor
+
+    def count(self, day):
+        """Lines indexed for one day; when the file has grown, the index catches up in the background"""
+        row = self._conn().execute('SELECT lines, indexed_offset FROM message_files WHERE day = ?', (day,)).fetchone()
+        lines, offset = row or (0, 0)
+        try:
+            if os.path.getsize(self.path(day)) != offset:
+                self._catch_up_in_background(day)
+        except FileNotFoundError:
+            pass
+        return lines
+
+    def _catch_up_in_background(self, day):
+        with self._lock:
+            if self._catching_up:
+                return
+            self._catching_up = True
+
+        def run():
+            try:
+                self.catch_up(day)
+            except Exception as e:
+                logger.error(f"Error indexing message log {day}: {str(e)}")
+            finally:
+                self._catching_up = False
+
+        threading.Thread(target=run, name="message-index", daemon=True).start()
+
+    def _read(self, rows):
+        messages = []
+        files = {}
+        try:
+            for day, offset, length in rows:
+                f = files.get(day)
+                if f is None:
+                    f = files[day] = open(self.path(day), 'rb')
+                f.seek(offset)
+                messages.append(_loads(f.read(length)))
+        finally:
+            for f in files.values():
+                f.close()
+        return messages
+
+    def stats(self):
+        conn = self._conn()
+        files = conn.execute('SELECT day, indexed_offset, size, lines FROM message_files ORDER BY day').fetchall()
+        return {
+            "index_path": self.index_path,
+            "files": [{"day": day, "indexed_bytes": indexed, "size": size, "lines": lines}
+                      for day, indexed, size, lines in files]
+        }
@@ -0,0 +1,192 @@
+"""
+Off-request-path logging.
+
+MessageLogWriter replaces the open/append/close of messages_YYYYMMDD.log
+on every message with a bounded queue drained by one background thread.
+The thread writes whatever has queued up as a single batch through one
+file handle per day, reopening it when the date changes. Entries are
+encoded with orjson when it is installed.
+
+start_queue_logging moves the application log handlers behind a
+QueueHandler so logger calls on the request path only enqueue records.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import Counter, Histogram
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def dumps(entry):
+    """Serialize a log entry to one line of JSON, with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(entry).decode('utf-8')
+    return json.dumps(entry, ensure_ascii=False)
+
+
+def daily_log_path(directory, prefix, day=None):
+    return os.path.join(directory, f"{prefix}{(day or datetime.now()).strftime('%Y%m%d')}.log")
+
+
+class MessageLogWriter:
+    """Append JSON lines to a daily log file from a background thread"""
+
+    def __init__(self, directory='.', prefix='messages_', background=True, batch_size=256, queue_size=10000,
+                 flush_interval=0.05):
+        self.directory = directory
+        self.prefix = prefix
+        self.background = background
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._file = None
+        self._day = None
+        self._thread = None
+
+        self.written = Counter()
+        self.dropped = Counter()
+        self.batches = Counter()
+        self.batch_latency = Histogram()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if background:
+            self._thread = threading.Thread(target=self._run, name="message-log-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def path(self, day=None):
+        return daily_log_path(self.directory, self.prefix, day)
+
+    def write(self, entry):
+        """Queue one entry; returns False if it was dropped because the queue is full"""
+        line = dumps(entry) + "\n"
+        if not self.background:
+            self._write_lines([line])
+            return True
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            self.dropped.inc()
+            return False
+
+    def _handle(self):
+        """Current day's file, reopened when the date rolls over"""
+        day = datetime.now().strftime('%Y%m%d')
+        if day != self._day:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path(), 'a', encoding='utf-8')
+            self._day = day
+        return self._file
+
+    def _write_lines(self, lines):
+        started = time.perf_counter()
+        with self._lock:
+            f = self._handle()
+            f.write(''.join(lines))
+            f.flush()
+        self.written.inc(len(lines))
+        self.batches.inc()
+        self.batch_latency.observe(time.perf_counter() - started)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            # Let entries accumulate so the thread wakes (and takes the GIL) once per batch, not per entry
+            if self.flush_interval:
+                time.sleep(self.flush_interval)
+            lines = []
+            # Take everything that queued up while the last batch was being written
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    lines.append(item)
+                if stopping or len(lines) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if lines:
+                try:
+                    self._write_lines(lines)
+                except Exception as e:
+                    self.dropped.inc(len(lines))
+                    logger.error(f"Error writing message log: {str(e)}")
+            for _ in range(len(lines) + stopping):
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued entry has been written"""
+        if self.background:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._day = None
+
+    def stats(self):
+        return {
+            "background": self.background,
+            "path": self.path(),
+            "queued": self._queue.qsize(),
+            "written": self.written.value,
+            "dropped": self.dropped.value,
+            "batches": self.batches.value,
+            "avg_batch_size": round(self.written.value / self.batches.value, 2) if self.batches.value else 0.0,
+            "batch_latency": self.batch_latency.snapshot(),
+            "encoder": "orjson" if orjson is not None else "json"
+        }
+
+
+class _RecordQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread when it is safe to"""
+
+    def prepare(self, record):
+        # Records without args or exception info can be passed on as-is; the default
+        # prepare() formats every record on the caller's thread
+        if record.args or record.exc_info:
+            return super().prepare(record)
+        return record
+
+
+def start_queue_logging(handlers, level=logging.INFO):
+    """Route the root logger through a queue; `handlers` run on a background listener thread"""
+    log_queue = queue.Queue(-1)
+    root = logging.getLogger()
+    root.setLevel(level)
+    # A queue installed before a fork has no listener left in the child
+    for handler in [handler for handler in root.handlers if isinstance(handler, _RecordQueueHandler)]:
+        root.removeHandler(handler)
+    root.addHandler(_RecordQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,120 @@
+"""
+Reusable Gemini model instances.
+
+Builds one GenerativeModel per business (and one for the FAQ preamble)
+instead of one per request, together with the rendered business context.
+When the installed SDK supports `system_instruction` the context is bound
+to the model once; otherwise callers send it as the opening turn. The FAQ
+preamble can additionally be stored provider-side with Gemini context
+caching when the SDK exposes `genai.caching`.
+
+With an LLMRouter the registry hands out RoutedModel views instead, which
+pass the context to whichever provider serves the call.
+"""
+
+import datetime
+import inspect
+import logging
+import threading
+
+from config_cache import ConfigCache
+from llm_providers import RoutedModel
+
+logger = logging.getLogger(__name__)
+
+FAQ_KEY = '__faq__'
+DEFAULT_KEY = '__default__'
+
+
+class ModelRegistry:
+    def __init__(self, model_name, maxsize=1000, faq_cache_ttl=None, router=None):
+        self.model_name = model_name
+        self.faq_cache_ttl = faq_cache_ttl
+        self.router = router
+        self.genai = None
+        if router is None:
+            import google.generativeai as genai
+            self.genai = genai
+        # Every provider behind the router takes the context as a system text
+        self.supports_system_instruction = router is not None or \
+            'system_instruction' in inspect.signature(self.genai.GenerativeModel).parameters
+        # key -> (source object, system text, model)
+        self._entries = ConfigCache(maxsize, ttl=None)
+        self._lock = threading.Lock()
+        self._cached_content = None
+
+    def _build(self, system_text):
+        if self.router is not None:
+            return RoutedModel(self.router, system_text)
+        if self.supports_system_instruction:
+            return self.genai.GenerativeModel(self.model_name, system_instruction=system_text)
+        return self.genai.GenerativeModel(self.model_name)
+
+    def default_model(self):
+        """Model with no bound context, for auxiliary calls like history summaries"""
+        entry = self._entries.get(DEFAULT_KEY)
+        if entry is None:
+            if self.router is not None:
+                model = RoutedModel(self.router)
+            else:
+                model = self.genai.GenerativeModel(self.model_name)
+            entry = (None, None, model)
+            self._entries.set(DEFAULT_KEY, entry)
+        return entry[2]
+
+    def for_business(self, business_id, business_config, build_context):
+        """Return (model, context_turn); context_turn is None when bound as a system instruction"""
+        key = business_id or ''
+        # A reloaded config is a new dict object, so identity tells us when to rebuild
+        entry = self._entries.get(key, current=lambda entry: entry[0] is business_config)
+        if entry is None:
+            context = build_context(business_config)
+            entry = (business_config, context, self._build(context))
+            self._entries.set(key, entry)
+        _, context, model = entry
+        return model, None if self.supports_system_instruction else context
+
+    def faq_model(self, preamble):
+        """Return (model, preamble_turn) for FAQ questions"""
+        entry = self._entries.get(FAQ_KEY, current=lambda entry: entry[0] is preamble)
+        if entry is None:
+            model = self._cached_faq_model(preamble) or self._build(preamble)
+            bound = self._cached_content is not None or self.supports_system_instruction
+            entry = (preamble, None if bound else preamble, model)
+            self._entries.set(FAQ_KEY, entry)
+        _, preamble_turn, model = entry
+        return model, preamble_turn
+
+    def _cached_faq_model(self, preamble):
+        """Store the FAQ preamble with Gemini context caching, if enabled and available"""
+        if not self.faq_cache_ttl or self.router is not None:
+            return None
+        caching = getattr(self.genai, 'caching', None)
+        if caching is None:
+            logger.warning("FAQ context caching requested but this google-generativeai version has no genai.caching")
+            return None
+        try:
+            with self._lock:
+                self._cached_content = caching.CachedContent.create(
+                    model=self.model_name,
+                    system_instruction=preamble,
+                    ttl=datetime.timedelta(seconds=self.faq_cache_ttl)
+                )
+            return self.genai.GenerativeModel.from_cached_content(self._cached_content)
+        except Exception as e:
+            # Small prompts are below the provider's minimum cacheable size
+            logger.warning(f"FAQ context caching unavailable, sending preamble inline: {str(e)}")
+            self._cached_content = None
+            return None
+
+    def invalidate(self, business_id):
+        return self._entries.invalidate(business_id or '')
+
+    def stats(self):
+        return {
+            "models": len(self._entries),
+            "system_instruction": self.supports_system_instruction,
+            "faq_context_cached": self._cached_content is not None,
+            "routed": self.router is not None,
+            "cache": self._entries.stats()
+        }
@@ -0,0 +1,108 @@
+"""
+Minimal Redis (RESP2) client.
+
+Only what the agent's shared-state layers need: single commands and
+pipelines over a small pool of blocking sockets. Works against any server
+that speaks the Redis protocol (Redis, KeyDB, Dragonfly, or a local fake).
+"""
+
+import queue
+import socket
+from urllib.parse import urlparse
+
+
+class RedisError(Exception):
+    """Error reply from the server"""
+
+
+class RedisClient:
+    def __init__(self, url='redis://localhost:6379/0', pool_size=8, timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile('rb'))
+        if self.password:
+            self._roundtrip(conn, [('AUTH', self.password)])
+        if self.db:
+            self._roundtrip(conn, [('SELECT', self.db)])
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn[0].close()
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            else:
+                data = str(arg).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(out)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError('Redis connection closed')
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b'+':
+            return rest.decode()
+        if prefix == b'-':
+            return RedisError(rest.decode())
+        if prefix == b':':
+            return int(rest)
+        if prefix == b'$':
+            length = int(rest)
+            if length == -1:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if prefix == b'*':
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self._read_reply(reader) for _ in range(length)]
+        raise RedisError(f'Unknown reply type: {line!r}')
+
+    def _roundtrip(self, conn, commands):
+        sock, reader = conn
+        sock.sendall(b''.join(self._encode(command) for command in commands))
+        return [self._read_reply(reader) for _ in commands]
+
+    def pipeline(self, commands):
+        """Send several commands in one round-trip and return all replies"""
+        conn = self._acquire()
+        try:
+            replies = self._roundtrip(conn, commands)
+        except Exception:
+            conn[0].close()
+            raise
+        self._release(conn)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def ping(self):
+        return self.execute('PING') == 'PONG'
@@ -0,0 +1,162 @@
+"""
+Out-of-band reply delivery for the Twilio webhook.
+
+When async replies are enabled the webhook only enqueues the incoming
+message and acknowledges Twilio with an empty TwiML document. A bounded
+pool of worker threads generates the AI reply and delivers it through
+Twilio's REST Messages API.
+
+The queue lives in memory by default. With a sqlite:// URL it is the
+durable InboundQueue (see inbound_queue.py), which survives restarts and
+drops Twilio's retries of a message it already has.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+import requests
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+EMPTY_TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response />'
+
+
+class TwilioReplySender:
+    """Send WhatsApp/SMS replies through the Twilio REST API"""
+
+    def __init__(self, account_sid, auth_token, api_url='https://api.twilio.com', timeout=(3.05, 10)):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        self.send_latency = Histogram()
+
+    def send(self, to_number, from_number, body):
+        """Create an outbound message and return its SID"""
+        url = f"{self.api_url}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                url,
+                data={"To": to_number, "From": from_number, "Body": body},
+                timeout=self.timeout
+            )
+        finally:
+            self.send_latency.observe(time.perf_counter() - started)
+
+        if response.status_code not in (200, 201):
+            raise RuntimeError(f"Twilio send failed: {response.status_code} - {response.text}")
+        return response.json().get('sid')
+
+
+class ReplyDispatcher:
+    """Bounded queue drained by a fixed pool of worker threads"""
+
+    def __init__(self, handler, sender, workers=4, queue_size=100):
+        self.handler = handler
+        self.sender = sender
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = []
+
+        self.submitted = Counter()
+        self.rejected = Counter()
+        self.completed = Counter()
+        self.failed = Counter()
+        self.in_flight = Gauge()
+        self.queue_wait = Histogram()
+        self.processing_time = Histogram()
+        self.end_to_end = Histogram()
+
+        for index in range(workers):
+            worker = threading.Thread(target=self._run, name=f"reply-worker-{index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, business_id, from_number, to_number, message, message_sid=None):
+        """Enqueue a message; returns False when the queue is full. The in-memory queue doesn't deduplicate"""
+        job = {
+            "business_id": business_id,
+            "from_number": from_number,
+            "to_number": to_number,
+            "message": message,
+            "enqueued_at": time.perf_counter()
+        }
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.rejected.inc()
+            return False
+        self.submitted.inc()
+        return True
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+            started = time.perf_counter()
+            self.queue_wait.observe(started - job["enqueued_at"])
+            self.in_flight.inc()
+            try:
+                ai_response = self.handler(
+                    job["business_id"], job["from_number"], job["to_number"], job["message"]
+                )
+                # Reply goes back to the sender from the number they wrote to
+                self.sender.send(job["from_number"], job["to_number"], ai_response)
+                self.completed.inc()
+            except Exception as e:
+                self.failed.inc()
+                logger.error(f"Error delivering async reply to {job['from_number']}: {str(e)}")
+            finally:
+                finished = time.perf_counter()
+                self.processing_time.observe(finished - started)
+                self.end_to_end.observe(finished - job["enqueued_at"])
+                self.in_flight.dec()
+                self.queue.task_done()
+
+    def join(self):
+        """Block until every queued job has been processed"""
+        self.queue.join()
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "workers": len(self.workers),
+            "in_flight": self.in_flight.value,
+            "submitted": self.submitted.value,
+            "rejected": self.rejected.value,
+            "completed": self.completed.value,
+            "failed": self.failed.value,
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+            "processing_seconds": self.processing_time.snapshot(),
+            "end_to_end_seconds": self.end_to_end.snapshot(),
+            "twilio_send_seconds": self.sender.send_latency.snapshot()
+        }
+
+
+def create_reply_dispatcher(url, handler, sender, workers=4, queue_size=100, **queue_options):
+    """Build a dispatcher whose queue is in memory (memory://) or durable (sqlite:///path/to.db)
+
+    queue_options (lease, max_attempts, retry_backoff, retention, ...) configure the durable queue.
+    """
+    if url.startswith('sqlite://'):
+        from inbound_queue import DurableReplyDispatcher, InboundQueue
+        inbound_queue = InboundQueue(url[len('sqlite:///'):] or 'inbound_queue.db', **queue_options)
+        return DurableReplyDispatcher(handler, sender, inbound_queue, workers=workers, queue_size=queue_size)
+    if url.startswith('memory://'):
+        return ReplyDispatcher(handler, sender, workers=workers, queue_size=queue_size)
+    raise ValueError(f"Unsupported ASYNC_REPLY_QUEUE_URL: {url}")
@@ -0,0 +1,185 @@
+"""
+Two-tier cache for LLM answers to repeated questions.
+
+Tier 1 is an exact match on normalized text. Tier 2 is a TF-IDF cosine
+similarity search over the cached questions of the same namespace
+(one namespace per business, plus one for the shared FAQ), with a
+tunable threshold. Entries expire after a TTL and each namespace is
+LRU-capped.
+"""
+
+import math
+import re
+import threading
+import time
+from collections import Counter as TermCounter
+from collections import OrderedDict
+
+from metrics import Counter
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+STOPWORDS = frozenset(
+    "a an the is are am do does i you your we our to of for in on and or my me it can how what "
+    "hi hello hey please thanks thank".split()
+)
+
+
+def normalize(text):
+    return _WHITESPACE.sub(' ', _PUNCTUATION.sub(' ', text.lower())).strip()
+
+
+def tokenize(normalized):
+    return [token for token in normalized.split() if token not in STOPWORDS]
+
+
+class _Entry:
+    __slots__ = ('answer', 'expires_at', 'terms')
+
+    def __init__(self, answer, expires_at, terms):
+        self.answer = answer
+        self.expires_at = expires_at
+        self.terms = terms
+
+
+class _Namespace:
+    """Cached questions for one business with an inverted index over terms"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.postings = {}
+        self.document_frequency = TermCounter()
+
+    def add(self, key, entry):
+        self.remove(key)
+        self.entries[key] = entry
+        for term in entry.terms:
+            self.postings.setdefault(term, set()).add(key)
+            self.document_frequency[term] += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        for term in entry.terms:
+            keys = self.postings.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[term]
+            self.document_frequency[term] -= 1
+            if self.document_frequency[term] <= 0:
+                del self.document_frequency[term]
+        return entry
+
+    def _idf(self, term, total):
+        return math.log(total / (1 + self.document_frequency.get(term, 0))) + 1.0
+
+    def most_similar(self, terms, top_k=5):
+        """Return (key, cosine) of the best-matching cached question"""
+        total = len(self.entries) + 1
+        idf = {term: self._idf(term, total) for term in terms}
+        query = {term: count * idf[term] for term, count in terms.items()}
+        query_norm = math.sqrt(sum(weight * weight for weight in query.values()))
+        if not query_norm:
+            return None, 0.0
+
+        # Accumulate dot products over posting lists, skipping terms common to most entries
+        max_posting = max(32, len(self.entries) // 2)
+        dots = {}
+        for term, weight in query.items():
+            keys = self.postings.get(term)
+            if not keys or len(keys) > max_posting:
+                continue
+            for key in keys:
+                dots[key] = dots.get(key, 0.0) + weight * self.entries[key].terms[term] * idf[term]
+        if not dots:
+            return None, 0.0
+
+        best_key, best_score = None, 0.0
+        for key in sorted(dots, key=dots.get, reverse=True)[:top_k]:
+            document = self.entries[key].terms
+            norm = math.sqrt(sum((count * self._idf(term, total)) ** 2 for term, count in document.items()))
+            score = dots[key] / (norm * query_norm) if norm else 0.0
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key, best_score
+
+
+class ResponseCache:
+    def __init__(self, maxsize_per_namespace=1000, ttl=3600.0, similarity_threshold=0.85, similarity=True):
+        self.maxsize = maxsize_per_namespace
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.similarity = similarity
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+        self.exact_hits = Counter()
+        self.similar_hits = Counter()
+        self.misses = Counter()
+        self.evictions = Counter()
+        self.expirations = Counter()
+
+    def _alive(self, namespace, key, now):
+        entry = namespace.entries.get(key)
+        if entry is None:
+            return None
+        if now >= entry.expires_at:
+            namespace.remove(key)
+            self.expirations.inc()
+            return None
+        namespace.entries.move_to_end(key)
+        return entry
+
+    def get(self, namespace_name, question):
+        """Return (answer, tier) where tier is 'exact' or 'similar', or None on a miss"""
+        key = normalize(question)
+        now = time.monotonic()
+        with self._lock:
+            namespace = self._namespaces.get(namespace_name)
+            if namespace is not None:
+                entry = self._alive(namespace, key, now)
+                if entry is not None:
+                    self.exact_hits.inc()
+                    return entry.answer, 'exact'
+
+                if self.similarity:
+                    match, score = namespace.most_similar(TermCounter(tokenize(key)))
+                    if match is not None and score >= self.similarity_threshold:
+                        entry = self._alive(namespace, match, now)
+                        if entry is not None:
+                            self.similar_hits.inc()
+                            return entry.answer, 'similar'
+            self.misses.inc()
+            return None
+
+    def put(self, namespace_name, question, answer):
+        key = normalize(question)
+        entry = _Entry(answer, time.monotonic() + self.ttl, TermCounter(tokenize(key)))
+        with self._lock:
+            namespace = self._namespaces.setdefault(namespace_name, _Namespace())
+            namespace.add(key, entry)
+            while len(namespace.entries) > self.maxsize:
+                namespace.remove(next(iter(namespace.entries)))
+                self.evictions.inc()
+
+    def invalidate(self, namespace_name):
+        with self._lock:
+            return self._namespaces.pop(namespace_name, None) is not None
+
+    def stats(self):
+        hits = self.exact_hits.value + self.similar_hits.value
+        lookups = hits + self.misses.value
+        with self._lock:
+            sizes = {name: len(namespace.entries) for name, namespace in self._namespaces.items()}
+        return {
+            "exact_hits": self.exact_hits.value,
+            "similar_hits": self.similar_hits.value,
+            "misses": self.misses.value,
+            "evictions": self.evictions.value,
+            "expirations": self.expirations.value,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "similarity_threshold": self.similarity_threshold,
+            "namespaces": sizes
+        }
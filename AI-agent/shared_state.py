@@ -0,0 +1,214 @@
+"""
+State shared by every worker and node of a scaled-out deployment.
+
+Conversation history (CONVERSATION_STORE_URL) and rate limits
+(ADMISSION_STORE_URL) already accept sqlite:// and redis:// URLs. This
+module covers business configs:
+
+- A second-level config cache: a config fetched from the backend by one
+  worker is stored here, so the others load it without calling the
+  backend. Each worker still keeps its own ConfigCache in front of it.
+- An invalidation log: /cache/invalidate on any worker appends the
+  business id, and every worker polls the log at most once per
+  `sync_interval` seconds and drops its own cached copies. A saved config
+  is therefore picked up everywhere within that interval, not only by the
+  worker the backend happened to call.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class SharedState:
+    """Config cache and invalidation log; subclasses provide the storage"""
+
+    def __init__(self, config_ttl=300.0, sync_interval=1.0):
+        self.config_ttl = config_ttl
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self._seq = self._current_seq()
+        # Sequence numbers this process published, so it doesn't apply its own invalidations twice
+        self._published = deque(maxlen=1000)
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "published": 0, "applied": 0, "syncs": 0}
+
+    def get_config(self, business_id):
+        """The shared copy of a business config, or None"""
+        raw = self._get(business_id)
+        self._stats["hits" if raw is not None else "misses"] += 1
+        return json.loads(raw) if raw is not None else None
+
+    def set_config(self, business_id, config):
+        self._set(business_id, json.dumps(config, ensure_ascii=False))
+        self._stats["stores"] += 1
+
+    def invalidate(self, business_id):
+        """Drop the shared copy and tell the other workers to drop theirs"""
+        seq = self._publish(business_id)
+        self._published.append(seq)
+        self._stats["published"] += 1
+
+    def poll(self):
+        """Business ids invalidated by other workers since the last poll (at most once per sync_interval)"""
+        now = time.monotonic()
+        if now - self._last_sync < self.sync_interval or not self._lock.acquire(blocking=False):
+            return []
+        try:
+            self._last_sync = now
+            entries = self._entries_since(self._seq)
+            self._stats["syncs"] += 1
+        except Exception as e:
+            logger.warning(f"Could not read shared invalidations: {str(e)}")
+            return []
+        finally:
+            self._lock.release()
+        business_ids = []
+        for seq, business_id in entries:
+            self._seq = max(self._seq, seq)
+            if seq not in self._published:
+                business_ids.append(business_id)
+        self._stats["applied"] += len(business_ids)
+        return business_ids
+
+    def stats(self):
+        return {**self._stats, "seq": self._seq, "config_ttl": self.config_ttl, "sync_interval": self.sync_interval}
+
+
+class SQLiteSharedState(SharedState):
+    """Shared state in a SQLite file (WAL), for the workers of one host"""
+
+    LOG_RETENTION = 3600.0
+
+    def __init__(self, path='agent_state.db', config_ttl=300.0, sync_interval=1.0):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shared_business_configs (
+                    business_id TEXT PRIMARY KEY,
+                    config TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shared_invalidations (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    business_id TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+        super().__init__(config_ttl, sync_interval)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _current_seq(self):
+        return self._conn().execute('SELECT COALESCE(MAX(seq), 0) FROM shared_invalidations').fetchone()[0]
+
+    def _get(self, business_id):
+        row = self._conn().execute(
+            'SELECT config FROM shared_business_configs WHERE business_id = ? AND expires_at > ?',
+            (business_id, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, business_id, raw):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO shared_business_configs (business_id, config, expires_at) VALUES (?, ?, ?)',
+            (business_id, raw, time.time() + self.config_ttl)
+        )
+
+    def _publish(self, business_id):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM shared_business_configs WHERE business_id = ?', (business_id,))
+            seq = conn.execute('INSERT INTO shared_invalidations (business_id, created_at) VALUES (?, ?)',
+                               (business_id, now)).lastrowid
+            conn.execute('DELETE FROM shared_invalidations WHERE created_at < ?', (now - self.LOG_RETENTION,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return seq
+
+    def _entries_since(self, seq):
+        return self._conn().execute(
+            'SELECT seq, business_id FROM shared_invalidations WHERE seq > ? ORDER BY seq', (seq,)
+        ).fetchall()
+
+    def stats(self):
+        return {**super().stats(), "url": f"sqlite:///{self.path}"}
+
+
+class RedisSharedState(SharedState):
+    """Shared state in Redis, for workers spread over several hosts"""
+
+    LOG_LENGTH = 1000
+
+    def __init__(self, client, config_ttl=300.0, sync_interval=1.0, prefix='shared:'):
+        self.client = client
+        self.prefix = prefix
+        super().__init__(config_ttl, sync_interval)
+
+    def _current_seq(self):
+        return int(self.client.execute('GET', f"{self.prefix}invalidation_seq") or 0)
+
+    def _get(self, business_id):
+        raw = self.client.execute('GET', f"{self.prefix}config:{business_id}")
+        return raw.decode('utf-8') if raw is not None else None
+
+    def _set(self, business_id, raw):
+        self.client.execute('SET', f"{self.prefix}config:{business_id}", raw, 'PX', int(self.config_ttl * 1000))
+
+    def _publish(self, business_id):
+        log_key = f"{self.prefix}invalidations"
+        seq = self.client.execute('INCR', f"{self.prefix}invalidation_seq")
+        self.client.pipeline([
+            ('DEL', f"{self.prefix}config:{business_id}"),
+            ('RPUSH', log_key, f"{seq}:{business_id}"),
+            ('LTRIM', log_key, -self.LOG_LENGTH, -1)
+        ])
+        return seq
+
+    def _entries_since(self, seq):
+        latest = self._current_seq()
+        if latest <= seq:
+            return []
+        # Read a little past the gap: concurrent publishers can push their entries out of order
+        count = min(latest - seq + 16, self.LOG_LENGTH)
+        entries = []
+        for item in self.client.execute('LRANGE', f"{self.prefix}invalidations", -count, -1) or []:
+            entry_seq, _, business_id = item.decode('utf-8').partition(':')
+            if int(entry_seq) > seq:
+                entries.append((int(entry_seq), business_id))
+        return sorted(entries)
+
+    def stats(self):
+        return {**super().stats(), "url": f"redis://{self.client.host}:{self.client.port}/{self.client.db}"}
+
+
+def create_shared_state(url='memory://', **kwargs):
+    """Build shared state from a URL: sqlite:///path/to.db or redis://host:port/db; memory:// means none"""
+    if url.startswith('sqlite://'):
+        return SQLiteSharedState(url[len('sqlite:///'):] or 'agent_state.db', **kwargs)
+    if url.startswith('redis://'):
+        from redis_client import RedisClient
+        return RedisSharedState(RedisClient(url), **kwargs)
+    if url.startswith('memory://'):
+        return None
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
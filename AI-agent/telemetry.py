@@ -0,0 +1,294 @@
+"""
+Prometheus metrics and per-request stage tracing.
+
+Metric families carry labels (endpoint, stage, business_id, ...) and are
+rendered in the Prometheus text format for GET /metrics without extra
+dependencies. business_id values past `max_businesses` are folded into
+"other" so a flood of unknown ids can't grow the series without bound.
+
+start()/finish() (or the request() context manager) bracket one webhook
+or API call: they track in-flight requests and total duration. stage()
+times one step inside the current request into
+ai_agent_stage_duration_seconds. With tracing on, each sampled request's
+stage timings are written as one JSON line to traces_YYYYMMDD.log by a
+background writer.
+"""
+
+import contextvars
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from history import estimate_tokens
+from metrics import Counter, Gauge, Histogram
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricFamily:
+    """One named metric with a child Counter/Gauge/Histogram per label combination"""
+
+    TYPES = {'counter': Counter, 'gauge': Gauge, 'histogram': Histogram}
+
+    def __init__(self, kind, name, documentation, labelnames=()):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        entry = self._children.get(values)
+        if entry is None:
+            with self._lock:
+                entry = self._children.get(values)
+                if entry is None:
+                    # Label text is formatted once per series, not on every scrape
+                    text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values))
+                    entry = self._children[values] = (self.TYPES[self.kind](), text)
+        return entry[0]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.values())
+        for child, labels in children:
+            suffix = f"{{{labels}}}" if labels else ""
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{suffix} {_format_value(child.value)}")
+                continue
+            counts, total, count = child.totals()
+            prefix = f"{self.name}_bucket{{{labels},le=" if labels else f"{self.name}_bucket{{le="
+            running = 0
+            for bound, bucket_count in zip(child.buckets + (float('inf'),), counts):
+                running += bucket_count
+                lines.append(f'{prefix}"{_format_value(float(bound))}"}} {running}')
+            lines.append(f"{self.name}_sum{suffix} {_format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metric families, rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._families = []
+
+    def _add(self, kind, name, documentation, labelnames):
+        family = MetricFamily(kind, name, documentation, labelnames)
+        self._families.append(family)
+        return family
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add('counter', name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add('gauge', name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=()):
+        return self._add('histogram', name, documentation, labelnames)
+
+    def render(self):
+        lines = []
+        for family in self._families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUESTS_IN_FLIGHT = registry.gauge(
+    'ai_agent_requests_in_flight', 'Requests currently being handled', ('endpoint', 'business_id'))
+REQUEST_SECONDS = registry.histogram(
+    'ai_agent_request_duration_seconds', 'Total time to handle a request', ('endpoint', 'business_id'))
+STAGE_SECONDS = registry.histogram(
+    'ai_agent_stage_duration_seconds', 'Time spent in each stage of a request', ('endpoint', 'stage', 'business_id'))
+LLM_TOKENS = registry.counter(
+    'ai_agent_llm_tokens_total', 'LLM tokens sent (in) and generated (out)', ('direction', 'business_id'))
+ERRORS = registry.counter(
+    'ai_agent_errors_total', 'Errors by exception type', ('endpoint', 'type', 'business_id'))
+CACHE_HITS = registry.counter(
+    'ai_agent_cache_hits_total', 'Answers served from a cache or the FAQ index', ('cache', 'business_id'))
+CACHE_MISSES = registry.counter(
+    'ai_agent_cache_misses_total', 'Cache lookups that fell through to the LLM', ('cache', 'business_id'))
+
+
+class _Settings:
+    max_businesses = 1000
+    trace_writer = None
+    trace_sample_rate = 1.0
+
+
+_settings = _Settings()
+_businesses = set()
+_businesses_lock = threading.Lock()
+
+
+def configure(max_businesses=1000, trace_writer=None, trace_sample_rate=1.0):
+    """Set the business label cap and, to enable tracing, a MessageLogWriter for trace lines"""
+    _settings.max_businesses = max_businesses
+    _settings.trace_writer = trace_writer
+    _settings.trace_sample_rate = trace_sample_rate
+
+
+def business_label(business_id):
+    """business_id as a label value, or "other" once max_businesses distinct ids have been seen"""
+    if not business_id:
+        return ""
+    if business_id in _businesses:
+        return business_id
+    with _businesses_lock:
+        if len(_businesses) < _settings.max_businesses:
+            _businesses.add(business_id)
+            return business_id
+    return "other"
+
+
+class Trace:
+    """Labels, start time and (when sampled) stage timings of one request"""
+
+    __slots__ = ('endpoint', 'business_id', 'business', 'started', 'sampled', 'stages', 'error')
+
+    def __init__(self, endpoint, business_id=None):
+        self.endpoint = endpoint
+        self.business_id = business_id
+        self.business = business_label(business_id)
+        self.started = time.perf_counter()
+        self.sampled = _settings.trace_writer is not None and random.random() < _settings.trace_sample_rate
+        self.stages = [] if self.sampled else None
+        self.error = None
+
+    def entry(self, duration):
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "trace_id": uuid.uuid4().hex[:16],
+            "endpoint": self.endpoint,
+            "business_id": self.business_id,
+            "duration_ms": round(duration * 1000, 3),
+            "error": self.error,
+            "stages": self.stages
+        }
+
+
+def _labels():
+    trace = _current.get()
+    return ("", "") if trace is None else (trace.endpoint, trace.business)
+
+
+def current_endpoint():
+    """Endpoint label of the request being handled, or None outside one"""
+    trace = _current.get()
+    return None if trace is None else trace.endpoint
+
+
+def start(endpoint, business_id=None):
+    """Open a trace for a request on the current thread/task; pass the result to finish()"""
+    trace = Trace(endpoint, business_id)
+    REQUESTS_IN_FLIGHT.labels(endpoint, trace.business).inc()
+    return trace, _current.set(trace)
+
+
+def finish(started, error=None):
+    """Close a trace opened by start(), recording its duration and any unhandled error"""
+    trace, token = started
+    _current.reset(token)
+    duration = time.perf_counter() - trace.started
+    REQUESTS_IN_FLIGHT.labels(trace.endpoint, trace.business).dec()
+    REQUEST_SECONDS.labels(trace.endpoint, trace.business).observe(duration)
+    if error is not None:
+        ERRORS.labels(trace.endpoint, type(error).__name__, trace.business).inc()
+        trace.error = type(error).__name__
+    if trace.sampled:
+        _settings.trace_writer.write(trace.entry(duration))
+
+
+@contextmanager
+def request(endpoint, business_id=None):
+    """Trace the block as one request"""
+    started = start(endpoint, business_id)
+    try:
+        yield started[0]
+    except BaseException as e:
+        finish(started, e)
+        raise
+    else:
+        finish(started)
+
+
+def traced(endpoint, fn):
+    """Wrap fn(business_id, ...) so each call is traced as one request"""
+    def run(business_id, *args, **kwargs):
+        with request(endpoint, business_id):
+            return fn(business_id, *args, **kwargs)
+    return run
+
+
+@contextmanager
+def stage(name):
+    """Time one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        trace = _current.get()
+        if trace is None:
+            STAGE_SECONDS.labels("", name, "").observe(duration)
+        else:
+            STAGE_SECONDS.labels(trace.endpoint, name, trace.business).observe(duration)
+            if trace.sampled:
+                trace.stages.append({
+                    "stage": name,
+                    "start_ms": round((started - trace.started) * 1000, 3),
+                    "duration_ms": round(duration * 1000, 3)
+                })
+
+
+def error(exc):
+    """Count a handled exception against the current request"""
+    endpoint, business = _labels()
+    ERRORS.labels(endpoint, type(exc).__name__, business).inc()
+    trace = _current.get()
+    if trace is not None and trace.error is None:
+        trace.error = type(exc).__name__
+
+
+def cache_lookup(cache, hit):
+    """Count a cache (or FAQ index) hit or miss against the current request's business"""
+    (CACHE_HITS if hit else CACHE_MISSES).labels(cache, _labels()[1]).inc()
+
+
+def _content_text(contents):
+    if isinstance(contents, str):
+        return contents
+    return "\n".join(part if isinstance(part, str) else part.get("text", "")
+                     for content in contents for part in content.get("parts", []))
+
+
+def record_tokens(contents, text, response=None):
+    """Count LLM tokens, from usage_metadata when the SDK reports it, otherwise estimated from the text"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is not None:
+        tokens_in, tokens_out = usage.prompt_token_count, usage.candidates_token_count
+    else:
+        tokens_in, tokens_out = estimate_tokens(_content_text(contents)), estimate_tokens(text)
+    business = _labels()[1]
+    LLM_TOKENS.labels("in", business).inc(tokens_in)
+    LLM_TOKENS.labels("out", business).inc(tokens_out)
+    return tokens_in, tokens_out
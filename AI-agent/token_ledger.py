@@ -0,0 +1,272 @@
+"""
+LLM token accounting per business and endpoint, with daily budgets.
+
+record() adds one LLM call to in-memory counters keyed by (day,
+business_id, endpoint), so the request path only takes a lock and bumps
+a few integers. Every `flush_interval` seconds a background thread
+appends what was counted since the last flush to
+token_usage_YYYYMMDD.log, one JSON line per business and endpoint. It
+then reads the lines appended since its last read, its own and those of
+the other workers sharing the directory, into the day's totals.
+
+Usage and budget checks see those totals plus this process's unflushed
+counts. All workers together therefore stay within a budget up to about
+one flush interval of traffic, and a restarted process picks up the
+day's usage from the file.
+
+A budget is tokens (in + out) per business per local day: `budgets` for
+listed businesses, `default_budget` for the rest; 0 means unlimited.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from message_log import daily_log_path, dumps
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("calls", "tokens_in", "tokens_out", "estimated")
+
+
+def parse_budgets(spec):
+    """'business-1=200000,business-2=50000' -> {business_id: tokens}"""
+    budgets = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            business_id, tokens = item.split('=', 1)
+            budgets[business_id.strip()] = int(tokens)
+    return budgets
+
+
+# (local midnight as a timestamp, day it ends); formatting the date on every call costs more than the record
+_day_cache = [0.0, None]
+
+
+def _today():
+    now = time.time()
+    if now >= _day_cache[0]:
+        today = datetime.fromtimestamp(now)
+        _day_cache[0] = datetime.combine(today.date() + timedelta(days=1), datetime.min.time()).timestamp()
+        _day_cache[1] = today.strftime('%Y%m%d')
+    return _day_cache[1]
+
+
+class TokenLedger:
+    """Tokens used per business and endpoint today, shared between workers through a daily file"""
+
+    def __init__(self, directory='.', flush_interval=10.0, default_budget=0, budgets=None,
+                 prefix='token_usage_'):
+        self.directory = directory
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.default_budget = default_budget
+        self.budgets = dict(budgets or {})
+        # business_id -> (day, endpoint) -> [calls, tokens_in, tokens_out, estimated], not yet written
+        self._pending = {}
+        # Taken from _pending by a flush and still counted until the file has been read back
+        self._flushing = {}
+        # business_id -> endpoint -> [calls, tokens_in, tokens_out, estimated], read back from today's file
+        self._totals = {}
+        self._day = None
+        self._offset = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        self.flushes = Counter()
+        self.lines_written = Counter()
+        self.lines_read = Counter()
+        self.over_budget = Counter()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._read_new()
+        self._thread = None
+        if flush_interval > 0:
+            self._thread = threading.Thread(target=self._run, name="token-ledger", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def path(self, day=None):
+        return daily_log_path(self.directory, self.prefix, datetime.strptime(day, '%Y%m%d') if day else None)
+
+    def record(self, business_id, endpoint, tokens_in, tokens_out, estimated=False):
+        """Count one LLM call; `estimated` when the provider didn't report usage"""
+        key = (_today(), endpoint or 'other')
+        with self._lock:
+            business = self._pending.get(business_id)
+            if business is None:
+                business = self._pending[business_id] = {}
+            counts = business.get(key)
+            if counts is None:
+                counts = business[key] = [0, 0, 0, 0]
+            counts[0] += 1
+            counts[1] += tokens_in
+            counts[2] += tokens_out
+            counts[3] += int(estimated)
+
+    def _endpoints(self, business_id):
+        """endpoint -> counts for today, flushed by any worker plus pending here"""
+        today = _today()
+        with self._lock:
+            merged = {endpoint: list(counts) for endpoint, counts in self._totals.get(business_id, {}).items()} \
+                if self._day == today else {}
+            unflushed = [*self._pending.get(business_id, {}).items(), *self._flushing.get(business_id, {}).items()]
+            for (day, endpoint), counts in unflushed:
+                if day == today:
+                    total = merged.setdefault(endpoint, [0, 0, 0, 0])
+                    for index, value in enumerate(counts):
+                        total[index] += value
+        return merged
+
+    def used(self, business_id):
+        """Tokens (in + out) used by a business today"""
+        return sum(counts[1] + counts[2] for counts in self._endpoints(business_id).values())
+
+    def budget(self, business_id):
+        return self.budgets.get(business_id, self.default_budget)
+
+    def exhausted(self, business_id):
+        """True when the business has used up today's budget"""
+        budget = self.budget(business_id)
+        if not budget or self.used(business_id) < budget:
+            return False
+        self.over_budget.inc()
+        return True
+
+    def usage(self, business_id):
+        endpoints = self._endpoints(business_id)
+        tokens_in = sum(counts[1] for counts in endpoints.values())
+        tokens_out = sum(counts[2] for counts in endpoints.values())
+        budget = self.budget(business_id)
+        return {
+            "business_id": business_id,
+            "day": _today(),
+            "calls": sum(counts[0] for counts in endpoints.values()),
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "tokens": tokens_in + tokens_out,
+            "budget": budget or None,
+            "remaining": max(0, budget - tokens_in - tokens_out) if budget else None,
+            "endpoints": {endpoint: dict(zip(FIELDS, counts)) for endpoint, counts in sorted(endpoints.items())}
+        }
+
+    def top(self, limit=50):
+        """Businesses with the most tokens today, busiest first"""
+        today = _today()
+        with self._lock:
+            businesses = set(self._totals) if self._day == today else set()
+            businesses.update(business_id for pending in (self._pending, self._flushing)
+                              for business_id, counts in pending.items() if any(day == today for day, _ in counts))
+        used = sorted(((self.used(business_id), business_id) for business_id in businesses),
+                      key=lambda item: item[0], reverse=True)
+        return [{"business_id": business_id, "tokens": tokens, "budget": self.budget(business_id) or None}
+                for tokens, business_id in used[:limit]]
+
+    def _read_new(self):
+        """Add the lines appended to today's file since the last read to the totals"""
+        today = _today()
+        if today != self._day:
+            with self._lock:
+                self._totals = {}
+            self._day = today
+            self._offset = 0
+        try:
+            with open(self.path(today), 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line another worker is still writing is picked up on the next read
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return
+        lines = data[:end].splitlines()
+        with self._lock:
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                counts = self._totals.setdefault(entry.get("business_id"), {}).setdefault(
+                    entry.get("endpoint", "other"), [0, 0, 0, 0])
+                for index, field in enumerate(FIELDS):
+                    counts[index] += entry.get(field, 0)
+        self._offset += end
+        self.lines_read.inc(len(lines))
+
+    def flush(self):
+        """Write the pending counts, then read back every worker's lines"""
+        with self._flush_lock:
+            with self._lock:
+                pending = self._flushing = self._pending
+                self._pending = {}
+            by_day = {}
+            timestamp = datetime.now().astimezone().isoformat()
+            for business_id, business in pending.items():
+                for (day, endpoint), counts in business.items():
+                    entry = {"timestamp": timestamp, "pid": os.getpid(), "business_id": business_id,
+                             "endpoint": endpoint, **dict(zip(FIELDS, counts))}
+                    by_day.setdefault(day, []).append(dumps(entry) + "\n")
+            try:
+                for day in list(by_day):
+                    # One append per file, so lines from several workers don't interleave
+                    with open(self.path(day), 'a', encoding='utf-8') as f:
+                        f.write(''.join(by_day[day]))
+                    self.lines_written.inc(len(by_day.pop(day)))
+            except Exception:
+                # Keep the counts that didn't make it to disk for the next flush
+                with self._lock:
+                    for business_id, business in pending.items():
+                        for key, counts in business.items():
+                            if key[0] in by_day:
+                                merged = self._pending.setdefault(business_id, {}).setdefault(key, [0, 0, 0, 0])
+                                for index, value in enumerate(counts):
+                                    merged[index] += value
+                    self._flushing = {}
+                raise
+            try:
+                self._read_new()
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            self.flushes.inc()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing token usage: {str(e)}")
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing token usage: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+            businesses = len(self._totals)
+        return {
+            "path": self.path(),
+            "flush_interval": self.flush_interval,
+            "default_budget": self.default_budget or None,
+            "budgets": len(self.budgets),
+            "businesses_today": businesses,
+            "pending": pending,
+            "flushes": self.flushes.value,
+            "lines_written": self.lines_written.value,
+            "lines_read": self.lines_read.value,
+            "over_budget": self.over_budget.value
+        }
@@ -148,6 +148,54 @@ router.post('/', async (req, res) => {
   }
 })
 
+// Save a batch of conversations from the AI agent in one insert
+router.post('/bulk', async (req, res) => {
+  try {
+    const { conversations } = req.body
+
+    if (!Array.isArray(conversations) || conversations.length === 0) {
+      return res.status(400).json({ error: 'conversations must be a non-empty array' })
+    }
+    // Validate each record on its own: one bad row (e.g. a media-only message with no text)
+    // must not cost the rest of the batch. Rejected rows are reported by their index
+    const rows = []
+    const rejected = []
+    conversations.forEach((c, index) => {
+      if (!c || !c.phone_number || !c.user_message || !c.ai_response) {
+        rejected.push(index)
+        return
+      }
+      rows.push({
+        phone_number: c.phone_number,
+        user_message: c.user_message,
+        ai_response: c.ai_response,
+        business_id: c.business_id || null,
+        // Batches are written after the fact, so keep the time the message was handled
+        timestamp: c.timestamp && !isNaN(Date.parse(c.timestamp)) ? new Date(c.timestamp).toISOString() : new Date().toISOString()
+      })
+    })
+
+    if (rows.length > 0) {
+      const { error } = await supabase
+        .from('conversations')
+        .insert(rows)
+
+      if (error) {
+        console.error('Supabase bulk conversation save error:', error)
+        return res.status(500).json({ error: 'Failed to save conversations' })
+      }
+    }
+
+    if (rejected.length > 0) {
+      console.warn(`Bulk conversation save rejected ${rejected.length} of ${conversations.length} records: missing required fields`)
+    }
+    res.status(rows.length > 0 ? 201 : 200).json({ inserted: rows.length, rejected })
+  } catch (err) {
+    console.error('Bulk conversation save error:', err)
+    res.status(500).json({ error: 'Server error' })
+  }
+})
+
 // Get conversations for a business
 router.get('/business/:businessId', async (req, res) => {
   try {
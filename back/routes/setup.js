@@ -2,9 +2,20 @@ const express = require('express')
 const jwt = require('jsonwebtoken')
 const { createSetup } = require('../models/Setup')
 const router = express.Router()
+const axios = require('axios')
 const supabase = require('../supabaseClient')
 
 const JWT_SECRET = process.env.JWT_SECRET || 'changeme'
+const AI_AGENT_URL = process.env.AI_AGENT_URL || 'http://localhost:8000'
+const AI_AGENT_API_KEY = process.env.AI_AGENT_API_KEY
+
+// Tell the AI agent to drop its cached config for this business (fire-and-forget)
+function invalidateAgentConfig(businessId) {
+  axios.post(`${AI_AGENT_URL}/cache/invalidate/${businessId}`, null, {
+    headers: AI_AGENT_API_KEY ? { Authorization: `Bearer ${AI_AGENT_API_KEY}` } : {},
+    timeout: 2000
+  }).catch(err => console.error('AI agent cache invalidation failed:', err.message));
+}
 
 // Cookie-based authentication middleware
 function authMiddleware(req, res, next) {
@@ -121,6 +132,8 @@ router.post('/', authMiddleware, async (req, res) => {
       result = data;
     }
 
+    invalidateAgentConfig(result.id);
+
     res.status(201).json({
       success: true,
       business: result